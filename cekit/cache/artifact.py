@@ -1,52 +1,192 @@
-import glob
+import logging
 import os
+import re
+import stat
+import threading
+import time
 import uuid
-from typing import TYPE_CHECKING, Any, Dict, Union
-
-import yaml
+from contextlib import ExitStack
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
+from cekit.cache.index import BLOB_LAYOUT_KEY, CacheIndex
+from cekit.cache.lock import FileLock
 from cekit.cekit_types import PathType
 from cekit.config import Config
-from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, get_sum
+from cekit.crypto import (
+    READ_BUFFER_SIZE,
+    SUPPORTED_HASH_ALGORITHMS,
+    MultiHasher,
+    get_sums,
+)
 from cekit.errors import CekitError
+from cekit.parallel import RateLimiter, WorkerPool
+from cekit.tools import materialize_file
 
 if TYPE_CHECKING:
     from cekit.descriptor import Resource
 
+logger = logging.getLogger("cekit")
 CONFIG = Config()
 
+BLOBS_DIR = "blobs"
+LOCKS_DIR = "locks"
+QUARANTINE_DIR = "quarantine"
+# Algorithm of the digest used to address the cached content
+BLOB_ALGORITHM = "sha256"
+
+# Cache directories already migrated to the content-addressed layout in this process
+_migrated: Set[PathType] = set()
+_migrated_lock = threading.Lock()
+
+# When the cache exceeds the 'cache_max_size', artifacts are evicted
+# until the cache size drops to this fraction of the limit
+CACHE_LOW_WATER_MARK = 0.8
+
+# Artifacts used since the process started are never evicted automatically
+_PROCESS_START = time.time()
+_gc_lock = threading.Lock()
+
+# Blobs not referenced by the index are reported only if older than this
+# (in seconds), these may be just added to the cache by another process
+ORPHAN_BLOB_GRACE_PERIOD = 3600
+
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parses the size in bytes, optionally with a K, M, G or T (binary) unit, like '10G'.
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", str(value), re.I)
+
+    if not match:
+        raise CekitError(
+            f"Invalid size '{value}', use a number of bytes optionally followed by K, M, G or T unit"
+        )
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def parse_age(value: str) -> float:
+    """
+    Parses the age in seconds, optionally with a s, m, h, d (default) or w unit, like '30d'.
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$", str(value), re.I)
+
+    if not match:
+        raise CekitError(
+            f"Invalid age '{value}', use a number of days optionally followed by s, m, h, d or w unit"
+        )
+
+    return float(match.group(1)) * AGE_UNITS[match.group(2).lower() or "d"]
+
+
+def cache_directory() -> PathType:
+    """Returns the artifact cache directory located in the work directory"""
+    return os.path.expanduser(os.path.join(CONFIG.get("common", "work_dir"), "cache"))
+
+
+def blob_path(cache_dir: PathType, digest: str) -> PathType:
+    """
+    Returns the path of the blob with provided sha256 digest. The blob may not exist.
+    """
+    return os.path.join(cache_dir, BLOBS_DIR, BLOB_ALGORITHM, digest.lower())
+
 
 class ArtifactCache:
     """
     Represents Artifact cache for cekit. All cached resource are saved into cache subdirectory
-    of a Cekit 'work_dir'. All files are stored by random generated uuid with an yaml file
-    indexing it.
+    of a Cekit 'work_dir'. Files are content-addressed, stored once under
+    'blobs/sha256/<digest>'. Every artifact is identified by a random generated uuid
+    and indexed by all supported checksums in the cache index (see CacheIndex),
+    names of the artifact are kept as aliases.
     """
 
     def __init__(self):
-        self.cache_dir: PathType = os.path.expanduser(
-            os.path.join(CONFIG.get("common", "work_dir"), "cache")
-        )
+        self.cache_dir: PathType = cache_directory()
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
 
-    def _get_cache(self) -> Dict[str, Any]:
-        cache = {}
-        for index_file in glob.glob(os.path.join(self.cache_dir, "*.yaml")):
-            with open(index_file, "r") as file_:
-                cache[os.path.basename(index_file)] = yaml.safe_load(file_)
+        self.index: CacheIndex = CacheIndex.for_directory(self.cache_dir)
+
+        with _migrated_lock:
+            if self.cache_dir not in _migrated:
+                self._migrate()
+                _migrated.add(self.cache_dir)
+
+    def blob_path(self, digest: str) -> PathType:
+        return blob_path(self.cache_dir, digest)
+
+    def _migrate(self) -> None:
+        """
+        Moves artifacts cached by previous CEKit versions under random uuid
+        names to the content-addressed layout. Duplicates are removed.
+
+        Successful migration is recorded in the index, so that it is done once.
+        """
+        if self.index.metadata(BLOB_LAYOUT_KEY):
+            return
+
+        for artifact_id, entry in self.index.entries().items():
+            cached_path = entry["cached_path"]
+            digest = entry.get(BLOB_ALGORITHM)
+
+            if not digest:
+                if not os.path.isfile(cached_path):
+                    continue
+
+                digest = get_sums(cached_path, [BLOB_ALGORITHM])[BLOB_ALGORITHM]
+
+            blob = self.blob_path(digest)
+
+            if cached_path == blob:
+                continue
+
+            logger.debug(f"Moving cached artifact '{artifact_id}' to '{blob}'")
+
+            owner = self.index.find_id(BLOB_ALGORITHM, digest)
+
+            if owner and owner != artifact_id:
+                # Same content cached under another entry, keep it there
+                self.index.add_names(owner, entry["names"])
+                self.index.remove(artifact_id)
+            else:
+                self._store(cached_path, blob)
+                self.index.update_path(artifact_id, blob)
+
+            self.index.remove_stamps(cached_path)
 
-        return cache
+            if os.path.isfile(cached_path):
+                os.remove(cached_path)
 
-    def _update_cache(self, cache_entry: Any, artifact_id: str) -> None:
-        index_file = os.path.join(self.cache_dir, artifact_id + ".yaml")
-        tmp_cache_file = index_file + str(os.getpid())
-        with open(tmp_cache_file, "w") as file_:
-            yaml.safe_dump(cache_entry, file_)
-            os.rename(tmp_cache_file, index_file)
+        self.index.set_metadata(BLOB_LAYOUT_KEY, BLOB_ALGORITHM)
+
+    def _store(self, path: PathType, blob: PathType) -> None:
+        """Moves the file to the blob path, unless the blob exists already"""
+        if os.path.exists(blob) or not os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.rename(path, blob)
+        self._protect(blob)
 
     def list(self) -> Dict[str, Any]:
-        return self._get_cache()
+        """
+        Returns all cache entries, the key is the artifact identifier.
+        """
+        return self.index.entries()
 
     def add(self, artifact: "Resource"):
         # TODO: This line works, but it really is non-obvious why.
@@ -58,40 +198,535 @@ class ArtifactCache:
 
         artifact_id: str = str(uuid.uuid4())
 
-        artifact_file = os.path.expanduser(os.path.join(self.cache_dir, artifact_id))
-        if not os.path.exists(artifact_file):
-            artifact.guarded_copy(artifact_file)
+        incoming = self.incoming_path(artifact_id)
+
+        try:
+            if not os.path.exists(incoming):
+                artifact.guarded_copy(incoming)
+
+            # We should populate the cache entry with checksums for all supported algorithms
+            sums = self.sums(incoming, SUPPORTED_HASH_ALGORITHMS)
+
+            artifact_id = self._publish(incoming, artifact_id, [artifact["name"]], sums)
+        finally:
+            self.index.remove_stamps(os.path.abspath(incoming))
+
+            if os.path.exists(incoming):
+                os.remove(incoming)
+
+        self._enforce_max_size()
+
+        return artifact_id
+
+    def add_blobs(self, blobs: Iterable[Tuple[Dict[str, Any], IO]]) -> Tuple[int, int]:
+        """
+        Adds content of the streams to the cache. Every stream comes with the cache
+        entry describing it: names and checksums (at least sha256) of the content,
+        which is verified against all of them while it is stored. Streams with
+        content cached already are not read, their names are merged instead.
+
+        Returns the number of added and already cached artifacts.
+        """
+        added = skipped = 0
+
+        for entry, source in blobs:
+            with self.entry_lock(entry):
+                owner = self.index.find_id(BLOB_ALGORITHM, entry[BLOB_ALGORITHM])
+
+                if owner:
+                    logger.debug(
+                        f"Artifact '{', '.join(entry['names'])}' is already cached, skipping it"
+                    )
+                    self.index.add_names(owner, entry["names"])
+                    skipped += 1
+                    continue
+
+                self._add_blob(source, entry)
+
+            added += 1
+
+        self._enforce_max_size()
+
+        return added, skipped
+
+    def _add_blob(self, source: IO, entry: Dict[str, Any]) -> None:
+        artifact_id = str(uuid.uuid4())
+        incoming = self.incoming_path(artifact_id)
+        hasher = MultiHasher(SUPPORTED_HASH_ALGORITHMS)
+
+        try:
+            with open(incoming, "wb") as target:
+                while True:
+                    chunk = source.read(READ_BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    target.write(chunk)
+
+            sums = hasher.hexdigests()
+
+            for alg in SUPPORTED_HASH_ALGORITHMS:
+                if entry.get(alg) and entry[alg].lower() != sums[alg]:
+                    raise CekitError(
+                        "Artifact '{}' does not match its {} checksum".format(
+                            ", ".join(entry["names"]), alg
+                        )
+                    )
+
+            self._publish(incoming, artifact_id, entry["names"], sums)
+        finally:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+
+        logger.debug(f"Added artifact '{', '.join(entry['names'])}'")
+
+    def incoming_path(self, artifact_id: str) -> PathType:
+        """
+        Returns the path where the content of new artifact is staged before it is
+        published. It is located next to the blobs, so it can be moved in place.
+        """
+        incoming = os.path.join(self.cache_dir, BLOBS_DIR, "incoming", artifact_id)
+        os.makedirs(os.path.dirname(incoming), exist_ok=True)
+
+        return incoming
+
+    def _publish(
+        self,
+        incoming: PathType,
+        artifact_id: str,
+        names: List[str],
+        sums: Dict[str, str],
+    ) -> str:
+        """
+        Moves the staged file with provided checksums (for all supported algorithms)
+        to the blobs and adds it to the index. Returns the identifier of the entry,
+        which is the identifier of an existing entry if the same content is cached.
+        """
+        owner = self.index.find_id(BLOB_ALGORITHM, sums[BLOB_ALGORITHM])
+
+        if owner:
+            # Same content was cached in the meantime, under a different checksum
+            self.index.add_names(owner, names)
+            return owner
+
+        # Blob is published atomically, either it exists or not
+        blob = self.blob_path(sums[BLOB_ALGORITHM])
+        self._store(incoming, blob)
+        self.stamp(blob, sums)
 
         # TODO: replace this with a specific type/class
-        cache_entry = {"names": [artifact["name"]], "cached_path": artifact_file}
+        cache_entry = {"names": names, "cached_path": blob}
+        cache_entry.update(sums)
+
+        return self.index.add(artifact_id, cache_entry)
+
+    def lock(self, key: str) -> FileLock:
+        """
+        Returns the lock guarding the artifact with the key ('<algorithm>:<checksum>')
+        shared by all processes using the cache. Artifacts are fetched and added
+        to the cache while the lock is held, so that concurrent CEKit processes
+        do not fetch the same artifact.
+        """
+        return FileLock(
+            os.path.join(self.cache_dir, LOCKS_DIR, key.lower().replace(":", "-")),
+            f"artifact '{key}'",
+        )
+
+    def entry_lock(self, cache_entry: Dict[str, Any]) -> ExitStack:
+        """
+        Acquires locks for all checksums of the cache entry, no matter which
+        of them is used to refer to the artifact. Locks are acquired in the same
+        order everywhere.
+        """
+        stack = ExitStack()
+
+        for key in sorted(
+            f"{alg}:{cache_entry[alg]}"
+            for alg in SUPPORTED_HASH_ALGORITHMS
+            if cache_entry.get(alg)
+        ):
+            stack.enter_context(self.lock(key))
+
+        return stack
+
+    def touch(self, cache_entry: Dict[str, Any]) -> None:
+        """Records an access to the cached artifact"""
+        self.index.touch(cache_entry["cached_path"])
+
+    def pin(self, artifact_uuid: str, pinned: bool = True) -> None:
+        """Pins (or unpins) the artifact, pinned artifacts are never evicted"""
+        if not self.index.set_pinned(artifact_uuid, pinned):
+            raise CekitError(f"Artifact with UUID '{artifact_uuid}' is not cached.")
+
+    def size(self) -> int:
+        """Returns the total size of cached artifacts in bytes"""
+        return sum(
+            self._file_size(row["cached_path"]) for row in self.index.usage().values()
+        )
 
-        # We should populate the cache entry with checksums for all supported algorithms
+    @staticmethod
+    def _file_size(path: PathType) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def gc(
+        self,
+        max_size: Optional[int] = None,
+        max_age: Optional[float] = None,
+        used_since: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> List[str]:
+        """
+        Evicts artifacts not used for more than max_age seconds and then least recently
+        used artifacts until the cache size is at most max_size bytes. Pinned artifacts
+        and artifacts used after the used_since time are never evicted.
+
+        Returns identifiers of evicted artifacts.
+        """
+        with _gc_lock:
+            usage = self.index.usage()
+            now = time.time()
+            size = sum(self._file_size(row["cached_path"]) for row in usage.values())
+            evicted = []
+
+            # Least recently used (and least frequently used for the same time) first
+            for artifact_id, row in usage.items():
+                expired = max_age is not None and now - row["last_access"] > max_age
+                oversized = max_size is not None and size > max_size
+
+                if not (expired or oversized) or row["pinned"]:
+                    continue
+
+                if used_since is not None and row["last_access"] >= used_since:
+                    continue
+
+                logger.info(
+                    "Evicting artifact '{}' from cache, last used {}".format(
+                        artifact_id,
+                        time.strftime(
+                            "%Y-%m-%d %H:%M:%S", time.localtime(row["last_access"])
+                        ),
+                    )
+                )
+
+                size -= self._file_size(row["cached_path"])
+                evicted.append(artifact_id)
+
+                if dry_run:
+                    continue
+
+                cache_entry = self.index.get(artifact_id)
+
+                # Do not remove artifacts which are just copied by other processes
+                try:
+                    if cache_entry:
+                        with self.entry_lock(cache_entry):
+                            self.delete(artifact_id)
+                except CekitError:
+                    logger.debug(f"Artifact '{artifact_id}' was already removed")
+
+            return evicted
+
+    def _enforce_max_size(self) -> None:
+        """
+        Evicts least recently used artifacts if the cache size exceeds the
+        'cache_max_size' configuration option (the high-water mark). Artifacts
+        are evicted until the size drops below CACHE_LOW_WATER_MARK of the limit.
+        """
+        max_size = CONFIG.get("common", "cache_max_size")
+
+        if not max_size:
+            return
+
+        max_size = parse_size(max_size)
+
+        if self.size() <= max_size:
+            return
+
+        logger.info(
+            f"Artifact cache exceeds the maximum size of {max_size} bytes, evicting least recently used artifacts"
+        )
+
+        self.gc(
+            max_size=int(max_size * CACHE_LOW_WATER_MARK), used_since=_PROCESS_START
+        )
+
+    def add_alias(self, artifact: "Resource") -> None:
+        """
+        Records the name of the artifact as an alias of the cached artifact
+        with the same content.
+        """
         for alg in SUPPORTED_HASH_ALGORITHMS:
-            cache_entry.update({alg: get_sum(artifact_file, alg)})
+            if alg in artifact:
+                artifact_id = self.index.find_id(alg, artifact[alg])
 
-        self._update_cache(cache_entry, artifact_id)
-        return artifact_id
+                if artifact_id:
+                    self.index.add_names(artifact_id, [artifact["name"]])
+                    return
+
+    def find_blob(self, digest: str) -> Optional[PathType]:
+        """
+        Returns the path of the cached blob with provided sha256 digest,
+        or None if not cached. The index is not used.
+        """
+        blob = self.blob_path(digest)
+
+        if os.path.isfile(blob):
+            return blob
+
+        return None
+
+    @staticmethod
+    def _protect(artifact_file: PathType) -> None:
+        """
+        Makes the cached file read-only, so that it cannot be modified through
+        hardlinks created when materializing it in the target directory.
+        """
+        if not os.path.isfile(artifact_file):
+            return
+
+        mode = stat.S_IMODE(os.stat(artifact_file).st_mode)
+
+        if mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+            os.chmod(
+                artifact_file, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+            )
+
+    def materialize(self, cache_entry: Dict[str, Any], target: PathType) -> None:
+        """
+        Places the cached artifact at the target path. Depending on the 'materialization'
+        configuration option and the filesystem, the artifact is reflinked,
+        hardlinked or copied.
+        """
+        cached_path = cache_entry["cached_path"]
+
+        # Entries cached by previous versions of CEKit may not be protected yet
+        self._protect(cached_path)
+
+        if materialize_file(cached_path, target) != "hardlink":
+            # Reflinked or copied file is independent of the cached one, make it writable
+            # as it would be the case for any other file in the target directory
+            os.chmod(target, stat.S_IMODE(os.stat(target).st_mode) | stat.S_IWUSR)
+
+    def delete(self, artifact_uuid: str) -> None:
+        cache_entry = self.index.get(artifact_uuid)
+
+        if not cache_entry:
+            raise CekitError(f"Artifact with UUID '{artifact_uuid}' is not cached.")
+
+        self.index.remove(artifact_uuid)
+        self.index.remove_stamps(cache_entry["cached_path"])
+
+        # Blobs are shared by content, remove it only if not used anymore
+        if os.path.exists(cache_entry["cached_path"]) and not self.index.find_id(
+            BLOB_ALGORITHM, cache_entry.get(BLOB_ALGORITHM, "")
+        ):
+            os.remove(cache_entry["cached_path"])
+
+    def verify(
+        self, repair: bool = False, workers: int = 1, max_rate: Optional[int] = None
+    ) -> List[str]:
+        """
+        Checks the integrity of the cache: every blob is read again (ignoring
+        verification stamps) and compared with checksums in the index. Blobs are
+        hashed in parallel by workers, each blob is read only once for all
+        algorithms, reading is limited to max_rate bytes per second.
+
+        Detected problems are: index entries without a blob, blobs not referenced
+        by the index and blobs not matching their checksums. With repair, such
+        entries are removed from the index and such blobs are moved to the
+        quarantine directory.
+
+        Returns descriptions of detected problems.
+        """
+        problems: List[str] = []
+        entries = self.index.entries()
+        blobs: Dict[PathType, List[str]] = {}
+
+        for artifact_id, entry in entries.items():
+            if os.path.isfile(entry["cached_path"]):
+                blobs.setdefault(os.path.abspath(entry["cached_path"]), []).append(
+                    artifact_id
+                )
+                continue
 
-    def delete(self, artifact_uuid):
-        # check if artifact exists
-        # TODO: This doesn't actually appear to check anything
-        self._get_cache()
-        os.remove(os.path.join(self.cache_dir, artifact_uuid))
-        os.remove(os.path.join(self.cache_dir, artifact_uuid + ".yaml"))
+            problems.append(
+                f"Artifact '{artifact_id}' is missing its cached file '{entry['cached_path']}'"
+            )
+
+            if repair:
+                with self.entry_lock(entry):
+                    if not os.path.isfile(entry["cached_path"]):
+                        self.index.remove(artifact_id)
+                        logger.info(f"Removed artifact '{artifact_id}' from the index")
+
+        blobs_dir = os.path.abspath(
+            os.path.join(self.cache_dir, BLOBS_DIR, BLOB_ALGORITHM)
+        )
+
+        for name in sorted(os.listdir(blobs_dir)) if os.path.isdir(blobs_dir) else []:
+            blob = os.path.join(blobs_dir, name)
+
+            if (
+                blob in blobs
+                or time.time() - os.path.getmtime(blob) < ORPHAN_BLOB_GRACE_PERIOD
+            ):
+                continue
+
+            problems.append(f"Cached file '{blob}' does not belong to any artifact")
+
+            if repair:
+                with self.lock(f"{BLOB_ALGORITHM}:{name}"):
+                    if not self.index.find_id(BLOB_ALGORITHM, name):
+                        self._quarantine(blob)
+
+        limiter = RateLimiter(max_rate) if max_rate else None
+
+        def check(blob: PathType) -> Optional[str]:
+            sums = get_sums(
+                blob, SUPPORTED_HASH_ALGORITHMS, limiter.consume if limiter else None
+            )
+            corrupted = [
+                artifact_id
+                for artifact_id in blobs[blob]
+                if any(
+                    entries[artifact_id].get(alg)
+                    and entries[artifact_id][alg].lower() != sums[alg]
+                    for alg in SUPPORTED_HASH_ALGORITHMS
+                )
+            ]
+
+            if not corrupted and os.path.basename(blob) == sums[BLOB_ALGORITHM]:
+                # Verified blob does not need to be read again by builds
+                self.stamp(blob, sums)
+                return None
+
+            if repair:
+                with ExitStack() as stack:
+                    for artifact_id in blobs[blob]:
+                        stack.enter_context(self.entry_lock(entries[artifact_id]))
+                        self.index.remove(artifact_id)
+
+                    self.index.remove_stamps(blob)
+                    self._quarantine(blob)
+
+            return "Cached file '{}' of artifact(s) {} does not match its checksums".format(
+                blob, ", ".join(f"'{artifact_id}'" for artifact_id in blobs[blob])
+            )
+
+        # Larger blobs first, so that workers finish at about the same time
+        results = WorkerPool(workers).map(
+            check,
+            sorted(blobs, key=self._file_size, reverse=True),
+            describe=lambda blob: f"'{blob}'",
+            what="cached files",
+        )
+
+        return problems + [problem for problem in results if problem]
+
+    def _quarantine(self, path: PathType) -> None:
+        """Moves the file to the quarantine directory, where it can be inspected"""
+        quarantine_dir = os.path.join(self.cache_dir, QUARANTINE_DIR)
+        os.makedirs(quarantine_dir, exist_ok=True)
+
+        target = os.path.join(
+            quarantine_dir, f"{os.path.basename(path)}.{int(time.time())}"
+        )
+        os.rename(path, target)
+
+        logger.info(f"Moved '{path}' to '{target}'")
+
+    def verified(self, path: PathType, checksums: Dict[str, str]) -> bool:
+        """
+        Returns True if the file was already verified to match all provided checksums
+        and it was not modified since then, based on the recorded verification stamps.
+
+        This makes it possible to verify unchanged files with a single stat call
+        instead of reading the whole file.
+        """
+        stamped = self._stamped_sums(path)
+
+        for algorithm, checksum in checksums.items():
+            if stamped.get(algorithm) != checksum.lower():
+                return False
+
+        return True
+
+    def sums(self, path: PathType, algorithms: Iterable[str]) -> Dict[str, str]:
+        """
+        Returns checksums of the file for all requested algorithms. Checksums
+        recorded in valid verification stamps are reused, the file is read only
+        if some checksums are missing.
+        """
+        sums = {}
+
+        if not CONFIG.get_bool("common", "force_verify"):
+            sums = {
+                algorithm: digest
+                for algorithm, digest in self._stamped_sums(path).items()
+                if algorithm in algorithms
+            }
+
+        missing = [algorithm for algorithm in algorithms if algorithm not in sums]
+
+        if missing:
+            sums.update(get_sums(path, missing))
+
+        return sums
+
+    def _stamped_sums(self, path: PathType) -> Dict[str, str]:
+        """
+        Returns checksums recorded in verification stamps of the file
+        which are still valid, because the file was not modified since.
+        """
+        path = os.path.abspath(path)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {}
+
+        return {
+            algorithm: stamp["digest"]
+            for algorithm, stamp in self.index.stamps(path).items()
+            if stamp["inode"] == stat.st_ino
+            and stamp["size"] == stat.st_size
+            and stamp["mtime_ns"] == stat.st_mtime_ns
+        }
+
+    def stamp(self, path: PathType, checksums: Dict[str, str]) -> None:
+        """
+        Records verification stamps for the file, see verified().
+        """
+        path = os.path.abspath(path)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        self.index.add_stamps(path, stat, checksums)
 
     def get(self, artifact: "Resource"):
+        # Artifact is cached if any of its checksums is known, entries
+        # contain checksums for all supported algorithms
         for alg in SUPPORTED_HASH_ALGORITHMS:
             if alg in artifact:
-                return self._find_artifact(alg, artifact[alg])
+                cached = self.index.find(alg, artifact[alg])
+
+                if cached is not None:
+                    return cached
         raise CekitError("Artifact is not cached.")
 
     def _find_artifact(self, alg: str, chksum: str):
-        cache = self._get_cache()
-        for _, artifact in cache.items():
-            if alg in artifact and artifact[alg] == chksum:
-                return artifact
+        artifact = self.index.find(alg, chksum)
 
-        raise CekitError("Artifact is not cached.")
+        if artifact is None:
+            raise CekitError("Artifact is not cached.")
+
+        return artifact
 
     # TODO: Make this return Optional[Resource] instead of Union[Resource, bool]
     def cached(self, artifact: "Resource") -> Union["Resource", bool]:
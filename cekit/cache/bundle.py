@@ -0,0 +1,226 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tarfile
+import time
+from contextlib import ExitStack
+from typing import IO, Any, Dict, Iterable, Iterator, List, Tuple
+
+from cekit.cache.artifact import BLOB_ALGORITHM, BLOBS_DIR, ArtifactCache
+from cekit.cekit_types import PathType
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from cekit.errors import CekitError
+
+try:
+    import zstandard
+except ImportError:
+    # Optional, only required for Zstandard compressed bundles
+    zstandard = None
+
+logger = logging.getLogger("cekit")
+
+# Name of the bundle member with cache entries, it is the first member of the bundle
+BUNDLE_INDEX = "index.json"
+BUNDLE_VERSION = 1
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+COMPRESSIONS = {
+    ".gz": "gz",
+    ".tgz": "gz",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".zst": "zst",
+    ".tzst": "zst",
+}
+
+
+def _blob_member(digest: str) -> str:
+    return f"{BLOBS_DIR}/{BLOB_ALGORITHM}/{digest}"
+
+
+def _zstandard() -> Any:
+    if zstandard is None:
+        raise CekitError(
+            "Zstandard compressed bundles require the 'zstandard' Python module, "
+            "please install it, for example with 'pip install zstandard'"
+        )
+
+    return zstandard
+
+
+def export_bundle(
+    cache: ArtifactCache, entries: Iterable[Dict[str, Any]], output: PathType
+) -> int:
+    """
+    Writes cache entries and their blobs to the bundle at the output path. The bundle
+    is a tar archive, compressed according to the file name extension ('.gz', '.bz2',
+    '.xz' or '.zst'). Blobs are streamed to the archive directly from the cache.
+
+    Returns the number of exported artifacts.
+    """
+    compression = COMPRESSIONS.get(os.path.splitext(output)[1], "")
+    exported: Dict[str, Dict[str, Any]] = {}
+
+    for entry in entries:
+        if not os.path.isfile(entry["cached_path"]):
+            logger.warning(
+                f"Cached file of artifact '{', '.join(entry['names'])}' is missing, skipping it"
+            )
+            continue
+
+        exported.setdefault(entry[BLOB_ALGORITHM], entry)
+
+    with ExitStack() as stack:
+        fileobj: IO = stack.enter_context(open(output, "wb"))
+
+        if compression == "zst":
+            fileobj = stack.enter_context(
+                _zstandard().ZstdCompressor().stream_writer(fileobj)
+            )
+            compression = ""
+
+        tar = stack.enter_context(
+            tarfile.open(fileobj=fileobj, mode=f"w|{compression}")
+        )
+
+        index = json.dumps(
+            {
+                "version": BUNDLE_VERSION,
+                "artifacts": [
+                    dict(
+                        names=entry["names"],
+                        **{
+                            alg: entry[alg]
+                            for alg in SUPPORTED_HASH_ALGORITHMS
+                            if entry.get(alg)
+                        },
+                    )
+                    for entry in exported.values()
+                ],
+            },
+            indent=2,
+        ).encode("utf-8")
+
+        info = tarfile.TarInfo(BUNDLE_INDEX)
+        info.size = len(index)
+        info.mtime = int(time.time())
+        info.mode = 0o444
+        tar.addfile(info, io.BytesIO(index))
+
+        for entry in exported.values():
+            # Do not let the blob to be evicted while it is read
+            with cache.entry_lock(entry):
+                info = tar.gettarinfo(
+                    entry["cached_path"], arcname=_blob_member(entry[BLOB_ALGORITHM])
+                )
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+
+                with open(entry["cached_path"], "rb") as blob:
+                    tar.addfile(info, blob)
+
+            logger.debug(f"Exported artifact '{', '.join(entry['names'])}'")
+
+    return len(exported)
+
+
+def import_bundle(cache: ArtifactCache, bundle: PathType) -> Tuple[int, int]:
+    """
+    Adds artifacts from the bundle created by export_bundle() to the cache. Content
+    of every artifact is verified against all its checksums while it is extracted.
+    Artifacts which are cached already are not extracted, their names are merged.
+
+    Returns the number of imported and skipped artifacts.
+    """
+    with ExitStack() as stack:
+        fileobj: IO = stack.enter_context(open(bundle, "rb"))
+
+        if fileobj.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+            fileobj.seek(0)
+            fileobj = stack.enter_context(
+                _zstandard().ZstdDecompressor().stream_reader(fileobj)
+            )
+        else:
+            fileobj.seek(0)
+
+        try:
+            tar = stack.enter_context(tarfile.open(fileobj=fileobj, mode="r|*"))
+            members = iter(tar)
+            member = next(members, None)
+        except tarfile.TarError as ex:
+            raise CekitError(f"Cannot read bundle '{bundle}': {ex}")
+
+        if member is None or member.name != BUNDLE_INDEX:
+            raise CekitError(f"File '{bundle}' is not a CEKit cache bundle")
+
+        index = json.load(tar.extractfile(member))
+
+        if index.get("version") != BUNDLE_VERSION:
+            raise CekitError(
+                f"Bundle '{bundle}' version {index.get('version')} is not supported"
+            )
+
+        artifacts = {
+            _blob_member(artifact[BLOB_ALGORITHM]): artifact
+            for artifact in _validate(bundle, index.get("artifacts"))
+        }
+
+        def blobs() -> Iterator[Tuple[Dict[str, Any], IO]]:
+            for member in members:
+                artifact = artifacts.get(member.name)
+
+                if not member.isfile() or artifact is None:
+                    logger.warning(
+                        f"Bundle member '{member.name}' is not a known artifact, skipping it"
+                    )
+                    continue
+
+                yield artifact, tar.extractfile(member)
+
+        return cache.add_blobs(blobs())
+
+
+def _validate(bundle: PathType, artifacts: Any) -> List[Dict[str, Any]]:
+    """
+    Checks entries of the bundle index, checksums are used to name cached blobs
+    and locks, these must be hexadecimal digests of the right length.
+    """
+    if not isinstance(artifacts, list):
+        raise CekitError(f"Bundle '{bundle}' does not list any artifacts")
+
+    for artifact in artifacts:
+        if not isinstance(artifact, dict) or not artifact.get(BLOB_ALGORITHM):
+            raise CekitError(
+                f"Artifact entry {artifact} in bundle '{bundle}' lacks the {BLOB_ALGORITHM} checksum"
+            )
+
+        names = artifact.get("names")
+
+        if not isinstance(names, list) or not all(
+            isinstance(name, str) for name in names
+        ):
+            raise CekitError(
+                f"Artifact entry {artifact} in bundle '{bundle}' has invalid names"
+            )
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if alg in artifact and not _valid_digest(alg, artifact[alg]):
+                raise CekitError(
+                    f"Artifact entry {artifact} in bundle '{bundle}' has invalid {alg} checksum"
+                )
+
+            if alg in artifact:
+                artifact[alg] = artifact[alg].lower()
+
+    return artifacts
+
+
+def _valid_digest(algorithm: str, digest: Any) -> bool:
+    length = hashlib.new(algorithm).digest_size * 2
+
+    return isinstance(digest, str) and bool(
+        re.fullmatch(f"[0-9a-fA-F]{{{length}}}", digest)
+    )
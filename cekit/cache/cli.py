@@ -1,14 +1,32 @@
+import json
 import logging
+import os
 import shutil
 import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
 
 import click
-
-from cekit.cache.artifact import ArtifactCache
+import yaml
+
+from cekit.cache.artifact import (
+    ArtifactCache,
+    blob_path,
+    cache_directory,
+    parse_age,
+    parse_size,
+)
+from cekit.cache.bundle import export_bundle, import_bundle
+from cekit.cache.server import CacheServer, parse_bind
 from cekit.config import Config
 from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from cekit.descriptor import Resource
 from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from cekit.generator.base import Generator
 from cekit.log import setup_logging
+from cekit.parallel import WorkerPool, fetch_workers, fetch_workers_per_host
 from cekit.tools import Map
 from cekit.version import __version__
 
@@ -44,7 +62,7 @@ def ls():
 
 
 @cli.command(name="add", short_help="Add artifact to cache")
-@click.argument("location", metavar="LOCATION")
+@click.argument("location", metavar="LOCATION", required=False)
 @click.option("--md5", metavar="CHECKSUM", help="The md5 checksum of the artifact.")
 @click.option("--sha1", metavar="CHECKSUM", help="The sha1 checksum of the artifact.")
 @click.option(
@@ -53,19 +71,204 @@ def ls():
 @click.option(
     "--sha512", metavar="CHECKSUM", help="The sha512 checksum of the artifact."
 )
-def add(location, md5, sha1, sha256, sha512):
+@click.option(
+    "--manifest",
+    metavar="PATH",
+    help="Path to a manifest (YAML or JSON lines) with artifacts to add.",
+)
+def add(location, md5, sha1, sha256, sha512, manifest):
+    if manifest:
+        if location or md5 or sha1 or sha256 or sha512:
+            raise click.UsageError(
+                "Location and checksums cannot be used together with --manifest"
+            )
+
+        CacheCli.prepare().add_manifest(manifest)
+        return
+
+    if not location:
+        raise click.UsageError("Location or --manifest must be provided")
+
     if not (md5 or sha1 or sha256 or sha512):
         raise click.UsageError("At least one checksum must be provided")
 
     CacheCli.prepare().add(location, md5, sha1, sha256, sha512)
 
 
+@cli.command(name="prefetch", short_help="Add artifacts required by images to cache")
+@click.option(
+    "--descriptor",
+    "descriptors",
+    metavar="PATH",
+    help="Path to image descriptor file. Can be specified multiple times.",
+    default=["image.yaml"],
+    show_default=True,
+    multiple=True,
+)
+@click.option(
+    "--overrides",
+    metavar="JSON",
+    help="Inline overrides in JSON format.",
+    multiple=True,
+)
+@click.option(
+    "--overrides-file",
+    "overrides",
+    metavar="PATH",
+    help="Path to overrides file in YAML format.",
+    multiple=True,
+)
+def prefetch(descriptors, overrides):
+    """
+    Fetches all artifacts with checksums required by the image descriptors into the
+    cache, concurrently. Overrides and modules are applied the same way as when
+    building the image. Artifacts required by multiple images are fetched only once.
+
+    Overrides are applied to every image descriptor.
+    """
+    CacheCli.prepare().prefetch(descriptors, overrides)
+
+
 @cli.command(name="rm", short_help="Remove artifact from cache")
 @click.argument("uuid", metavar="UUID")
 def rm(uuid):
     CacheCli.prepare().rm(uuid)
 
 
+@cli.command(name="path", short_help="Show path of cached artifact")
+@click.argument("digest", metavar="SHA256")
+def path(digest):
+    CacheCli.prepare().path(digest)
+
+
+@cli.command(name="pin", short_help="Protect artifact from eviction")
+@click.argument("uuid", metavar="UUID")
+def pin(uuid):
+    CacheCli.prepare().pin(uuid, True)
+
+
+@cli.command(name="unpin", short_help="Allow eviction of pinned artifact")
+@click.argument("uuid", metavar="UUID")
+def unpin(uuid):
+    CacheCli.prepare().pin(uuid, False)
+
+
+@cli.command(name="gc", short_help="Evict least recently used artifacts")
+@click.option(
+    "--max-size",
+    metavar="SIZE",
+    help="Evict least recently used artifacts until the cache is not larger than SIZE, for example '10G'.",
+)
+@click.option(
+    "--max-age",
+    metavar="AGE",
+    help="Evict artifacts not used for longer than AGE, for example '30d' or '12h'.",
+)
+@click.option(
+    "--dry-run",
+    help="Only print artifacts which would be evicted.",
+    is_flag=True,
+)
+def gc(max_size, max_age, dry_run):
+    if not (max_size or max_age):
+        raise click.UsageError("At least one of --max-size or --max-age is required")
+
+    try:
+        max_size = parse_size(max_size) if max_size else None
+        max_age = parse_age(max_age) if max_age else None
+    except CekitError as ex:
+        raise click.BadParameter(str(ex))
+
+    CacheCli.prepare().gc(max_size, max_age, dry_run)
+
+
+@cli.command(name="export", short_help="Export cached artifacts to a bundle")
+@click.option(
+    "-o",
+    "--output",
+    metavar="PATH",
+    help="Path to the bundle. The bundle is compressed if the name ends with '.gz', '.bz2', '.xz' or '.zst'.",
+    required=True,
+)
+@click.option(
+    "--descriptor",
+    "descriptors",
+    metavar="PATH",
+    help="Export only artifacts required by the image descriptor. Can be specified multiple times.",
+    multiple=True,
+)
+@click.option(
+    "--overrides",
+    metavar="JSON",
+    help="Inline overrides in JSON format.",
+    multiple=True,
+)
+@click.option(
+    "--overrides-file",
+    "overrides",
+    metavar="PATH",
+    help="Path to overrides file in YAML format.",
+    multiple=True,
+)
+def export(output, descriptors, overrides):
+    CacheCli.prepare().export(output, descriptors, overrides)
+
+
+@cli.command(name="import", short_help="Import artifacts from a bundle to cache")
+@click.argument("bundle", metavar="BUNDLE")
+def import_(bundle):
+    CacheCli.prepare().import_(bundle)
+
+
+@cli.command(name="serve", short_help="Serve cached artifacts over HTTP")
+@click.option(
+    "--bind",
+    metavar="ADDRESS",
+    help="Address to listen on, in the 'host:port' form.",
+    default="127.0.0.1:8080",
+    show_default=True,
+)
+@click.option(
+    "--upstream",
+    metavar="TEMPLATE",
+    help="Cacher URL template (or templates) to fetch artifacts missing in the cache from. "
+    "If not provided, requests for missing artifacts are answered with 404.",
+)
+def serve(bind, upstream):
+    try:
+        address = parse_bind(bind)
+    except CekitError as ex:
+        raise click.BadParameter(str(ex))
+
+    CacheCli.prepare().serve(address, upstream)
+
+
+@cli.command(name="verify", short_help="Check integrity of cached artifacts")
+@click.option(
+    "--repair",
+    help="Remove broken artifacts from the index and move broken or unknown files to quarantine.",
+    is_flag=True,
+)
+@click.option(
+    "--workers",
+    metavar="COUNT",
+    help="Number of files verified in parallel.  [default: number of CPUs]",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--max-rate",
+    metavar="SIZE",
+    help="Maximum number of bytes read per second, for example '100M'.",
+)
+def verify(repair, workers, max_rate):
+    try:
+        max_rate = parse_size(max_rate) if max_rate else None
+    except CekitError as ex:
+        raise click.BadParameter(str(ex))
+
+    CacheCli.prepare().verify(repair, workers or os.cpu_count() or 1, max_rate)
+
+
 @cli.command(name="clear", short_help="Remove all artifacts from the cache")
 def clear():
     CacheCli.prepare().clear()
@@ -119,22 +322,241 @@ class CacheCli:
             click.secho(f"Cannot cache artifact {location}: {str(ex)}", fg="red")
             sys.exit(1)
 
+    def add_manifest(self, manifest: str):
+        try:
+            artifacts = [
+                create_resource(
+                    dict(
+                        url=entry["location"],
+                        **{
+                            alg: entry[alg]
+                            for alg in SUPPORTED_HASH_ALGORITHMS
+                            if alg in entry
+                        },
+                    )
+                )
+                for entry in self._read_manifest(manifest)
+            ]
+        except CekitError as ex:
+            click.secho(str(ex), fg="red")
+            sys.exit(1)
+
+        artifact_cache = ArtifactCache()
+
+        def add(artifact: Resource) -> str:
+            # Entries sharing a checksum are added only once, even when
+            # processed concurrently (or by another CEKit process)
+            with artifact_cache.lock(artifact.fetch_key()):
+                if artifact_cache.cached(artifact):
+                    return "skipped"
+
+                try:
+                    artifact_id = artifact_cache.add(artifact)
+                except Exception as ex:
+                    click.secho(
+                        f"Cannot cache artifact {artifact['url']}: {str(ex)}", fg="red"
+                    )
+                    return "failed"
+
+            click.echo(f"Artifact {artifact['url']} cached with UUID '{artifact_id}'")
+            return "added"
+
+        results = WorkerPool(fetch_workers(), fetch_workers_per_host()).map(
+            add,
+            artifacts,
+            # Entries with the same location may use different checksums
+            group=lambda artifact: artifact["url"],
+            host=lambda artifact: artifact.fetch_host(),
+        )
+
+        click.echo(
+            "{} artifact(s) added, {} already cached, {} failed".format(
+                results.count("added"),
+                results.count("skipped"),
+                results.count("failed"),
+            )
+        )
+
+        if "failed" in results:
+            sys.exit(1)
+
+    @staticmethod
+    def _read_manifest(manifest: str) -> List[Dict[str, str]]:
+        """
+        Reads the list of artifacts to add from the manifest file. The manifest
+        is a YAML list or JSON lines of objects with the 'location' key and
+        at least one checksum.
+        """
+        try:
+            with open(manifest, "r") as file_:
+                content = file_.read()
+        except OSError as ex:
+            raise CekitError(f"Cannot read manifest '{manifest}': {ex}")
+
+        lines = [line.strip() for line in content.splitlines() if line.strip()]
+
+        try:
+            if lines and all(line.startswith("{") for line in lines):
+                entries = [json.loads(line) for line in lines]
+            else:
+                entries = yaml.safe_load(content) or []
+        except ValueError as ex:
+            raise CekitError(f"Cannot parse manifest '{manifest}': {ex}")
+        except yaml.YAMLError as ex:
+            raise CekitError(f"Cannot parse manifest '{manifest}': {ex}")
+
+        if not isinstance(entries, list):
+            raise CekitError(f"Manifest '{manifest}' must contain a list of artifacts")
+
+        for index, entry in enumerate(entries, 1):
+            if not isinstance(entry, dict) or not entry.get("location"):
+                raise CekitError(
+                    f"Entry {index} of manifest '{manifest}' does not define location"
+                )
+
+            if not set(SUPPORTED_HASH_ALGORITHMS).intersection(entry):
+                raise CekitError(
+                    f"Entry {index} of manifest '{manifest}' does not define any checksum"
+                )
+
+        return entries
+
+    def prefetch(self, descriptors: List[str], overrides: List[str]):
+        # Module artifacts can refer to files in module repositories fetched
+        # into the target directory, these must be kept until artifacts are cached
+        targets: List[str] = []
+
+        try:
+            artifacts = self._required_artifacts(descriptors, overrides, targets)
+
+            WorkerPool(fetch_workers(), fetch_workers_per_host()).map(
+                lambda artifact: artifact.prefetch(),
+                artifacts,
+                host=lambda artifact: artifact.fetch_host(),
+                describe=lambda artifact: f"'{artifact.name}'",
+                what="artifacts",
+            )
+        except CekitError as ex:
+            click.secho(f"Cannot cache artifacts: {ex}", fg="red")
+            sys.exit(1)
+        finally:
+            for target in targets:
+                shutil.rmtree(target, ignore_errors=True)
+
+        click.echo(f"{len(artifacts)} artifact(s) cached")
+
+    def export(self, output: str, descriptors: List[str], overrides: List[str]):
+        artifact_cache = ArtifactCache()
+        targets: List[str] = []
+
+        try:
+            if descriptors:
+                entries = []
+
+                for artifact in self._required_artifacts(
+                    descriptors, overrides, targets
+                ):
+                    cached = artifact_cache.cached(artifact)
+
+                    if cached:
+                        entries.append(cached)
+                    else:
+                        LOGGER.warning(
+                            f"Artifact '{artifact.name}' is not cached, it will not be exported"
+                        )
+            else:
+                entries = list(artifact_cache.list().values())
+
+            count = export_bundle(artifact_cache, entries, output)
+        except CekitError as ex:
+            click.secho(f"Cannot export artifacts: {ex}", fg="red")
+            sys.exit(1)
+        finally:
+            for target in targets:
+                shutil.rmtree(target, ignore_errors=True)
+
+        click.echo(f"{count} artifact(s) exported to '{output}'")
+
+    def import_(self, bundle: str):
+        try:
+            imported, skipped = import_bundle(ArtifactCache(), bundle)
+        except CekitError as ex:
+            click.secho(f"Cannot import artifacts: {ex}", fg="red")
+            sys.exit(1)
+
+        click.echo(f"{imported} artifact(s) imported, {skipped} already cached")
+
+    def _required_artifacts(
+        self, descriptors: List[str], overrides: List[str], targets: List[str]
+    ) -> List[Resource]:
+        """
+        Returns artifacts with checksums required by images defined in descriptors,
+        artifacts shared by multiple images are returned once. Descriptors are processed
+        in temporary target directories, which are appended to targets, these must
+        be removed by the caller.
+        """
+        artifacts: Dict[str, Resource] = {}
+
+        for descriptor in descriptors:
+            targets.append(tempfile.mkdtemp(prefix="cekit-cache-"))
+
+            for artifact in self._image_artifacts(descriptor, targets[-1], overrides):
+                key = artifact.fetch_key()
+
+                if not set(SUPPORTED_HASH_ALGORITHMS).intersection(artifact):
+                    LOGGER.warning(
+                        f"Artifact '{artifact.name}' does not define any checksum, it cannot be cached"
+                    )
+                elif key not in artifacts:
+                    artifacts[key] = artifact
+
+        return list(artifacts.values())
+
+    @staticmethod
+    def _image_artifacts(
+        descriptor: str, target: str, overrides: List[str]
+    ) -> List[Resource]:
+        """
+        Returns artifacts of all images defined in the descriptor, with overrides
+        and modules applied the same way as when the image is built.
+        """
+        generator = Generator(descriptor, target, "Dockerfile", overrides, False)
+
+        if CONFIG.get("common", "redhat"):
+            generator.add_redhat_overrides()
+
+        generator.init()
+
+        return [
+            artifact for image in generator.images for artifact in image.all_artifacts
+        ]
+
     def ls(self):
         artifact_cache = ArtifactCache()
         artifacts = artifact_cache.list()
+        usage = artifact_cache.index.usage()
         if artifacts:
-            for artifact_filename, artifact in artifacts.items():
+            for artifact_id, artifact in artifacts.items():
                 click.echo(
-                    "\n{}:".format(
-                        click.style(
-                            artifact_filename.split(".")[0], fg="green", bold=True
-                        )
-                    )
+                    "\n{}:".format(click.style(artifact_id, fg="green", bold=True))
                 )
                 for alg in SUPPORTED_HASH_ALGORITHMS:
                     if alg in artifact and artifact[alg]:
                         click.echo(f"  {click.style(alg, bold=True)}: {artifact[alg]}")
 
+                if artifact_id in usage:
+                    row = usage[artifact_id]
+                    last_access = time.strftime(
+                        "%Y-%m-%d %H:%M:%S", time.localtime(row["last_access"])
+                    )
+                    click.echo(
+                        f"  {click.style('last access', bold=True)}: {last_access}"
+                    )
+                    click.echo(f"  {click.style('hits', bold=True)}: {row['hits']}")
+
+                    if row["pinned"]:
+                        click.echo(f"  {click.style('pinned', bold=True)}: true")
+
                 if artifact["names"]:
                     click.echo(f"  {click.style('names', bold=True)}:")
                     for name in artifact["names"]:
@@ -142,6 +564,91 @@ class CacheCli:
         else:
             click.echo("No artifacts cached!")
 
+    def path(self, digest: str):
+        """
+        Prints the path of the cached artifact with provided sha256 digest.
+        Artifacts are stored by their digest, the index is not needed.
+        """
+        cached_path = blob_path(cache_directory(), digest)
+
+        if not os.path.isfile(cached_path):
+            # Cache may not be migrated to the current layout yet
+            cached_path = ArtifactCache().find_blob(digest)
+
+        if not cached_path:
+            click.secho(
+                f"Artifact with sha256 '{digest}' is not cached", fg="yellow", err=True
+            )
+            sys.exit(1)
+
+        click.echo(cached_path)
+
+    def pin(self, uuid: str, pinned: bool):
+        try:
+            ArtifactCache().pin(uuid, pinned)
+        except CekitError as ex:
+            click.secho(str(ex), fg="yellow")
+            sys.exit(1)
+
+        click.echo(
+            "Artifact with UUID '{}' {}".format(
+                uuid, "pinned" if pinned else "unpinned"
+            )
+        )
+
+    def gc(self, max_size, max_age, dry_run):
+        artifact_cache = ArtifactCache()
+        evicted = artifact_cache.gc(max_size=max_size, max_age=max_age, dry_run=dry_run)
+
+        for artifact_id in evicted:
+            click.echo(
+                "Artifact with UUID '{}' {}".format(
+                    artifact_id, "would be evicted" if dry_run else "evicted"
+                )
+            )
+
+        click.echo(f"Cache size: {artifact_cache.size()} bytes")
+
+    def serve(self, address: Tuple[str, int], upstream: Optional[str]):
+        # Artifacts missing in the cache are fetched using the cacher mechanism
+        CONFIG.cfg["common"]["cache_url"] = upstream or ""
+
+        try:
+            server = CacheServer(address, read_through=bool(upstream))
+        except OSError as ex:
+            click.secho(f"Cannot listen on {address[0]}:{address[1]}: {ex}", fg="red")
+            sys.exit(1)
+
+        click.echo(
+            f"Serving cached artifacts, use '{server.cache_url}' as the cache_url"
+        )
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def verify(self, repair: bool, workers: int, max_rate: Optional[int]):
+        artifact_cache = ArtifactCache()
+        count = len(artifact_cache.list())
+        problems = artifact_cache.verify(
+            repair=repair, workers=workers, max_rate=max_rate
+        )
+
+        for problem in problems:
+            click.secho(problem, fg="red")
+
+        click.echo(
+            "Verified {} artifact(s), found {} problem(s){}".format(
+                count, len(problems), ", repaired" if repair and problems else ""
+            )
+        )
+
+        if problems and not repair:
+            sys.exit(1)
+
     def rm(self, uuid: str):
         artifact_cache = ArtifactCache()
 
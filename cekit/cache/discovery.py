@@ -0,0 +1,248 @@
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from http.client import HTTPException
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, urlunparse
+
+from cekit.cache.artifact import ArtifactCache
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, get_sums
+from cekit.download import (
+    NotModifiedError,
+    OfflineError,
+    download_client,
+    offline,
+    response_validators,
+)
+from cekit.errors import CekitError
+from cekit.tools import download_file
+
+logger = logging.getLogger("cekit")
+
+# Algorithm names used in the 'Digest' (RFC 3230) and 'Repr-Digest' (RFC 9530) headers
+DIGEST_ALGORITHMS = {
+    "md5": "md5",
+    "sha": "sha1",
+    "sha-256": "sha256",
+    "sha-512": "sha512",
+}
+
+# Headers with hex encoded checksums, sent for example by Artifactory
+CHECKSUM_HEADERS = {
+    "X-Checksum-Sha256": "sha256",
+    "X-Checksum-Sha1": "sha1",
+    "X-Checksum-Md5": "md5",
+}
+
+# Maven style checksum files published next to the artifact, in order of preference
+SIDECAR_ALGORITHMS = ["sha256", "sha1", "md5"]
+
+# Checksum files are tiny, anything bigger is not a checksum file
+MAX_SIDECAR_SIZE = 4096
+
+
+def _valid(algorithm: str, value: str) -> Optional[str]:
+    """Returns the lowercase hex checksum if it is valid for the algorithm"""
+    value = value.strip().lower()
+
+    if re.match(r"^[0-9a-f]{%d}$" % (hashlib.new(algorithm).digest_size * 2), value):
+        return value
+
+    return None
+
+
+def _from_base64(algorithm: str, value: str) -> Optional[str]:
+    try:
+        return _valid(
+            algorithm,
+            binascii.hexlify(base64.b64decode(value.strip(), validate=True)).decode(),
+        )
+    except (binascii.Error, ValueError):
+        return None
+
+
+def checksums_from_headers(headers) -> Dict[str, str]:
+    """
+    Returns checksums of the remote file announced in the response headers:
+    'Digest', 'Repr-Digest', 'Content-MD5' and 'X-Checksum-*'. Malformed
+    values are ignored.
+    """
+    checksums: Dict[str, str] = {}
+
+    for name in ["Repr-Digest", "Digest"]:
+        for item in (headers.get(name) or "").split(","):
+            algorithm, _, value = item.strip().partition("=")
+            algorithm = DIGEST_ALGORITHMS.get(algorithm.strip().lower())
+
+            if algorithm:
+                # Structured field byte sequence (RFC 9530) is enclosed in colons
+                value = _from_base64(algorithm, value.strip().strip(":"))
+
+            if algorithm and value:
+                checksums.setdefault(algorithm, value)
+
+    if headers.get("Content-MD5"):
+        value = _from_base64("md5", headers.get("Content-MD5"))
+
+        if value:
+            checksums.setdefault("md5", value)
+
+    for name, algorithm in CHECKSUM_HEADERS.items():
+        value = _valid(algorithm, headers.get(name) or "")
+
+        if value:
+            checksums.setdefault(algorithm, value)
+
+    return checksums
+
+
+def _head(url: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Requests headers of the remote file. Returns its validators and checksums
+    found in the headers, both are empty if the server does not support
+    HEAD requests.
+    """
+    client = download_client()
+
+    try:
+        with client.open(client.request(url, method="HEAD")) as response:
+            response.read()
+
+            if response.getcode() != 200:
+                logger.debug(
+                    f"HEAD request for '{url}' failed with status code {response.getcode()}"
+                )
+                return {}, {}
+
+            headers = {
+                name: response.getheader(name)
+                for name in ["Repr-Digest", "Digest", "Content-MD5"]
+                + list(CHECKSUM_HEADERS)
+            }
+
+            return response_validators(response), checksums_from_headers(headers)
+    except (OSError, HTTPException, CekitError) as ex:
+        logger.debug(f"HEAD request for '{url}' failed: {ex}")
+        return {}, {}
+
+
+def _from_sidecars(url: str, algorithms: List[str]) -> Dict[str, str]:
+    """
+    Fetches checksum files published next to the remote file, like
+    'artifact.jar.sha256'. Returns the checksum from the first one found.
+    """
+    client = download_client()
+    parsed = urlparse(url)
+
+    for algorithm in [alg for alg in SIDECAR_ALGORITHMS if alg in algorithms]:
+        sidecar = urlunparse(parsed._replace(path=f"{parsed.path}.{algorithm}"))
+
+        try:
+            with client.open(client.request(sidecar)) as response:
+                content = response.read(MAX_SIDECAR_SIZE + 1)
+
+                if response.getcode() != 200 or len(content) > MAX_SIDECAR_SIZE:
+                    continue
+        except (OSError, HTTPException, CekitError) as ex:
+            logger.debug(f"Unable to fetch checksum file '{sidecar}': {ex}")
+            continue
+
+        # Content is the checksum, optionally followed by the file name
+        tokens = content.decode("utf-8", errors="replace").split()
+        value = _valid(algorithm, tokens[0]) if tokens else None
+
+        if value:
+            logger.debug(f"Found {algorithm} checksum of '{url}' in '{sidecar}'")
+            return {algorithm: value}
+
+        logger.debug(f"Ignoring malformed checksum file '{sidecar}'")
+
+    return {}
+
+
+def _download(url: str, validators: Dict[str, str]) -> Dict[str, str]:
+    """
+    Downloads the remote file to compute its checksums, the download is conditional
+    if validators are provided, see download_file().
+    """
+    logger.warning(
+        f"Remote checksum of '{url}' is not available, downloading the artifact to compute it"
+    )
+
+    with tempfile.TemporaryDirectory(prefix="cekit-checksum") as tmp:
+        destination = os.path.join(tmp, "artifact")
+        checksums = download_file(url, destination, validators=validators)
+
+        # Local files are not hashed while copied
+        return checksums or get_sums(destination, SUPPORTED_HASH_ALGORITHMS)
+
+
+def discover_checksums(
+    url: str, algorithms: List[str] = SUPPORTED_HASH_ALGORITHMS
+) -> Dict[str, str]:
+    """
+    Finds checksums of the remote file, at least one of them computed with one
+    of the requested algorithms, downloading the file only as the last resort:
+
+    1. checksums announced by the server in headers of the HEAD response,
+    2. Maven style checksum files next to the file ('.sha256', '.sha1' and '.md5'),
+    3. checksums computed while the whole file is downloaded.
+
+    Discovered checksums are recorded in the cache index together with the ETag
+    and Last-Modified headers of the file, and reused as long as the file does
+    not change. In offline mode only the recorded checksums are used.
+    """
+    if urlparse(url).scheme not in ["http", "https"]:
+        return _download(url, {})
+
+    index = ArtifactCache().index
+    recorded = index.remote_checksums(url)
+
+    def usable(found: Dict[str, str]) -> bool:
+        return any(alg in found for alg in algorithms)
+
+    if offline():
+        if recorded and usable(recorded[1]):
+            logger.debug(f"Using recorded checksums of '{url}' without revalidation")
+            return recorded[1]
+
+        raise OfflineError(
+            f"Checksum of '{url}' is not known, it cannot be looked up in offline mode"
+        )
+
+    validators, checksums = _head(url)
+
+    if recorded and usable(recorded[1]) and validators and recorded[0] == validators:
+        logger.debug(f"Using recorded checksums of '{url}', the file did not change")
+        return recorded[1]
+
+    if not usable(checksums):
+        checksums.update(_from_sidecars(url, algorithms))
+
+    if not usable(checksums):
+        # Without HEAD support the recorded checksums can be revalidated only with a download
+        conditional = (
+            dict(recorded[0])
+            if recorded and usable(recorded[1]) and not validators
+            else {}
+        )
+
+        try:
+            checksums = _download(url, conditional)
+        except NotModifiedError:
+            logger.debug(
+                f"Using recorded checksums of '{url}', the file did not change"
+            )
+            return recorded[1]
+
+        # Validators of the downloaded file
+        validators = validators or conditional
+
+    if validators:
+        index.set_remote_checksums(url, validators, checksums)
+
+    return checksums
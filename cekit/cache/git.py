@@ -0,0 +1,301 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+from cekit.cache.lock import FileLock
+from cekit.cekit_types import PathType
+from cekit.config import Config
+from cekit.download import OfflineError, offline
+from cekit.errors import CekitError
+from cekit.tools import materialize_file, run_wrapper
+
+logger = logging.getLogger("cekit")
+config = Config()
+
+GIT_DIR = "git"
+MIRROR_DIR = "mirror.git"
+SNAPSHOTS_DIR = "snapshots"
+
+# Number of extracted commits kept for every repository, least recently used are removed
+SNAPSHOTS_KEPT = 3
+
+
+def git_directory() -> PathType:
+    """Returns the directory with git mirrors located in the work directory"""
+    return os.path.expanduser(os.path.join(config.get("common", "work_dir"), GIT_DIR))
+
+
+def _local(url: str) -> bool:
+    """Returns True if the repository is located on the local filesystem"""
+    return url.startswith("file:") or os.path.exists(url)
+
+
+class GitMirror(object):
+    """
+    Persistent bare mirror of a remote git repository, stored in the 'git'
+    subdirectory of the work directory and shared by all CEKit runs.
+
+    The mirror is updated with 'git fetch' only if the requested ref is not
+    present in it yet, or if it is a branch, which can move. Commits and tags
+    are never fetched again.
+
+    Content of every checked out commit is extracted once (by checking out
+    a temporary index) and reused as long as the ref resolves to the same commit.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.directory = os.path.join(
+            git_directory(), hashlib.sha256(url.encode("utf-8")).hexdigest()
+        )
+        self.mirror = os.path.join(self.directory, MIRROR_DIR)
+
+    def checkout(self, ref: str, target: PathType) -> str:
+        """
+        Places content of the repository at the ref into the target directory.
+        Returns the commit the ref resolved to.
+        """
+        with self._lock():
+            commit = self._resolve(ref)
+            snapshot = self._snapshot(commit)
+
+            logger.debug(
+                f"Copying '{self.url}' repository at {commit} commit to '{target}'"
+            )
+
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+
+            shutil.copytree(
+                snapshot,
+                target,
+                symlinks=True,
+                copy_function=lambda src, dst: materialize_file(
+                    src, dst, allow_hardlink=False
+                ),
+            )
+
+        return commit
+
+    def resolve(self, ref: str) -> str:
+        """Makes sure the ref is present in the mirror, returns the commit it points to"""
+        with self._lock():
+            return self._resolve(ref)
+
+    def paths(self, commit: str) -> List[str]:
+        """Returns paths of all files at the commit, without extracting them"""
+        with self._lock():
+            result = self._git(
+                "ls-tree", "-r", "-z", "--name-only", commit, capture_output=True
+            )
+
+        return [path for path in result.stdout.split("\0") if path]
+
+    def read(self, commit: str, paths: List[str]) -> Dict[str, bytes]:
+        """Returns content of the files at the commit, by their path"""
+        if not paths:
+            return {}
+
+        with self._lock():
+            with tempfile.TemporaryDirectory(prefix=".read", dir=self.directory) as tmp:
+                self._extract(commit, paths, tmp)
+
+                content = {}
+
+                for path in paths:
+                    with open(os.path.join(tmp, path), "rb") as file_:
+                        content[path] = file_.read()
+
+                return content
+
+    def extract(self, commit: str, paths: List[str], target: PathType) -> None:
+        """
+        Extracts the paths (files or directories) at the commit into the target
+        directory, next to anything that is already there.
+        """
+        logger.debug(
+            f"Extracting {', '.join(paths)} of '{self.url}' at {commit} commit to '{target}'"
+        )
+
+        with self._lock():
+            self._extract(commit, paths, target)
+
+    def _lock(self) -> FileLock:
+        # Other CEKit processes must not update the mirror while it is used
+        return FileLock(f"{self.directory}.lock", f"git repository '{self.url}'")
+
+    def _git(self, *args: str, capture_output: bool = False, check: bool = True):
+        return run_wrapper(
+            ["git", f"--git-dir={self.mirror}"] + list(args),
+            capture_output,
+            f"Could not execute git command in the mirror of '{self.url}'",
+            check=check,
+        )
+
+    def _git_pipe(self, producer: List[str], consumer: List[str]) -> None:
+        """Executes two git commands, output of the producer is input of the consumer"""
+        commands = [
+            ["git", f"--git-dir={self.mirror}"] + args for args in [producer, consumer]
+        ]
+
+        logger.debug(
+            "Executing '{}'.".format(" | ".join(" ".join(cmd) for cmd in commands))
+        )
+
+        with subprocess.Popen(commands[0], stdout=subprocess.PIPE) as process:
+            result = subprocess.run(commands[1], stdin=process.stdout)
+
+        if process.returncode or result.returncode:
+            raise CekitError(
+                f"Could not execute git command in the mirror of '{self.url}'"
+            )
+
+    def _rev_parse(self, ref: str) -> Optional[str]:
+        result = self._git(
+            "rev-parse",
+            "--verify",
+            "--quiet",
+            f"{ref}^{{commit}}",
+            capture_output=True,
+            check=False,
+        )
+
+        if result.returncode != 0:
+            return None
+
+        return result.stdout.strip()
+
+    def _immutable(self, ref: str, commit: str) -> bool:
+        """Returns True if the ref is a commit id or a tag"""
+        if re.match(r"^[0-9a-fA-F]{4,}$", ref) and commit.startswith(ref.lower()):
+            return True
+
+        return self._rev_parse(f"refs/tags/{ref}") is not None
+
+    def _resolve(self, ref: str) -> str:
+        """Makes sure the ref is present in the mirror, returns the commit it points to"""
+        can_fetch = _local(self.url) or not offline()
+
+        if not os.path.isdir(self.mirror):
+            if not can_fetch:
+                raise OfflineError(
+                    f"Repository '{self.url}' is not mirrored, it cannot be cloned in offline mode"
+                )
+
+            self._clone()
+        else:
+            commit = self._rev_parse(ref)
+
+            if commit and (self._immutable(ref, commit) or not can_fetch):
+                logger.debug(
+                    f"Ref '{ref}' of '{self.url}' is present in the mirror, not fetching"
+                )
+                return commit
+
+            if can_fetch:
+                logger.info(f"Fetching changes of '{self.url}' repository")
+                self._git("fetch", "--quiet", "--prune", "origin")
+
+        commit = self._rev_parse(ref)
+
+        if not commit:
+            if not can_fetch:
+                raise OfflineError(
+                    f"Ref '{ref}' of '{self.url}' is not mirrored, it cannot be fetched in offline mode"
+                )
+
+            raise CekitError(f"Could not checkout from {ref}")
+
+        return commit
+
+    def _clone(self) -> None:
+        logger.info(f"Mirroring '{self.url}' repository")
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".mirror", dir=self.directory)
+
+        try:
+            run_wrapper(
+                ["git", "clone", "--mirror", "--quiet", self.url, tmp],
+                False,
+                f"Could not clone from {self.url}",
+            )
+            os.rename(tmp, self.mirror)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+
+    def _snapshot(self, commit: str) -> PathType:
+        """Returns the directory with the content of the commit, extracting it if needed"""
+        snapshots = os.path.join(self.directory, SNAPSHOTS_DIR)
+        snapshot = os.path.join(snapshots, commit)
+
+        if os.path.isdir(snapshot):
+            logger.debug(f"Reusing extracted commit {commit} of '{self.url}'")
+            # Recently used snapshots are kept
+            os.utime(snapshot)
+            return snapshot
+
+        os.makedirs(snapshots, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".snapshot", dir=snapshots)
+
+        try:
+            self._extract(commit, [], tmp)
+            os.rename(tmp, snapshot)
+            os.utime(snapshot)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+
+        self._evict(snapshots)
+
+        return snapshot
+
+    def _extract(self, commit: str, paths: List[str], target: PathType) -> None:
+        """Extracts content of the commit, limited to the paths if any, into the target directory"""
+        os.makedirs(target, exist_ok=True)
+
+        # Unlike 'git archive', checking out the index applies the same
+        # .gitattributes rules as a regular checkout: files marked with
+        # 'export-ignore' are present and 'export-subst' files are untouched.
+        # The mirror is bare, its index is used only here, under the lock.
+        index = os.path.join(self.mirror, "index")
+        work_tree = f"--work-tree={os.path.abspath(target)}"
+
+        try:
+            self._git(work_tree, "read-tree", commit)
+
+            if not paths:
+                self._git(work_tree, "checkout-index", "--all", "--force")
+                return
+
+            # Matching files are streamed to 'checkout-index', so that neither
+            # the command line length nor git warnings can break the file list
+            self._git_pipe(
+                [work_tree, "ls-files", "-z", "--", *paths],
+                [work_tree, "checkout-index", "--force", "-z", "--stdin"],
+            )
+        finally:
+            if os.path.exists(index):
+                os.remove(index)
+
+    @staticmethod
+    def _evict(snapshots: PathType) -> None:
+        existing = sorted(
+            (
+                os.path.join(snapshots, name)
+                for name in os.listdir(snapshots)
+                if not name.startswith(".")
+            ),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+
+        for snapshot in existing[SNAPSHOTS_KEPT:]:
+            logger.debug(f"Removing extracted commit '{snapshot}'")
+            shutil.rmtree(snapshot)
@@ -0,0 +1,535 @@
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from cekit.cekit_types import PathType
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+
+logger = logging.getLogger("cekit")
+
+# Bump this every time the schema below changes, the upgrade steps
+# are executed in order in the CacheIndex._upgrade() method.
+SCHEMA_VERSION = 5
+
+INDEX_FILE_NAME = "index.sqlite"
+
+# Metadata key set once all cached files are stored in the content-addressed
+# layout, see ArtifactCache._migrate(). Importing legacy index files removes it.
+BLOB_LAYOUT_KEY = "blob_layout"
+
+
+class CacheIndex(object):
+    """
+    Persistent index of cached artifacts backed by a SQLite database located
+    in the cache directory.
+
+    Every artifact is stored once in the 'artifacts' table and is reachable
+    by every checksum computed for it through the 'checksums' table, where
+    the (algorithm, value) pair is the primary key. This makes artifact lookup
+    a single indexed query, independently of the number of cached artifacts.
+
+    Legacy '<uuid>.yaml' index files found in the cache directory are imported
+    into the database (and removed) when the index is opened for the first time.
+    """
+
+    _instances: Dict[PathType, "CacheIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir: PathType):
+        self.cache_dir: PathType = cache_dir
+        self.path: PathType = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self._local = threading.local()
+        self._prepared = False
+        self._prepare_lock = threading.Lock()
+
+    @classmethod
+    def for_directory(cls, cache_dir: PathType) -> "CacheIndex":
+        """
+        Returns the index for selected cache directory. Instances are shared
+        within the process so that the schema preparation and the migration
+        of legacy index files is done only once.
+        """
+        with cls._instances_lock:
+            index = cls._instances.get(cache_dir)
+
+            # If the cache directory was wiped out, start from scratch
+            if index is None or (index._prepared and not os.path.exists(index.path)):
+                index = CacheIndex(cache_dir)
+                cls._instances[cache_dir] = index
+
+            return index
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA foreign_keys = ON")
+            self._local.connection = connection
+
+        if not self._prepared:
+            with self._prepare_lock:
+                if not self._prepared:
+                    self._prepare(connection)
+                    self._prepared = True
+
+        return connection
+
+    def _prepare(self, connection: sqlite3.Connection) -> None:
+        # WAL makes it possible for readers to not block on a writer
+        connection.execute("PRAGMA journal_mode = WAL")
+
+        with _Transaction(connection):
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+            if version < SCHEMA_VERSION:
+                self._upgrade(connection, version)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+            imported = self._import_legacy_entries(connection)
+
+        # Remove legacy index files only after these were safely committed
+        for index_file in imported:
+            os.remove(index_file)
+
+    @staticmethod
+    def _upgrade(connection: sqlite3.Connection, version: int) -> None:
+        logger.debug(
+            f"Upgrading artifact cache index from version {version} to {SCHEMA_VERSION}"
+        )
+
+        if version < 1:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    id TEXT PRIMARY KEY,
+                    cached_path TEXT NOT NULL,
+                    names TEXT NOT NULL
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS checksums (
+                    algorithm TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    artifact_id TEXT NOT NULL
+                        REFERENCES artifacts(id) ON DELETE CASCADE,
+                    PRIMARY KEY (algorithm, value)
+                )""")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS checksums_artifact ON checksums(artifact_id)"
+            )
+
+        if version < 2:
+            # Verification stamps, see ArtifactCache.verified()
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS stamps (
+                    path TEXT NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT NOT NULL,
+                    PRIMARY KEY (path, algorithm)
+                )""")
+
+        if version < 3:
+            # Access ledger used to evict least recently used artifacts
+            for column in [
+                "last_access REAL NOT NULL DEFAULT 0",
+                "hits INTEGER NOT NULL DEFAULT 0",
+                "pinned INTEGER NOT NULL DEFAULT 0",
+            ]:
+                connection.execute(f"ALTER TABLE artifacts ADD COLUMN {column}")
+
+            # Existing artifacts are treated as used right now
+            connection.execute("UPDATE artifacts SET last_access = ?", (time.time(),))
+
+        if version < 4:
+            # Checksums of remote artifacts, see cekit.cache.discovery
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS remote_checksums (
+                    url TEXT NOT NULL,
+                    validators TEXT NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (url, algorithm)
+                )""")
+
+        if version < 5:
+            # State of one-time migrations of the cache directory
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS metadata (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )""")
+
+    def _import_legacy_entries(self, connection: sqlite3.Connection) -> List[str]:
+        """
+        Imports '<uuid>.yaml' index files written by previous CEKit versions.
+
+        Returns list of the imported index files.
+        """
+        imported = []
+
+        for index_file in glob.glob(os.path.join(self.cache_dir, "*.yaml")):
+            artifact_id = os.path.basename(index_file)[: -len(".yaml")]
+
+            try:
+                with open(index_file, "r") as file_:
+                    entry = yaml.safe_load(file_)
+            except (OSError, yaml.YAMLError) as ex:
+                logger.warning(
+                    f"Unable to import legacy cache index file '{index_file}': {ex}"
+                )
+                continue
+
+            if not isinstance(entry, dict) or not entry.get("cached_path"):
+                logger.warning(
+                    f"Skipping malformed legacy cache index file '{index_file}'"
+                )
+                continue
+
+            logger.debug(f"Importing legacy cache index file '{index_file}'")
+
+            if not connection.execute(
+                "SELECT 1 FROM artifacts WHERE id = ?", (artifact_id,)
+            ).fetchone():
+                self._insert(connection, artifact_id, entry)
+
+            imported.append(index_file)
+
+        if imported:
+            # Imported artifacts are stored in the legacy layout
+            connection.execute("DELETE FROM metadata WHERE key = ?", (BLOB_LAYOUT_KEY,))
+
+        return imported
+
+    @staticmethod
+    def _insert(
+        connection: sqlite3.Connection, artifact_id: str, entry: Dict[str, Any]
+    ) -> None:
+        connection.execute(
+            "INSERT INTO artifacts (id, cached_path, names, last_access) VALUES (?, ?, ?, ?)",
+            (
+                artifact_id,
+                entry["cached_path"],
+                json.dumps(entry.get("names") or []),
+                time.time(),
+            ),
+        )
+
+        for alg in SUPPORTED_HASH_ALGORITHMS:
+            if entry.get(alg):
+                connection.execute(
+                    "INSERT OR REPLACE INTO checksums (algorithm, value, artifact_id) VALUES (?, ?, ?)",
+                    (alg, entry[alg].lower(), artifact_id),
+                )
+
+    def _to_entry(self, connection: sqlite3.Connection, row: sqlite3.Row) -> dict:
+        entry = {"names": json.loads(row["names"]), "cached_path": row["cached_path"]}
+
+        for checksum in connection.execute(
+            "SELECT algorithm, value FROM checksums WHERE artifact_id = ?",
+            (row["id"],),
+        ):
+            entry[checksum["algorithm"]] = checksum["value"]
+
+        return entry
+
+    def add(self, artifact_id: str, entry: Dict[str, Any]) -> str:
+        """
+        Adds new entry to the index. Entry is a dictionary with the 'cached_path' and 'names' keys
+        and the checksums, where the algorithm is the key.
+
+        If an entry with the same content (sha256 checksum) was added in the meantime,
+        for example by another process, the names are added to that entry instead.
+        Returns the identifier of the entry.
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            if entry.get("sha256"):
+                row = connection.execute(
+                    "SELECT artifact_id FROM checksums WHERE algorithm = 'sha256' AND value = ?",
+                    (entry["sha256"].lower(),),
+                ).fetchone()
+
+                if row:
+                    self._add_names(
+                        connection, row["artifact_id"], entry.get("names") or []
+                    )
+                    return row["artifact_id"]
+
+            self._insert(connection, artifact_id, entry)
+
+        return artifact_id
+
+    def remove(self, artifact_id: str) -> bool:
+        """
+        Removes the entry from index. Returns True if such entry did exist.
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            cursor = connection.execute(
+                "DELETE FROM artifacts WHERE id = ?", (artifact_id,)
+            )
+
+        return cursor.rowcount > 0
+
+    def get(self, artifact_id: str) -> Optional[dict]:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT * FROM artifacts WHERE id = ?", (artifact_id,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return self._to_entry(connection, row)
+
+    def find(self, algorithm: str, checksum: str) -> Optional[dict]:
+        """
+        Finds the cache entry by the checksum. Returns None if the artifact is not cached.
+        """
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT a.* FROM checksums c JOIN artifacts a ON a.id = c.artifact_id "
+            "WHERE c.algorithm = ? AND c.value = ?",
+            (algorithm, checksum.lower()),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return self._to_entry(connection, row)
+
+    def find_id(self, algorithm: str, checksum: str) -> Optional[str]:
+        """
+        Finds the identifier of the cache entry by the checksum.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT artifact_id FROM checksums WHERE algorithm = ? AND value = ?",
+                (algorithm, checksum.lower()),
+            )
+            .fetchone()
+        )
+
+        return row["artifact_id"] if row else None
+
+    def add_names(self, artifact_id: str, names: List[str]) -> None:
+        """
+        Adds names (aliases) to the entry, names already known are skipped.
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            self._add_names(connection, artifact_id, names)
+
+    @staticmethod
+    def _add_names(
+        connection: sqlite3.Connection, artifact_id: str, names: List[str]
+    ) -> None:
+        row = connection.execute(
+            "SELECT names FROM artifacts WHERE id = ?", (artifact_id,)
+        ).fetchone()
+
+        if row is None:
+            return
+
+        known = json.loads(row["names"])
+        missing = [name for name in names if name not in known]
+
+        if missing:
+            connection.execute(
+                "UPDATE artifacts SET names = ? WHERE id = ?",
+                (json.dumps(known + missing), artifact_id),
+            )
+
+    def update_path(self, artifact_id: str, cached_path: PathType) -> None:
+        connection = self._connection()
+
+        with _Transaction(connection):
+            connection.execute(
+                "UPDATE artifacts SET cached_path = ? WHERE id = ?",
+                (cached_path, artifact_id),
+            )
+
+    def touch(self, cached_path: PathType) -> None:
+        """
+        Records an access to the cached artifact, see usage().
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            connection.execute(
+                "UPDATE artifacts SET last_access = ?, hits = hits + 1 WHERE cached_path = ?",
+                (time.time(), cached_path),
+            )
+
+    def set_pinned(self, artifact_id: str, pinned: bool) -> bool:
+        """
+        Pins (or unpins) the entry. Pinned entries are never evicted.
+        Returns True if such entry exists.
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            cursor = connection.execute(
+                "UPDATE artifacts SET pinned = ? WHERE id = ?",
+                (int(pinned), artifact_id),
+            )
+
+        return cursor.rowcount > 0
+
+    def usage(self) -> Dict[str, sqlite3.Row]:
+        """
+        Returns the access ledger: the 'cached_path', 'last_access' time,
+        number of 'hits' and the 'pinned' flag of every entry,
+        least recently used entries first.
+        """
+        return {
+            row["id"]: row
+            for row in self._connection().execute(
+                "SELECT id, cached_path, last_access, hits, pinned FROM artifacts "
+                "ORDER BY last_access, hits"
+            )
+        }
+
+    def entries(self) -> Dict[str, dict]:
+        connection = self._connection()
+
+        return {
+            row["id"]: self._to_entry(connection, row)
+            for row in connection.execute("SELECT * FROM artifacts ORDER BY rowid")
+        }
+
+    def stamps(self, path: PathType) -> Dict[str, sqlite3.Row]:
+        """
+        Returns verification stamps recorded for the path, the key is the algorithm.
+        """
+        return {
+            row["algorithm"]: row
+            for row in self._connection().execute(
+                "SELECT * FROM stamps WHERE path = ?", (path,)
+            )
+        }
+
+    def add_stamps(
+        self, path: PathType, stat: os.stat_result, digests: Dict[str, str]
+    ) -> None:
+        connection = self._connection()
+
+        with _Transaction(connection):
+            for algorithm, digest in digests.items():
+                connection.execute(
+                    "INSERT OR REPLACE INTO stamps (path, algorithm, inode, size, mtime_ns, digest) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        algorithm,
+                        stat.st_ino,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        digest.lower(),
+                    ),
+                )
+
+    def remove_stamps(self, path: PathType) -> None:
+        connection = self._connection()
+
+        with _Transaction(connection):
+            connection.execute("DELETE FROM stamps WHERE path = ?", (path,))
+
+    def metadata(self, key: str) -> Optional[str]:
+        row = (
+            self._connection()
+            .execute("SELECT value FROM metadata WHERE key = ?", (key,))
+            .fetchone()
+        )
+
+        return row["value"] if row else None
+
+    def set_metadata(self, key: str, value: str) -> None:
+        connection = self._connection()
+
+        with _Transaction(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+
+    def remote_checksums(
+        self, url: str
+    ) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+        """
+        Returns the validators (the 'ETag' and 'Last-Modified' headers) and checksums
+        recorded for the remote file at the URL, or None if nothing is recorded.
+        """
+        rows = (
+            self._connection()
+            .execute("SELECT * FROM remote_checksums WHERE url = ?", (url,))
+            .fetchall()
+        )
+
+        if not rows:
+            return None
+
+        return (
+            json.loads(rows[0]["validators"]),
+            {row["algorithm"]: row["value"] for row in rows},
+        )
+
+    def set_remote_checksums(
+        self, url: str, validators: Dict[str, str], checksums: Dict[str, str]
+    ) -> None:
+        """
+        Records checksums of the remote file at the URL, replacing checksums
+        recorded for previous version of the file.
+        """
+        connection = self._connection()
+
+        with _Transaction(connection):
+            connection.execute("DELETE FROM remote_checksums WHERE url = ?", (url,))
+
+            for algorithm, value in checksums.items():
+                connection.execute(
+                    "INSERT INTO remote_checksums (url, validators, algorithm, value) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        url,
+                        json.dumps(validators, sort_keys=True),
+                        algorithm,
+                        value.lower(),
+                    ),
+                )
+
+
+class _Transaction(object):
+    """
+    Context manager executing statements in a write transaction. The IMMEDIATE mode
+    makes sure the write lock is acquired up front, so concurrent writers wait
+    (up to the connection timeout) instead of failing in the middle.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, etype, value, traceback):
+        if etype is None:
+            self.connection.execute("COMMIT")
+        else:
+            self.connection.execute("ROLLBACK")
@@ -0,0 +1,60 @@
+import logging
+import os
+import time
+from typing import IO, Optional
+
+from cekit.cekit_types import PathType
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Not available on Windows, locking is skipped there
+    fcntl = None
+
+logger = logging.getLogger("cekit")
+
+
+class FileLock(object):
+    """
+    Exclusive advisory lock shared by all CEKit processes (and threads) using
+    the same lock file. The lock is released when the process dies, so stale
+    locks are never left behind.
+
+    Lock files are never removed, removing these would make it possible for
+    two processes to hold the "same" lock at the same time.
+    """
+
+    def __init__(self, path: PathType, description: Optional[str] = None):
+        self.path = path
+        self.description = description or os.path.basename(path)
+        self._file: Optional[IO] = None
+
+    def __enter__(self) -> "FileLock":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a")
+
+        if fcntl is None:
+            return self
+
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(
+                f"Waiting for {self.description}, it is used by another CEKit process"
+            )
+            start = time.monotonic()
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            logger.debug(
+                "Acquired lock for {} after {:.2f} seconds".format(
+                    self.description, time.monotonic() - start
+                )
+            )
+
+        return self
+
+    def __exit__(self, *args) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        self._file.close()
+        self._file = None
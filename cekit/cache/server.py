@@ -0,0 +1,207 @@
+import logging
+import os
+import re
+import socket
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from cekit.cache.artifact import BLOB_ALGORITHM, ArtifactCache
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from cekit.version import __version__
+
+logger = logging.getLogger("cekit")
+
+# Cacher URL template clients should use to fetch artifacts from the server
+CACHE_URL_TEMPLATE = "http://{}/#algorithm#/#hash#/#filename#"
+
+
+def parse_bind(bind: str) -> Tuple[str, int]:
+    """
+    Parses the address to listen on in the 'host:port' form. IPv6 hosts
+    must be enclosed in brackets, like '[::]:8080'.
+    """
+    match = re.match(r"^(?:\[([0-9a-fA-F:.]+)\]|([^:\[\]]*)):(\d+)$", bind)
+
+    if not match or int(match.group(3)) > 65535:
+        raise CekitError(
+            f"Invalid address '{bind}', use the 'host:port' form, for example '0.0.0.0:8080'"
+        )
+
+    return match.group(1) or match.group(2), int(match.group(3))
+
+
+def _parse_range(value: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (first, last) byte positions requested by the single range Range
+    header value. Returns None if the whole file should be sent, raises ValueError
+    if the range cannot be satisfied.
+    """
+    match = re.match(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", value or "")
+
+    # Multiple ranges are not supported, in such case the whole file is sent
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+
+    if not match.group(1):
+        # Suffix range, the last N bytes
+        first, last = max(size - int(match.group(2)), 0), size - 1
+    else:
+        first = int(match.group(1))
+        last = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+    if first > last:
+        raise ValueError(f"Range '{value}' cannot be satisfied")
+
+    return first, last
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers '/<algorithm>/<hash>[/<filename>]' requests with cached artifacts.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = f"cekit-cache/{__version__}"
+    server: "CacheServer"
+
+    def do_HEAD(self) -> None:
+        self._serve(body=False)
+
+    def do_GET(self) -> None:
+        self._serve(body=True)
+
+    def _serve(self, body: bool) -> None:
+        entry = self._find_entry()
+
+        if entry is None:
+            self._respond(404)
+            return
+
+        try:
+            # Blob removed after the file is opened remains readable
+            blob = open(entry["cached_path"], "rb")
+        except OSError as ex:
+            logger.warning(f"Cannot read cached file '{entry['cached_path']}': {ex}")
+            self._respond(404)
+            return
+
+        with blob:
+            size = os.fstat(blob.fileno()).st_size
+            etag = f'"{entry[BLOB_ALGORITHM]}"'
+
+            if self.headers.get("If-None-Match") in [etag, "*"]:
+                self._respond(304, {"ETag": etag})
+                return
+
+            headers = {
+                "Accept-Ranges": "bytes",
+                "Content-Type": "application/octet-stream",
+                "ETag": etag,
+            }
+
+            try:
+                requested = None
+
+                # Range is ignored if the client has an outdated version of the file
+                if self.headers.get("If-Range") in [None, etag]:
+                    requested = _parse_range(self.headers.get("Range"), size)
+            except ValueError:
+                headers["Content-Range"] = f"bytes */{size}"
+                self._respond(416, headers)
+                return
+
+            status, first, count = 200, 0, size
+
+            if requested:
+                first, last = requested
+                status, count = 206, last - first + 1
+                headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+            headers["Content-Length"] = str(count)
+            self.server.cache.touch(entry)
+            self._respond(status, headers)
+
+            if body and count:
+                # Uses sendfile() if available, so the content is not copied to user space
+                self.connection.sendfile(blob, first, count)
+
+    def _find_entry(self) -> Optional[Dict[str, Any]]:
+        parts = [unquote(part) for part in urlparse(self.path).path.split("/") if part]
+
+        if (
+            len(parts) not in [2, 3]
+            or parts[0] not in SUPPORTED_HASH_ALGORITHMS
+            or not re.match(r"^[0-9a-fA-F]+$", parts[1])
+        ):
+            return None
+
+        algorithm, checksum = parts[0], parts[1]
+        entry = self.server.cache.index.find(algorithm, checksum)
+
+        if entry is None and self.server.read_through:
+            entry = self._read_through(
+                algorithm, checksum, parts[2] if len(parts) == 3 else checksum
+            )
+
+        return entry
+
+    def _read_through(
+        self, algorithm: str, checksum: str, name: str
+    ) -> Optional[Dict[str, Any]]:
+        logger.info(f"Artifact '{name}' is not cached, fetching it from upstream")
+
+        try:
+            return create_resource({"name": name, algorithm: checksum}).prefetch()
+        except CekitError as ex:
+            logger.warning(f"Cannot fetch artifact '{name}' from upstream: {ex}")
+            return None
+
+    def _respond(self, status: int, headers: Optional[Dict[str, str]] = None):
+        headers = headers or {}
+        headers.setdefault("Content-Length", "0")
+
+        self.send_response(status)
+
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+class CacheServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server exposing the artifact cache, compatible with the 'cache_url'
+    cacher URL template mechanism. Every client is served by its own thread.
+
+    Artifacts missing in the cache are answered with 404, unless read_through
+    is enabled, in which case these are fetched from cacher mirrors configured
+    in the 'cache_url' configuration key.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], read_through: bool = False):
+        if ":" in address[0]:
+            self.address_family = socket.AF_INET6
+
+        super(CacheServer, self).__init__(address, _CacheRequestHandler)
+
+        self.cache = ArtifactCache()
+        self.read_through = read_through
+
+    @property
+    def cache_url(self) -> str:
+        """Returns the cacher URL template to be used by clients"""
+        host, port = self.server_address[:2]
+
+        if ":" in host:
+            host = f"[{host}]"
+
+        return CACHE_URL_TEMPLATE.format(f"{host}:{port}")
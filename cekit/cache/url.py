@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+from cekit.cache.artifact import LOCKS_DIR, cache_directory
+from cekit.cache.lock import FileLock
+from cekit.cekit_types import PathType
+from cekit.config import Config
+from cekit.download import NotModifiedError, OfflineError, offline
+from cekit.tools import download_file, materialize_file
+
+logger = logging.getLogger("cekit")
+config = Config()
+
+URLS_DIR = "urls"
+
+# Number of seconds a file fetched from URL is used without asking the server
+# whether it changed, by default it is revalidated every time it is used
+DEFAULT_URL_CACHE_TTL = 0
+
+
+def url_cache_ttl() -> int:
+    return config.get_int("common", "url_cache_ttl", DEFAULT_URL_CACHE_TTL, minimum=0)
+
+
+class UrlCache(object):
+    """
+    Cache of files fetched from HTTP URLs, used for files without known checksums
+    which cannot be stored in the ArtifactCache. Files are stored in the 'urls'
+    subdirectory of the cache, keyed by the URL, together with the ETag and
+    Last-Modified headers sent by the server.
+
+    A cached file is reused without any request for 'url_cache_ttl' seconds,
+    then it is revalidated with a conditional request: if the server responds
+    with 304 Not Modified, the cached file is used again.
+    """
+
+    def __init__(self):
+        self.directory = os.path.join(cache_directory(), URLS_DIR)
+
+    def fetch(
+        self,
+        url: str,
+        destination: PathType,
+        cancel: Optional[threading.Event] = None,
+    ) -> None:
+        """
+        Places the file from the URL at the destination, using the cached file
+        if it did not change. URLs other than HTTP(S) are not cached.
+        """
+        if urlparse(url).scheme not in ["http", "https"]:
+            download_file(url, destination, cancel=cancel)
+            return
+
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        path = os.path.join(self.directory, key)
+
+        # Other CEKit processes must not replace the file while it is used
+        with FileLock(
+            os.path.join(cache_directory(), LOCKS_DIR, f"url-{key}"), f"URL '{url}'"
+        ):
+            metadata = self._load(path) if os.path.isfile(path) else None
+
+            if metadata and time.time() - metadata["validated_at"] < url_cache_ttl():
+                logger.debug(f"Using cached file for '{url}'")
+            elif offline():
+                if not metadata:
+                    raise OfflineError(
+                        f"File '{url}' is not cached, it cannot be downloaded in offline mode"
+                    )
+
+                logger.debug(f"Using cached file for '{url}' without revalidation")
+            else:
+                validators = dict(metadata["validators"]) if metadata else {}
+
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    download_file(url, path, cancel=cancel, validators=validators)
+                except NotModifiedError:
+                    logger.debug(f"File '{url}' was not modified, using cached file")
+
+                self._save(
+                    path,
+                    {"url": url, "validators": validators, "validated_at": time.time()},
+                )
+
+            # The cached file is writable, it must not be shared with the destination
+            materialize_file(path, destination, allow_hardlink=False)
+
+    @staticmethod
+    def _load(path: PathType) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path + ".json", "r") as file_:
+                return json.load(file_)
+        except (OSError, ValueError) as ex:
+            logger.debug(f"Could not read metadata of cached file '{path}': {ex}")
+            return None
+
+    @staticmethod
+    def _save(path: PathType, metadata: Dict[str, Any]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".metadata")
+
+        with os.fdopen(fd, "w") as file_:
+            json.dump(metadata, file_, indent=2)
+
+        os.replace(tmp, path + ".json")
@@ -60,6 +60,11 @@ def verify_release_passed(ctx, param, value):
     help="Set default options for Red Hat internal infrastructure.",
     is_flag=True,
 )
+@click.option(
+    "--offline",
+    help="Do not access network, resolve everything from local caches.",
+    is_flag=True,
+)
 @click.option(
     "--target",
     metavar="PATH",
@@ -68,7 +73,7 @@ def verify_release_passed(ctx, param, value):
     show_default=True,
 )
 @click.version_option(message="%(version)s", version=__version__)
-def cli(descriptor, verbose, nocolor, work_dir, config, redhat, target, trace):
+def cli(descriptor, verbose, nocolor, work_dir, config, redhat, offline, target, trace):
     """
     ABOUT
 
@@ -517,7 +522,11 @@ class Cekit(object):
 
         CONFIG.configure(
             self.params.config,
-            {"redhat": self.params.redhat, "work_dir": self.params.work_dir},
+            {
+                "redhat": self.params.redhat,
+                "offline": self.params.offline,
+                "work_dir": self.params.work_dir,
+            },
         )
 
     def cleanup(self):
@@ -5,6 +5,7 @@ from typing import Any, Dict, Optional
 import yaml
 
 from cekit.cekit_types import PathType
+from cekit.errors import CekitError
 
 default_work_dir = "~/.cekit"
 
@@ -24,6 +25,8 @@ class Config(object):
         # Only allow command line overriding of these values if they are not the default value.
         if cmdline_args.get("redhat"):
             cls.cfg["common"]["redhat"] = cmdline_args.get("redhat")
+        if cmdline_args.get("offline"):
+            cls.cfg["common"]["offline"] = cmdline_args.get("offline")
         if (
             cmdline_args.get("work_dir")
             and cmdline_args.get("work_dir") != default_work_dir
@@ -68,3 +71,43 @@ class Config(object):
                 )
             value = value.get(arg)
         return value
+
+    @classmethod
+    def get_bool(cls, section: str, key: str, default: bool = False) -> bool:
+        """Returns the value of the key in the section converted to a boolean,
+        default is returned if the key or section doesn't exist."""
+        value = cls.cfg.get(section, {}).get(key)
+
+        if value is None or value == "":
+            return default
+
+        if isinstance(value, str):
+            return value.strip().lower() in ["true", "yes", "on", "1"]
+
+        return bool(value)
+
+    @classmethod
+    def get_int(cls, section: str, key: str, default: int, minimum: int = 1) -> int:
+        """Returns the value of the key in the section converted to an integer,
+        default is returned if the key or section doesn't exist.
+
+        Raises:
+          CekitError if the value is not an integer or it is lower than minimum."""
+        value = cls.cfg.get(section, {}).get(key)
+
+        if value is None or value == "":
+            return default
+
+        try:
+            value = int(value)
+        except ValueError:
+            raise CekitError(
+                f"Configuration key '{section}/{key}' must be an integer, got '{value}'"
+            )
+
+        if value < minimum:
+            raise CekitError(
+                f"Configuration key '{section}/{key}' must be at least {minimum}, got '{value}'"
+            )
+
+        return value
@@ -1,6 +1,6 @@
 import hashlib
 import logging
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional
 
 from cekit.cekit_types import PathType
 
@@ -13,35 +13,120 @@ SUPPORTED_SOURCE_HASH_ALGORITHMS: List[str] = [
     "source-md5",
 ]
 
+# Size of the buffer used to read files while computing checksums. Digest
+# computation releases the GIL for such large chunks, so hashing can run
+# in parallel to other work.
+READ_BUFFER_SIZE = 1048576  # 1 MB
 
-def get_sum(target: PathType, algorithm: str) -> str:
-    hash_function = getattr(hashlib, algorithm)()
 
-    logger.debug(f"Computing {algorithm} checksum for '{target}' file")
+class MultiHasher(object):
+    """
+    Computes digests for multiple algorithms at once, every chunk
+    of data is fed to all hash objects.
+    """
+
+    def __init__(self, algorithms: Iterable[str]):
+        self._hashes = {
+            algorithm: hashlib.new(algorithm) for algorithm in dict.fromkeys(algorithms)
+        }
+
+    @property
+    def algorithms(self) -> List[str]:
+        return list(self._hashes.keys())
 
-    with open(target, "rb") as f:
-        for chunk in iter(lambda: f.read(65536), b""):
+    def update(self, chunk: bytes) -> None:
+        for hash_function in self._hashes.values():
             hash_function.update(chunk)
-    return hash_function.hexdigest()
 
+    def update_file(
+        self, target: PathType, throttle: Optional[Callable[[int], None]] = None
+    ) -> None:
+        """
+        Feeds the whole content of the target file to all hash objects. The optional
+        throttle is called with the size of every chunk read, it can block to limit
+        the read rate.
+        """
+        buffer = bytearray(READ_BUFFER_SIZE)
+        view = memoryview(buffer)
 
-def check_sum(target: PathType, algorithm: str, expected: str) -> bool:
-    """Check that file checksum is correct
+        with open(target, "rb", buffering=0) as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                if throttle:
+                    throttle(read)
+                self.update(view[:read])
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {
+            algorithm: hash_function.hexdigest()
+            for algorithm, hash_function in self._hashes.items()
+        }
+
+
+def get_sums(
+    target: PathType,
+    algorithms: Iterable[str],
+    throttle: Optional[Callable[[int], None]] = None,
+) -> Dict[str, str]:
+    """
+    Computes checksums for all requested algorithms reading the target file only once.
+
+    Returns dictionary where the key is the algorithm and the value is the hex digest.
+    """
+    hasher = MultiHasher(algorithms)
+
+    logger.debug(
+        f"Computing {', '.join(hasher.algorithms)} checksum(s) for '{target}' file"
+    )
+
+    hasher.update_file(target, throttle)
+
+    return hasher.hexdigests()
+
+
+def get_sum(target: PathType, algorithm: str) -> str:
+    return get_sums(target, [algorithm])[algorithm]
+
+
+def check_sums(target: PathType, expected: Dict[str, str]) -> bool:
+    """Check that file checksums are correct, the file is read only once
     Args:
-      alg - algorithm which will be used for digest
-      expected_checksum - checksum which artifact must match
+      expected - dictionary where the key is the algorithm and the value the checksum
+        which artifact must match
     """
-    logger.debug(f"Checking '{target}' {algorithm} hash...")
+    logger.debug(f"Checking '{target}' {', '.join(expected.keys())} hash(es)...")
+
+    return compare_sums(target, get_sums(target, expected.keys()), expected)
 
-    checksum = get_sum(target, algorithm)
 
-    if checksum.lower() != expected.lower():
-        logger.error(
-            "The {} computed for the '{}' file ('{}') doesn't match the '{}' value".format(
-                algorithm, target, checksum, expected
+def compare_sums(
+    target: PathType, checksums: Dict[str, str], expected: Dict[str, str]
+) -> bool:
+    """Check that already computed checksums of the target match the expected ones
+    Args:
+      checksums - dictionary where the key is the algorithm and the value the computed checksum
+      expected - dictionary where the key is the algorithm and the value the checksum
+        which artifact must match
+    """
+    for algorithm, checksum in expected.items():
+        if checksums[algorithm].lower() != checksum.lower():
+            logger.error(
+                "The {} computed for the '{}' file ('{}') doesn't match the '{}' value".format(
+                    algorithm, target, checksums[algorithm], checksum
+                )
             )
-        )
-        return False
+            return False
 
     logger.debug("Hash is correct.")
     return True
+
+
+def check_sum(target: PathType, algorithm: str, expected: str) -> bool:
+    """Check that file checksum is correct
+    Args:
+      alg - algorithm which will be used for digest
+      expected_checksum - checksum which artifact must match
+    """
+    return check_sums(target, {algorithm: expected})
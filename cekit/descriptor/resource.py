@@ -1,20 +1,41 @@
 import json
 import logging
 import os
+import queue
 import shutil
+import threading
+import time
 from abc import abstractmethod
-from typing import Any, Dict, Optional, overload
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union, overload
+from urllib.parse import urlparse
 
 from cekit.cekit_types import _T, PathType
 from cekit.config import Config
-from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, check_sum
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS, check_sums
 from cekit.descriptor import Descriptor
-from cekit.errors import CekitError
-from cekit.tools import Chdir, Map, download_file, get_brew_url, run_wrapper
+from cekit.download import DownloadCancelledError, OfflineError
+from cekit.errors import CekitChecksumError, CekitError
+from cekit.mirrors import cache_urls, mirror_stats, ordered_cache_urls
+from cekit.parallel import SingleFlight
+from cekit.tools import (
+    Map,
+    download_file,
+    get_brew_url,
+    materialize_file,
+)
 
 logger = logging.getLogger("cekit")
 config = Config()
 
+DEFAULT_FETCH_HEDGE_DELAY = 10
+
+# Source of a resource: name, function returning the URL and whether to use cacher
+# (or the cacher URL template to use, if multiple cacher mirrors are configured)
+_Source = Tuple[str, Callable[[], Optional[str]], Union[bool, str]]
+
+# Resources fetched concurrently are fetched only once
+_fetches = SingleFlight()
+
 RawResourceDescriptor = Dict[str, Any]
 
 artifact_dest = "/tmp/artifacts/"
@@ -232,24 +253,101 @@ class Resource(Descriptor):
             logger.debug(f"Local resource '{self.name}' exists and is valid")
             return target
 
+        # The stale file may be linked to a cached artifact, it must never be written to
+        if os.path.isfile(target) or os.path.islink(target):
+            os.remove(target)
+
+        key = self.fetch_key()
+
+        if not set(SUPPORTED_HASH_ALGORITHMS).intersection(self):
+            if key is None:
+                return self.guarded_copy(target)
+
+            # Artifacts without checksum cannot be cached, concurrent fetches
+            # of the same file share a single download
+            source = _fetches.do(key, lambda: self.guarded_copy(target))
+
+            if source != target:
+                logger.debug(f"Using '{source}' file already fetched for '{key}'")
+                materialize_file(source, target, allow_hardlink=False)
+
+            return target
+
+        cached_resource = self.prefetch()
+
+        self.cache.touch(cached_resource)
+
+        self.cache.materialize(cached_resource, target)
+        # Cached artifacts were verified when added to the cache, record it for the copy
+        # so that it is not verified again on subsequent builds
+        self.cache.stamp(
+            target,
+            {
+                algorithm: cached_resource[algorithm]
+                for algorithm in SUPPORTED_HASH_ALGORITHMS
+                if cached_resource.get(algorithm)
+            },
+        )
+        logger.info(f"Using cached artifact '{self.name}'.")
+        return target
+
+    def prefetch(self) -> Dict[str, Any]:
+        """
+        Makes sure the resource is cached, fetching it if needed, without copying it
+        anywhere. Returns the cache entry. Only resources with checksum can be cached.
+        """
+        if not set(SUPPORTED_HASH_ALGORITHMS).intersection(self):
+            raise CekitError(
+                f"Artifact '{self.name}' cannot be cached, it does not define any checksum"
+            )
+
+        # Concurrent fetches of the same artifact share a single fetch and verification
+        cached_resource = _fetches.do(self.fetch_key(), self.__cache)
+
+        # The same content may be known under different names
+        if self.name not in cached_resource["names"]:
+            self.cache.add_alias(self)
+
+        return cached_resource
+
+    def __cache(self) -> Dict[str, Any]:
+        """Makes sure the resource is cached, returns the cache entry"""
         cached_resource = self.cache.cached(self)
 
         if cached_resource:
-            shutil.copy(cached_resource["cached_path"], target)
-            logger.info(f"Using cached artifact '{self.name}'.")
+            return cached_resource
 
-        else:
-            try:
+        # Other CEKit process may be fetching the same artifact,
+        # wait for it to finish and use the result
+        with self.cache.lock(self.fetch_key()):
+            cached_resource = self.cache.cached(self)
+
+            if not cached_resource:
                 self.cache.add(self)
                 cached_resource = self.cache.get(self)
-                shutil.copy(cached_resource["cached_path"], target)
-                logger.info(f"Using cached artifact '{self.name}'.")
-            except ValueError:
-                return self.guarded_copy(target)
+
+        return cached_resource
+
+    def fetch_key(self) -> Optional[str]:
+        """
+        Returns the key identifying the content of the resource. Resources with the same
+        key are fetched only once, see SingleFlight. None means the resource is always fetched.
+        """
+        for algorithm in SUPPORTED_HASH_ALGORITHMS:
+            if self.get(algorithm):
+                return f"{algorithm}:{self[algorithm].lower()}"
+
+        return None
 
     def guarded_copy(self, target: PathType) -> PathType:
         try:
             self._copy_impl(target)
+        except CekitChecksumError as ex:
+            raise CekitError("Artifact checksum verification failed!") from ex
+        except OfflineError as ex:
+            raise OfflineError(
+                f"Resource '{self.name}' is not available locally: {ex.message}"
+            ) from ex
         except Exception as ex:
             logger.warning(
                 "Cekit is not able to fetch resource '{}' automatically. "
@@ -284,15 +382,36 @@ class Resource(Descriptor):
         if os.path.isdir(target):
             logger.info("Target is directory, cannot verify checksum.")
             return True
-        for algorithm in SUPPORTED_HASH_ALGORITHMS:
-            if algorithm in self and self[algorithm]:
-                if not check_sum(target, algorithm, self[algorithm]):
-                    return False
+        checksums = self._checksums()
+        # Files verified earlier and not modified since then do not need to be read again
+        if not config.get_bool("common", "force_verify") and self.cache.verified(
+            target, checksums
+        ):
+            logger.debug(
+                f"File '{target}' was already verified and is unchanged, skipping verification."
+            )
+            return True
+        # All checksums are computed in a single pass over the file
+        if not check_sums(target, checksums):
+            return False
+        self.cache.stamp(target, checksums)
         return True
 
+    def fetch_host(self) -> Optional[str]:
+        """
+        Returns the host the resource will be fetched from, or None if it is not
+        fetched over network. Used to limit the number of concurrent fetches per host.
+        """
+        if self._cacher_available():
+            return urlparse(ordered_cache_urls()[0]).hostname
+
+        return None
+
     # TODO: This seems to unnecessarily use name mangling.
-    def __substitute_cache_url(self, url: str) -> str:
-        cache = config.get("common", "cache_url")
+    def __substitute_cache_url(self, url: str, cache: Optional[str] = None) -> str:
+        # Unless requested otherwise, use the fastest healthy cacher mirror
+        if cache is None:
+            cache = next(iter(ordered_cache_urls()), None)
 
         if not cache:
             return url
@@ -314,16 +433,199 @@ class Resource(Descriptor):
         return url
 
     def _download_file(
-        self, url: Optional[str], destination: PathType, use_cache=True
-    ) -> None:
-        """Downloads a file from url and save it as destination"""
-        if use_cache:
+        self,
+        url: Optional[str],
+        destination: PathType,
+        use_cache: Union[bool, str] = True,
+        cancel: Optional[threading.Event] = None,
+    ) -> Dict[str, str]:
+        """Downloads a file from url and save it as destination
+
+        If use_cache is a cacher URL template, the file is downloaded from
+        that cacher mirror instead of the preferred one.
+        Defined checksums are verified while the file is downloaded,
+        computed checksums of the file are returned.
+
+        Files without checksums are fetched through the UrlCache, so that
+        unchanged files are not downloaded again."""
+        if use_cache is True:
             url = self.__substitute_cache_url(url)
+        elif use_cache:
+            url = self.__substitute_cache_url(url, use_cache)
         if not url:
             raise CekitError(
                 f"Artifact {self.name} cannot be downloaded, no URL provided"
             )
-        download_file(url, destination)
+
+        if not self._checksums():
+            # forwarded import to prevent circular imports
+            from cekit.cache.url import UrlCache
+
+            UrlCache().fetch(url, destination, cancel=cancel)
+            return {}
+
+        checksums = self._checksums() if Resource.CHECK_INTEGRITY else {}
+        return download_file(url, destination, checksums, cancel=cancel)
+
+    def _stamp(self, target: PathType, digests: Dict[str, str]) -> None:
+        """
+        Records checksums computed while the file was downloaded as verified,
+        so that the file is not read again.
+        """
+        if digests and self._checksums():
+            self.cache.stamp(target, digests)
+
+    def _cacher_available(self) -> bool:
+        """Returns True if the resource can be fetched from cacher"""
+        return bool(cache_urls()) and bool(
+            set(SUPPORTED_HASH_ALGORITHMS).intersection(self)
+        )
+
+    def _cacher_sources(self, url: Callable[[], Optional[str]]) -> List[_Source]:
+        """
+        Returns sources for all configured cacher mirrors,
+        the fastest healthy mirror first.
+        """
+        mirrors = ordered_cache_urls()
+
+        if len(mirrors) == 1:
+            return [("cacher", url, True)]
+
+        return [
+            (f"cacher '{urlparse(mirror).netloc}'", url, mirror) for mirror in mirrors
+        ]
+
+    def _record_mirror(self, use_cache: Union[bool, str], error: Optional[Exception]):
+        """Records the result of a fetch from one of multiple cacher mirrors"""
+        if not isinstance(use_cache, str) or isinstance(error, DownloadCancelledError):
+            return
+
+        mirror_stats().record(use_cache, error is None)
+
+    def _fetch_hedged(self, sources: List[_Source], target: PathType) -> PathType:
+        """
+        Fetches the resource from the first source which delivers the file with
+        valid checksums. Sources are tried in the provided order, but the next source
+        is started already if the previous one does not finish within
+        the 'fetch_hedge_delay' number of seconds (or immediately, if it fails).
+        Once the file is fetched from one of the sources, other sources are cancelled.
+
+        Every source is a tuple of the source name, function returning the URL
+        and whether to use cacher (or the cacher mirror URL template). Results
+        of fetches from cacher mirrors are recorded, see MirrorStats.
+        """
+        if len(sources) == 1:
+            name, url, use_cache = sources[0]
+            start = time.monotonic()
+
+            try:
+                digests = self._download_file(url(), target, use_cache)
+            except Exception as ex:
+                self._record_mirror(use_cache, ex)
+                raise
+
+            self._record_mirror(use_cache, None)
+            self._stamp(target, digests)
+            logger.debug(
+                "Artifact '{}' fetched from {} in {:.2f} seconds".format(
+                    self.name, name, time.monotonic() - start
+                )
+            )
+            return target
+
+        delay = config.get_int("common", "fetch_hedge_delay", DEFAULT_FETCH_HEDGE_DELAY)
+        cancel = threading.Event()
+        lock = threading.Lock()
+        finished: "queue.Queue[Tuple[str, Optional[Exception], float]]" = queue.Queue()
+        winner: List[Tuple[str, PathType, Dict[str, str], float]] = []
+
+        def fetch(
+            name: str,
+            url: Callable[[], Optional[str]],
+            use_cache: Union[bool, str],
+            destination: PathType,
+        ):
+            start = time.monotonic()
+            error = None
+
+            try:
+                digests = self._download_file(url(), destination, use_cache, cancel)
+
+                with lock:
+                    if winner:
+                        os.remove(destination)
+                    else:
+                        winner.append(
+                            (name, destination, digests, time.monotonic() - start)
+                        )
+                        cancel.set()
+            except Exception as ex:
+                error = ex
+
+            self._record_mirror(use_cache, error)
+            finished.put((name, error, time.monotonic() - start))
+
+        def start_next() -> None:
+            name, url, use_cache = sources[len(started)]
+            destination = f"{target}.{len(started)}"
+            started.append(name)
+            threading.Thread(
+                target=fetch, args=(name, url, use_cache, destination), daemon=True
+            ).start()
+
+        started: List[str] = []
+        completed = 0
+        last_error: Optional[Exception] = None
+
+        start_next()
+
+        while completed < len(started):
+            try:
+                name, error, elapsed = finished.get(
+                    timeout=delay if len(started) < len(sources) else None
+                )
+            except queue.Empty:
+                logger.info(
+                    "Fetching artifact '{}' from {} takes more than {} seconds, trying {} too".format(
+                        self.name, started[-1], delay, sources[len(started)][0]
+                    )
+                )
+                start_next()
+                continue
+
+            completed += 1
+
+            with lock:
+                if winner:
+                    name, destination, digests, elapsed = winner[0]
+                    shutil.move(destination, target)
+                    self._stamp(target, digests)
+                    logger.info(
+                        "Artifact '{}' fetched from {} in {:.2f} seconds".format(
+                            self.name, name, elapsed
+                        )
+                    )
+                    return target
+
+            logger.warning(
+                "Could not fetch artifact '{}' from {} (failed after {:.2f} seconds): {}".format(
+                    self.name, name, elapsed, error
+                )
+            )
+            last_error = error
+
+            if len(started) < len(sources):
+                start_next()
+
+        raise last_error
+
+    def _checksums(self) -> Dict[str, str]:
+        """Returns all checksums defined for the resource"""
+        return {
+            algorithm: self[algorithm]
+            for algorithm in SUPPORTED_HASH_ALGORITHMS
+            if algorithm in self and self[algorithm]
+        }
 
 
 class _PathResource(Resource):
@@ -372,15 +674,14 @@ class _PathResource(Resource):
 
     def _copy_impl(self, target: PathType) -> PathType:
         if not os.path.exists(self.path):
-            cache = config.get("common", "cache_url")
-
             # If cache_url is specified in Cekit configuration
             # file - try to fetch the 'path' artifact from cacher
             # even if it was not defined as 'url'.
-            if cache:
+            if cache_urls():
                 try:
-                    self._download_file(self.path, target)
-                    return target
+                    return self._fetch_hedged(
+                        self._cacher_sources(lambda: self.path), target
+                    )
                 except Exception as ex:
                     raise CekitError(
                         f"Could not download resource '{self.name}' from cache"
@@ -396,7 +697,9 @@ class _PathResource(Resource):
         if os.path.isdir(self.path):
             shutil.copytree(self.path, target)
         else:
-            shutil.copy2(self.path, target)
+            # Source files are not under our control, never hardlink these
+            # unless explicitly requested by the user
+            materialize_file(self.path, target, allow_hardlink=False)
         return target
 
 
@@ -448,9 +751,11 @@ class _UrlResource(Resource):
         # Normalize the URL
         self["url"] = descriptor.get("url").strip()
 
-    # Avoid protected access warning
-    def download_file(self, url: str, destination: PathType):
-        return self._download_file(url, destination, use_cache=False)
+    def fetch_host(self) -> Optional[str]:
+        return super(_UrlResource, self).fetch_host() or urlparse(self.url).hostname
+
+    def fetch_key(self) -> Optional[str]:
+        return super(_UrlResource, self).fetch_key() or f"url:{self.url}"
 
     def _get_default_name_value(self, descriptor: RawResourceDescriptor) -> str:
         """
@@ -459,14 +764,12 @@ class _UrlResource(Resource):
         return os.path.basename(descriptor.get("url"))
 
     def _copy_impl(self, target: PathType) -> PathType:
-        try:
-            self._download_file(self.url, target)
-        except Exception:
-            logger.debug(
-                f"Cannot hit artifact: '{self.name}' via cache, trying directly."
-            )
-            self._download_file(self.url, target, use_cache=False)
-        return target
+        sources: List[_Source] = [("url", lambda: self.url, False)]
+
+        if self._cacher_available():
+            sources[:0] = self._cacher_sources(lambda: self.url)
+
+        return self._fetch_hedged(sources, target)
 
 
 class _GitResource(Resource):
@@ -504,12 +807,10 @@ class _GitResource(Resource):
         return os.path.basename(descriptor.get("git", {}).get("url")).split(".", 1)[0]
 
     def _copy_impl(self, target: PathType) -> PathType:
-        cmd = ["git", "clone", self.git.url, target]
-        run_wrapper(cmd, False, f"Could not clone from {self.git.url}")
+        # forwarded import to prevent circular imports
+        from cekit.cache.git import GitMirror
 
-        with Chdir(target):
-            cmd = ["git", "checkout", self.git.ref]
-            run_wrapper(cmd, False, f"Could not checkout from {self.git.ref}")
+        GitMirror(self.git.url).checkout(self.git.ref, target)
 
         return target
 
@@ -559,33 +860,30 @@ class _PlainResource(Resource):
         super(_PlainResource, self).__init__(descriptor)
 
     def _copy_impl(self, target: PathType) -> PathType:
+        sources: List[_Source] = []
+
         # First of all try to download the file using cacher if specified
-        if config.get("common", "cache_url"):
-            try:
-                self._download_file(url=None, destination=target)
-                return target
-            except Exception as e:
-                logger.debug(str(e))
-                logger.warning(
-                    f"Could not download '{self.name}' artifact using cacher"
-                )
+        if cache_urls():
+            sources.extend(self._cacher_sources(lambda: None))
 
         # Next option is to download it from Brew directly but only if the md5 checksum
         # is provided and we are running with the --redhat switch
         if self.md5 and config.get("common", "redhat"):
-            logger.debug(
-                f"Trying to download artifact '{self.name}' from Brew directly"
-            )
+            # Generate the URL
+            sources.append(("Brew", lambda: get_brew_url(self.md5), False))
 
+        if sources:
             try:
-                # Generate the URL
-                url = get_brew_url(self.md5)
-                # Use the URL to download the file
-                self._download_file(url, target, use_cache=False)
-                return target
+                return self._fetch_hedged(sources, target)
+            except (CekitChecksumError, OfflineError):
+                raise
             except Exception as e:
                 logger.debug(str(e))
-                logger.warning(f"Could not download artifact '{self.name}' from Brew")
+                logger.warning(
+                    "Could not download artifact '{}' from {}".format(
+                        self.name, " or ".join(name for name, _, _ in sources)
+                    )
+                )
 
         raise CekitError(f"Artifact {self.name} could not be found")
 
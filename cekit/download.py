@@ -0,0 +1,635 @@
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import ssl
+import threading
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+from urllib.request import Request, getproxies, proxy_bypass
+from urllib.request import urlopen as urllib_urlopen
+
+from cekit.cache.lock import FileLock
+from cekit.cekit_types import PathType
+from cekit.config import Config
+from cekit.errors import CekitError
+from cekit.version import __version__
+
+logger = logging.getLogger("cekit")
+config = Config()
+
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_READ_TIMEOUT = 300
+
+# Maximum number of idle connections kept open for a single host
+MAX_IDLE_CONNECTIONS = 8
+MAX_REDIRECTS = 10
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+USER_AGENT = f"cekit/{__version__}"
+
+_ConnectionKey = Tuple[str, str, int, ssl.SSLContext]
+
+
+class PooledResponse(object):
+    """
+    Response of a request made by the DownloadClient. The underlying connection
+    is returned to the pool once the response body is completely read, closing
+    the response before that closes the connection.
+    """
+
+    def __init__(self, client: "DownloadClient", key: _ConnectionKey, connection, url):
+        self.url = url
+        self._client = client
+        self._key = key
+        self._connection = connection
+        self._response = connection.getresponse()
+
+    def getcode(self) -> int:
+        return self._response.status
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._response.getheader(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self._response.read(amt)
+
+        if self._response.isclosed():
+            self._release()
+
+        return data
+
+    def close(self) -> None:
+        if self._connection is None:
+            return
+
+        if not self._response.isclosed():
+            # Unread data would be received as response to the next request
+            self._connection.close()
+            self._connection = None
+            return
+
+        self._release()
+
+    def _release(self) -> None:
+        if self._connection is None:
+            return
+
+        if self._response.will_close:
+            self._connection.close()
+        else:
+            self._client._release(self._key, self._connection)
+
+        self._connection = None
+
+    def __enter__(self) -> "PooledResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ErrorResponse(object):
+    """
+    Response with an error status code received through a proxy. urllib raises
+    such responses as HTTPError, this makes them look like any other response.
+    """
+
+    def __init__(self, error: HTTPError):
+        self.url = error.url
+        self._error = error
+
+    def getcode(self) -> int:
+        return self._error.code
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._error.headers.get(name, default)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if self._error.fp is None:
+            return b""
+
+        return self._error.read(amt)
+
+    def close(self) -> None:
+        self._error.close()
+
+    def __enter__(self) -> "ErrorResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class DownloadClient(object):
+    """
+    HTTP(S) client shared by all downloads within the process. Connections to
+    hosts are kept alive and reused by subsequent requests. The SSL context
+    and authentication headers are prepared once, when the client is created.
+    """
+
+    def __init__(
+        self,
+        ssl_verify: bool = True,
+        url_authentication: Optional[str] = None,
+        connect_timeout: int = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: int = DEFAULT_READ_TIMEOUT,
+    ):
+        self.settings = (ssl_verify, url_authentication, connect_timeout, read_timeout)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.context = ssl.create_default_context()
+
+        if not ssl_verify:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+
+        self._authentication: Dict[str, Tuple[str, str]] = {}
+
+        if url_authentication:
+            for host, credentials in [
+                x.split("#") for x in url_authentication.split(";")
+            ]:
+                self._authentication.setdefault(
+                    host,
+                    (
+                        credentials.split(":")[0],
+                        "Basic {}".format(
+                            base64.b64encode(credentials.encode("latin-1")).decode()
+                        ),
+                    ),
+                )
+
+        self._idle: Dict[_ConnectionKey, List[HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        method: Optional[str] = None,
+    ) -> Request:
+        """Prepares request for the URL, including authentication for the host"""
+        request = Request(url, headers=headers or {}, method=method)
+        hostname = urlparse(url).hostname
+
+        if hostname in self._authentication:
+            username, authorization = self._authentication[hostname]
+            logger.debug(
+                f"Located matching hostname '{hostname}' to add authentication with username '{username}'."
+            )
+            request.add_header("Authorization", authorization)
+
+        return request
+
+    def open(
+        self, request: Request, context: Optional[ssl.SSLContext] = None
+    ) -> PooledResponse:
+        """
+        Executes the request following redirects. Unlike urllib, responses with
+        an error status code are returned and not raised. No request is made
+        in offline mode, OfflineError is raised instead.
+        """
+        url = request.full_url
+
+        ensure_online(f"fetch '{url}'")
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._open(request, context)
+
+            location = response.getheader("Location")
+
+            if response.getcode() not in REDIRECT_CODES or not location:
+                return response
+
+            # Redirect responses have tiny (if any) bodies, read it to reuse the connection
+            response.read()
+            response.close()
+
+            location = urljoin(request.full_url, location)
+            logger.debug(
+                f"Following redirect from '{request.full_url}' to '{location}'"
+            )
+
+            # Authentication is applied based on the host we are redirected to
+            request = self.request(
+                location,
+                {
+                    name: value
+                    for name, value in request.header_items()
+                    if name not in ["Authorization", "Host"]
+                },
+                method=request.get_method(),
+            )
+
+        raise CekitError(f"Too many redirects while downloading '{url}'")
+
+    def close(self) -> None:
+        """Closes all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _open(self, request: Request, context: Optional[ssl.SSLContext]):
+        parsed_url = urlparse(request.full_url)
+        context = context or self.context
+
+        if self._proxied(parsed_url.scheme, parsed_url.hostname):
+            # Proxies are left to urllib, connections are not reused in such case
+            try:
+                return urllib_urlopen(
+                    request, context=context, timeout=self.read_timeout
+                )
+            except HTTPError as ex:
+                return ErrorResponse(ex)
+
+        key = (
+            parsed_url.scheme,
+            parsed_url.hostname,
+            parsed_url.port or (443 if parsed_url.scheme == "https" else 80),
+            context,
+        )
+
+        path = parsed_url.path or "/"
+
+        if parsed_url.query:
+            path = f"{path}?{parsed_url.query}"
+
+        headers = dict(request.header_items())
+        headers.setdefault("User-agent", USER_AGENT)
+
+        while True:
+            connection, reused = self._acquire(key)
+
+            try:
+                connection.request(request.get_method(), path, headers=headers)
+                return PooledResponse(self, key, connection, request.full_url)
+            except (ConnectionError, HTTPException):
+                connection.close()
+
+                # The server may close idle keep-alive connection at any time
+                if reused:
+                    logger.debug(
+                        f"Reused connection to '{parsed_url.netloc}' was closed, reconnecting"
+                    )
+                    continue
+
+                raise
+
+    def _proxied(self, scheme: str, hostname: str) -> bool:
+        return scheme in getproxies() and not proxy_bypass(hostname)
+
+    def _acquire(self, key: _ConnectionKey) -> Tuple[HTTPConnection, bool]:
+        with self._lock:
+            connections = self._idle.get(key)
+
+            if connections:
+                return connections.pop(), True
+
+        scheme, host, port, context = key
+
+        if scheme == "https":
+            connection = HTTPSConnection(
+                host, port, timeout=self.connect_timeout, context=context
+            )
+        else:
+            connection = HTTPConnection(host, port, timeout=self.connect_timeout)
+
+        connection.connect()
+        # Connection timeout is used only while connecting, afterwards
+        # the read timeout applies to every blocking socket operation
+        connection.sock.settimeout(self.read_timeout)
+
+        return connection, False
+
+    def _release(self, key: _ConnectionKey, connection: HTTPConnection) -> None:
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+
+            if len(connections) < MAX_IDLE_CONNECTIONS:
+                connections.append(connection)
+                return
+
+        connection.close()
+
+
+_client: Optional[DownloadClient] = None
+_client_lock = threading.Lock()
+
+
+def download_client() -> DownloadClient:
+    """
+    Returns the process-wide download client. The client is recreated
+    if the configuration it was created with changed.
+    """
+    global _client
+
+    verify = config.get("common", "ssl_verify")
+    if str(verify).lower() == "false":
+        verify = False
+
+    settings = (
+        bool(verify),
+        config.get("common", "url_authentication"),
+        config.get_int("common", "connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+        config.get_int("common", "read_timeout", DEFAULT_READ_TIMEOUT),
+    )
+
+    with _client_lock:
+        if _client is None or _client.settings != settings:
+            if _client is not None:
+                _client.close()
+
+            _client = DownloadClient(*settings)
+
+        return _client
+
+
+def reset_download_client() -> None:
+    """Closes and drops the process-wide download client"""
+    global _client
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+
+        _client = None
+
+
+def urlopen(request: Request, context: Optional[ssl.SSLContext] = None):
+    """Opens the request reusing connections of the process-wide download client"""
+    return download_client().open(request, context=context)
+
+
+class OfflineError(CekitError):
+    """Network access is needed, but CEKit runs in offline mode"""
+
+
+def offline() -> bool:
+    """
+    Returns True if CEKit must not access the network, see the '--offline' switch.
+    Everything has to be resolved from local caches in such case.
+    """
+    return config.get_bool("common", "offline")
+
+
+def ensure_online(what: str) -> None:
+    """Raises OfflineError if CEKit runs in offline mode, what describes the network access"""
+    if offline():
+        raise OfflineError(f"Cannot {what}, CEKit runs in offline mode")
+
+
+class TransientDownloadError(CekitError):
+    """Download failed for a reason which may go away when retried"""
+
+
+class DownloadCancelledError(CekitError):
+    """Download was cancelled, because the file is not needed anymore"""
+
+
+class NotModifiedError(CekitError):
+    """Conditional download was not performed, because the remote file did not change"""
+
+
+def conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+    """
+    Returns headers making the request conditional on the remote file being
+    different from the one described by validators, see response_validators().
+    """
+    headers = {}
+
+    if validators.get("ETag"):
+        headers["If-None-Match"] = validators["ETag"]
+
+    if validators.get("Last-Modified"):
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    return headers
+
+
+def response_validators(response) -> Dict[str, str]:
+    """
+    Returns the ETag and Last-Modified headers of the response, these can be
+    used later to check whether the remote file changed.
+    """
+    return {
+        name: str(response.getheader(name))
+        for name in ["ETag", "Last-Modified"]
+        if response.getheader(name)
+    }
+
+
+# HTTP status codes which signal a temporary problem of the server
+TRANSIENT_STATUS_CODES = [408, 429, 500, 502, 503, 504]
+
+DEFAULT_RETRY_BACKOFF = 1.0
+
+
+class RetryPolicy(object):
+    """
+    Defines how many times a download is attempted and how long to wait between
+    attempts. The delay doubles with every attempt.
+    """
+
+    def __init__(self, attempts: int = 1, backoff: float = DEFAULT_RETRY_BACKOFF):
+        self.attempts = attempts
+        self.backoff = backoff
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        if attempt >= self.attempts:
+            return False
+
+        return isinstance(error, (OSError, HTTPException, TransientDownloadError))
+
+    def delay(self, attempt: int) -> float:
+        return self.backoff * 2 ** (attempt - 1)
+
+    @staticmethod
+    def for_url(url: str) -> "RetryPolicy":
+        """
+        Returns retry policy for the URL as defined by the 'download_retries'
+        configuration option. Host specific policy takes precedence
+        over the policy defined for the URL scheme.
+        """
+        policies: Dict[str, str] = {}
+
+        if config.get("common", "download_retries"):
+            policies = dict(
+                x.strip().split("#")
+                for x in config.get("common", "download_retries").split(";")
+                if x.strip()
+            )
+
+        parsed_url = urlparse(url)
+        policy = policies.get(parsed_url.hostname) or policies.get(parsed_url.scheme)
+
+        if not policy:
+            return RetryPolicy()
+
+        try:
+            attempts, _, backoff = policy.partition(":")
+            return RetryPolicy(
+                int(attempts), float(backoff) if backoff else DEFAULT_RETRY_BACKOFF
+            )
+        except ValueError:
+            raise CekitError(
+                f"Invalid 'download_retries' policy '{policy}', expected '<attempts>[:<backoff>]'"
+            )
+
+
+def content_range_starts_at(response, start: int) -> bool:
+    """Checks whether the response is a partial content starting at the position"""
+    if response.getcode() != 206:
+        return False
+
+    content_range = str(response.getheader("Content-Range", ""))
+
+    # Content-Range: bytes <start>-<end>/<size>
+    try:
+        return int(content_range.split()[1].split("-")[0]) == start
+    except (IndexError, ValueError):
+        return False
+
+
+DEFAULT_DOWNLOAD_SEGMENTS = 4
+DEFAULT_DOWNLOAD_SEGMENT_THRESHOLD = 64  # MB
+
+
+def download_segments(response) -> Optional[List[Tuple[int, int]]]:
+    """
+    Splits the file to be downloaded into byte ranges (segments) which can be
+    downloaded concurrently, returns a list of (start, end) tuples. Returns None
+    if the file should be downloaded in a single stream, because it is small,
+    the server does not support range requests, or it is disabled in configuration.
+    """
+    count = config.get_int("common", "download_segments", DEFAULT_DOWNLOAD_SEGMENTS)
+    threshold = config.get_int(
+        "common", "download_segment_threshold", DEFAULT_DOWNLOAD_SEGMENT_THRESHOLD
+    )
+
+    if count < 2 or not hasattr(os, "pwrite"):
+        return None
+
+    if str(response.getheader("Accept-Ranges", "")).lower() != "bytes":
+        return None
+
+    try:
+        size = int(response.getheader("Content-Length") or 0)
+    except (TypeError, ValueError):
+        return None
+
+    if size < threshold * 1048576:
+        return None
+
+    segment = -(-size // count)
+
+    return [
+        (start, min(start + segment, size) - 1) for start in range(0, size, segment)
+    ]
+
+
+class PartialDownload(object):
+    """
+    Incomplete download of a URL stored in the 'partial' subdirectory of the cache,
+    so that it can be resumed later. The validator (ETag or Last-Modified header)
+    of the remote file is stored next to it, the download is resumed only if
+    the remote file did not change.
+
+    Used as a context manager, ensures that a single thread of all CEKit processes
+    writes to the partial download at a time.
+    """
+
+    def __init__(self, url: str):
+        cache_dir = os.path.join(
+            os.path.expanduser(config.get("common", "work_dir")), "cache"
+        )
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+        self.url = url
+        self.path = os.path.join(cache_dir, "partial", key + ".part")
+        self._validator_path = self.path + ".validator"
+        # Checksum locks do not cover downloads of the same URL with different
+        # checksums (or without any lock at all), the partial file has its own
+        self._lock = FileLock(
+            os.path.join(cache_dir, "locks", f"partial-{key}"),
+            f"partial download of '{url}'",
+        )
+
+    def __enter__(self) -> "PartialDownload":
+        self._lock.__enter__()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._lock.__exit__(*args)
+
+    @property
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def validator(self) -> Optional[str]:
+        try:
+            with open(self._validator_path, "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def resume_headers(self) -> Dict[str, str]:
+        """Returns headers requesting the rest of the file, if it can be resumed"""
+        if not self.size or not self.validator:
+            return {}
+
+        return {"Range": f"bytes={self.size}-", "If-Range": self.validator}
+
+    def resumes(self, response) -> bool:
+        """
+        Checks whether the response contains the rest of the partially downloaded file.
+        """
+        return bool(self.size) and content_range_starts_at(response, self.size)
+
+    def start(self, response) -> None:
+        """Starts the download from scratch, recording the validator of the remote file"""
+        etag = response.getheader("ETag")
+        validator = None
+
+        # Weak entity tags cannot be used for range requests
+        if etag and not str(etag).startswith("W/"):
+            validator = str(etag)
+        elif response.getheader("Last-Modified"):
+            validator = str(response.getheader("Last-Modified"))
+
+        # Opening the file for writing truncates it
+        with open(self.path, "wb"):
+            pass
+
+        if validator:
+            with open(self._validator_path, "w") as f:
+                f.write(validator)
+        elif os.path.exists(self._validator_path):
+            os.remove(self._validator_path)
+
+    @property
+    def resumable(self) -> bool:
+        return bool(self.size and self.validator)
+
+    def publish(self, destination: PathType) -> None:
+        """Moves the completely downloaded file to the destination"""
+        shutil.move(self.path, destination)
+
+        if os.path.exists(self._validator_path):
+            os.remove(self._validator_path)
+
+    def discard(self) -> None:
+        for path in [self.path, self._validator_path]:
+            if os.path.exists(path):
+                os.remove(path)
@@ -2,3 +2,7 @@ class CekitError(Exception):
     def __init__(self, message, *args, **kwargs):
         super(CekitError, self).__init__(message, *args, **kwargs)
         self.message = message
+
+
+class CekitChecksumError(CekitError):
+    """Raised when checksums of a file do not match the expected ones"""
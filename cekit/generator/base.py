@@ -6,14 +6,17 @@ import platform
 import re
 import shutil
 import tempfile
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
+import yaml
 from jinja2 import Environment, FileSystemLoader
 from packaging.version import InvalidVersion, Version, _BaseVersion
 from packaging.version import parse as parse_version
 
-from cekit.cekit_types import PathType
+from cekit.cache.git import GitMirror
+from cekit.cache.url import UrlCache
+from cekit.cekit_types import _T, PathType
 from cekit.config import Config
 from cekit.descriptor import (
     Env,
@@ -25,14 +28,15 @@ from cekit.descriptor import (
     Repository,
     Resource,
 )
+from cekit.download import ensure_online
 from cekit.errors import CekitError
 from cekit.generator import legacy_version
 from cekit.generator.legacy_version import LegacyVersion
+from cekit.parallel import WorkerPool, fetch_workers, fetch_workers_per_host
 from cekit.template_helper import TemplateHelper
 from cekit.tools import (
     DependencyDefinition,
     Map,
-    download_file,
     load_descriptor,
     parse_env_timeout,
 )
@@ -79,6 +83,8 @@ class Generator(object):
         self.target: PathType = target
         self._fetch_repos = False
         self._module_registry: ModuleRegistry = ModuleRegistry()
+        self._sparse_repositories: List[SparseRepository] = []
+        self._sparse_requested: Set[str] = set()
         self.image: Optional[Image] = None
         self.builder_images: List[Image] = []
         self.images: List[Image] = []
@@ -95,7 +101,7 @@ class Generator(object):
                 if urlparse(override).scheme in ["http", "https", "file"]:
                     # HTTP Handling
                     tmpfile = tempfile.NamedTemporaryFile()
-                    download_file(override, tmpfile.name)
+                    UrlCache().fetch(override, tmpfile.name)
                     self._overrides.append(
                         Overrides(
                             load_descriptor(tmpfile.name), os.path.dirname(tmpfile.name)
@@ -277,27 +283,93 @@ class Generator(object):
         base_dir = os.path.join(self.target, "repo")
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
-        for repo in self._module_repositories():
-            LOGGER.debug(f"Downloading module repository: '{repo.name}'")
-            repo.copy(base_dir)
-            self.load_repository(os.path.join(base_dir, repo.target))
+
+        sparse = CONFIG.get_bool("common", "sparse_modules")
+
+        def fetch(repo: "Resource") -> None:
+            if sparse and repo.get("git"):
+                LOGGER.debug(f"Listing modules in module repository: '{repo.name}'")
+                self._sparse_repositories.append(
+                    SparseRepository(repo, os.path.join(base_dir, repo.target))
+                )
+            else:
+                LOGGER.debug(f"Downloading module repository: '{repo.name}'")
+                repo.copy(base_dir)
+
+        repositories = self._module_repositories()
+
+        # Repositories are fetched one by one, but all failures are reported together
+        WorkerPool(1).map(
+            fetch,
+            repositories,
+            describe=lambda repo: f"'{repo.name}'",
+            what="module repositories",
+        )
+
+        for repo in repositories:
+            if not (sparse and repo.get("git")):
+                self.load_repository(os.path.join(base_dir, repo.target))
+
+        if self._sparse_repositories:
+            # Modules required by images are extracted at once, other modules
+            # (for example required by modules from other repositories) on demand
+            self._module_registry.loader = self._load_sparse_modules
+            self._load_sparse_modules(
+                [
+                    install.name
+                    for modules in self._modules()
+                    for install in modules.install
+                ]
+            )
 
     def load_repository(self, repo_dir: str) -> None:
         for modules_dir, _, files in os.walk(repo_dir):
             if "module.yaml" in files:
-                module_descriptor_path = os.path.abspath(
-                    os.path.expanduser(
-                        os.path.normcase(os.path.join(modules_dir, "module.yaml"))
-                    )
-                )
+                self._load_module(modules_dir)
+
+    def _load_module(self, modules_dir: str) -> None:
+        module_descriptor_path = os.path.abspath(
+            os.path.expanduser(
+                os.path.normcase(os.path.join(modules_dir, "module.yaml"))
+            )
+        )
 
-                module = Module(
-                    load_descriptor(module_descriptor_path),
-                    modules_dir,
-                    os.path.dirname(module_descriptor_path),
+        module = Module(
+            load_descriptor(module_descriptor_path),
+            modules_dir,
+            os.path.dirname(module_descriptor_path),
+        )
+        LOGGER.debug(f"Adding module '{module.name}', path: '{module.path}'")
+        self._module_registry.add_module(module)
+
+    def _load_sparse_modules(self, names: List[str]) -> None:
+        """
+        Extracts modules with provided names, together with all modules these
+        depend on, from sparse module repositories and adds them to the registry.
+        """
+        pending = list(names)
+        selected: Dict[SparseRepository, List[str]] = {}
+
+        while pending:
+            name = pending.pop()
+
+            if name in self._sparse_requested:
+                continue
+
+            self._sparse_requested.add(name)
+
+            for repository in self._sparse_repositories:
+                for path, dependencies in repository.modules(name):
+                    selected.setdefault(repository, []).append(path)
+                    pending += dependencies
+
+        for repository, paths in selected.items():
+            repository.extract(paths)
+
+            for path in paths:
+                self._load_module(
+                    os.path.normpath(os.path.join(repository.directory, path))
                 )
-                LOGGER.debug(f"Adding module '{module.name}', path: '{module.path}'")
-                self._module_registry.add_module(module)
 
     def get_tags(self) -> List[str]:
         return [
@@ -495,6 +567,8 @@ class Generator(object):
                 f"There are no content_sets defined for platform '{arch}'!"
             )
 
+        ensure_online("request ODCS compose for content sets")
+
         repos = " ".join(content_sets[arch])
 
         odcs_service_type = "Fedora"
@@ -610,11 +684,97 @@ class Generator(object):
     def prepare_artifacts(self):
         raise NotImplementedError("Artifacts handling is not implemented")
 
+    def _fetch_artifacts(
+        self, artifacts: List[Resource], fetch: Callable[[Resource], _T]
+    ) -> List[_T]:
+        """
+        Executes the fetch function for every artifact using a bounded pool of workers,
+        see the 'fetch_workers' and 'fetch_workers_per_host' configuration options.
+
+        Artifacts with the same target are processed sequentially, in the order
+        these were provided. Results are returned in the order of provided artifacts.
+        """
+        return WorkerPool(fetch_workers(), fetch_workers_per_host()).map(
+            fetch,
+            artifacts,
+            group=lambda artifact: artifact.target,
+            host=lambda artifact: artifact.fetch_host(),
+            describe=lambda artifact: f"'{artifact.name}'",
+            what="artifacts",
+        )
+
+
+class SparseRepository(object):
+    """
+    Git module repository of which only directories of required modules are
+    extracted. Module descriptors are read directly from the git mirror of
+    the repository, see the 'sparse_modules' configuration option.
+    """
+
+    def __init__(self, repo: "Resource", directory: PathType):
+        self.name: str = repo.name
+        self.directory: PathType = directory
+        self._mirror = GitMirror(repo.git.url)
+        self._commit = self._mirror.resolve(repo.git.ref)
+        self._modules: Dict[str, List[Tuple[str, List[str]]]] = {}
+        self._extracted: Set[str] = set()
+
+        paths = self._mirror.paths(self._commit)
+        descriptors = self._mirror.read(
+            self._commit,
+            [path for path in paths if os.path.basename(path) == "module.yaml"],
+        )
+
+        for path, content in descriptors.items():
+            try:
+                descriptor = yaml.safe_load(content)
+                name = str(descriptor["name"])
+                install = (descriptor.get("modules") or {}).get("install") or []
+                dependencies = [str(module["name"]) for module in install]
+            except Exception as ex:
+                LOGGER.warning(
+                    f"Ignoring module descriptor '{path}' in '{self.name}' module repository "
+                    f"which cannot be parsed: {ex}"
+                )
+                continue
+
+            self._modules.setdefault(name, []).append(
+                (os.path.dirname(path), dependencies)
+            )
+
+        LOGGER.debug(
+            f"Found {len(descriptors)} modules in '{self.name}' module repository"
+        )
+
+        # Tests in the repository root are collected by 'cekit test'
+        if any(path.startswith("tests/") for path in paths):
+            self.extract(["tests"])
+
+    def modules(self, name: str) -> List[Tuple[str, List[str]]]:
+        """
+        Returns directories of all modules (any version) with the name, together
+        with names of modules these depend on.
+        """
+        return self._modules.get(name, [])
+
+    def extract(self, paths: List[str]) -> None:
+        """Extracts directories which were not extracted yet"""
+        paths = [path for path in paths if path not in self._extracted]
+
+        if paths:
+            self._mirror.extract(
+                self._commit, [path or "." for path in paths], self.directory
+            )
+            self._extracted.update(paths)
+
 
 class ModuleRegistry(object):
     def __init__(self):
         self._modules: Dict[str, Dict[str, Module]] = {}
         self._defaults: Dict[str, str] = {}
+        # Called with names of requested modules before these are looked up,
+        # makes it possible to load modules lazily
+        self.loader: Optional[Callable[[List[str]], None]] = None
 
     def get_module(self, name, version: Any = None, suppress_warnings=False) -> Module:
         """
@@ -638,6 +798,9 @@ class ModuleRegistry(object):
             CekitError: If a module is not found or version requirement is not satisfied
         """
 
+        if self.loader:
+            self.loader([name])
+
         # Get all modules for specied nam
         modules = self._modules.get(name, {})
 
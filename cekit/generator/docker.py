@@ -32,8 +32,9 @@ class DockerGenerator(Generator):
         logger.info("Handling artifacts for docker...")
         target_dir = os.path.join(self.target, "image")
 
-        for image in self.images:
-            for artifact in image.all_artifacts:
-                artifact.copy(target_dir)
+        self._fetch_artifacts(
+            [artifact for image in self.images for artifact in image.all_artifacts],
+            lambda artifact: artifact.copy(target_dir),
+        )
 
         logger.debug("Artifacts handled")
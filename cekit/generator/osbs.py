@@ -2,15 +2,15 @@ import fileinput
 import logging
 import os
 import sys
-import tempfile
 from collections import OrderedDict
 from contextlib import closing
-from typing import TYPE_CHECKING, Callable, Dict, List
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 from urllib.parse import urlparse
 
 import yaml
 
 from cekit import crypto, version
+from cekit.cache.discovery import discover_checksums
 from cekit.cekit_types import PathType
 from cekit.config import Config
 from cekit.descriptor.resource import (
@@ -29,6 +29,9 @@ if TYPE_CHECKING:
 logger = logging.getLogger("cekit")
 config = Config()
 
+# Checksum algorithms supported in the fetch-artifacts-url.yaml file, in order of preference
+FETCH_ARTIFACTS_HASH_ALGORITHMS = ["md5", "sha1", "sha256"]
+
 
 class OSBSGenerator(Generator):
     def __init__(
@@ -126,135 +129,33 @@ class OSBSGenerator(Generator):
 
         fetch_domains = config.get("common", "fetch_artifact_domains")
 
-        for image in self.images:
-            for artifact in image.all_artifacts:
-                logger.info(
-                    "Preparing artifact '{}' (of type {})".format(
-                        artifact["name"], type(artifact)
-                    )
-                )
+        artifacts = [
+            artifact for image in self.images for artifact in image.all_artifacts
+        ]
 
-                # We only want to use fetch-artifact-url if
-                # 1. is type _UrlResource
-                # 2. if fetch_artifact_domains configured, URL conforms to that.
-                process_fetch = False
-                if isinstance(artifact, _UrlResource):
-                    if fetch_domains is not None:
-                        fad = fetch_domains.replace(" ", "").split(",")
-                        # Verify if the URL can be used in fetch-artifact-url or now
-                        for d in fad:
-                            u = urlparse(d)
-                            logger.debug(f"Parsed URL '{u.netloc}' and path '{u.path}'")
-                            if u.netloc + u.path in artifact["url"]:
-                                process_fetch = True
-                        if not process_fetch:
-                            artifact["lookaside"] = True
-                            logger.warning(
-                                f"Ignoring {artifact['url']} as restricted to {fad}"
-                            )
-                    else:
-                        # Just process all UrlResource
-                        process_fetch = True
+        # Artifacts are prepared concurrently, but the results are processed
+        # in the order of artifacts so that generated files are stable
+        entries = self._fetch_artifacts(
+            artifacts,
+            lambda artifact: self._prepare_artifact(
+                artifact, target_dir, fetch_domains
+            ),
+        )
 
-                if process_fetch:
-                    intersected_hash = [
-                        x for x in crypto.SUPPORTED_HASH_ALGORITHMS if x in artifact
-                    ]
-                    logger.debug(f"Found checksum markers of {intersected_hash}")
-                    if not intersected_hash:
-                        logger.warning(
-                            "No checksum supplied for {}, calculating from the remote artifact".format(
-                                artifact["url"]
-                            )
-                        )
-                        intersected_hash = ["md5"]
-                        tmpfile = tempfile.NamedTemporaryFile()
-                        try:
-                            artifact.download_file(artifact["url"], tmpfile.name)
-                            artifact["md5"] = crypto.get_sum(tmpfile.name, "md5")
-                        finally:
-                            tmpfile.close()
-
-                    fetch_artifacts_url.append(
-                        {
-                            "url": artifact["url"],
-                            "target": os.path.join(artifact["target"]),
-                        }
-                    )
-                    for c in intersected_hash:
-                        fetch_artifacts_url[len(fetch_artifacts_url) - 1].update(
-                            {c: artifact[c]}
-                        )
-                    patch_source_url(artifact, fetch_artifacts_url)
-                    if "description" in artifact:
-                        file_comments[artifact["url"]] = artifact["description"]
-                    logger.debug(
-                        "Artifact '{}' (as URL) added to fetch-artifacts-url.yaml with contents {}".format(
-                            artifact["target"],
-                            fetch_artifacts_url[len(fetch_artifacts_url) - 1],
-                        )
-                    )
-                    # OSBS by default downloads all artifacts to artifacts/<target_path>
-                    artifact["target"] = os.path.join("artifacts", artifact["target"])
-                elif isinstance(artifact, _PlainResource) and config.get(
-                    "common", "redhat"
-                ):
-                    try:
-                        if "md5" not in artifact:
-                            logger.error(
-                                "Unable to use Brew as artifact does not have md5 checksum defined"
-                            )
-                            raise CekitError(
-                                "Unable to use Brew as artifact does not have md5 checksum defined"
-                            )
-                        fetch_artifacts_url.append(
-                            {
-                                "md5": artifact["md5"],
-                                "url": get_brew_url(artifact["md5"]),
-                                "target": os.path.join(artifact["target"]),
-                            }
-                        )
-                        patch_source_url(artifact, fetch_artifacts_url)
-
-                        logger.debug(
-                            "Artifact '{}' (as plain) added to fetch-artifacts-url.yaml".format(
-                                artifact["target"]
-                            )
-                        )
-                        # OSBS by default downloads all artifacts to artifacts/<target_path>
-                        artifact["target"] = os.path.join(
-                            "artifacts", artifact["target"]
-                        )
-                    except Exception:
-                        logger.debug(
-                            "Caught exception when processing PlainResource",
-                            exc_info=True,
-                        )
-                        logger.warning(
-                            "Plain artifact {} could not be found in Brew, trying to handle it using lookaside cache".format(
-                                artifact["name"]
-                            )
-                        )
-                        artifact.copy(target_dir)
-                        # TODO: This is ugly, rewrite this!
-                        artifact["lookaside"] = True
-
-                elif isinstance(artifact, _PncResource):
-                    logger.info(f"Handling pnc resources for {artifact}")
-                    build = fetch_artifacts_pnc.setdefault(artifact["pnc_build_id"], [])
-                    build.append(
-                        {
-                            "id": artifact["pnc_artifact_id"],
-                            "target": artifact["target"],
-                        }
-                    )
-                    # OSBS by default downloads all artifacts to artifacts/<target_path>
-                    artifact["target"] = os.path.join("artifacts", artifact["target"])
-                    if "url" in artifact:
-                        file_comments[artifact["pnc_artifact_id"]] = artifact["url"]
-                else:
-                    logger.debug(f"Copying artifact {artifact} to {target_dir}")
-                    artifact.copy(target_dir)
+        for artifact, entry in zip(artifacts, entries):
+            if entry is None:
+                continue
+
+            if isinstance(artifact, _PncResource):
+                fetch_artifacts_pnc.setdefault(artifact["pnc_build_id"], []).append(
+                    entry
+                )
+                if "url" in artifact:
+                    file_comments[artifact["pnc_artifact_id"]] = artifact["url"]
+            else:
+                fetch_artifacts_url.append(entry)
+                if isinstance(artifact, _UrlResource) and "description" in artifact:
+                    file_comments[artifact["url"]] = artifact["description"]
 
         if fetch_artifacts_pnc:
             fetch_artifacts_file = os.path.join(
@@ -287,6 +188,127 @@ class OSBSGenerator(Generator):
             patch_file(file_comments, fetch_artifacts_file)
         logger.debug("Artifacts handled")
 
+    def _prepare_artifact(
+        self, artifact: Resource, target_dir: str, fetch_domains: Optional[str]
+    ) -> Optional[Dict[str, str]]:
+        """
+        Prepares a single artifact. Returns the entry for the fetch-artifacts-url.yaml
+        or fetch-artifacts-pnc.yaml file, or None if the artifact was copied
+        to the target directory instead.
+        """
+        logger.info(
+            "Preparing artifact '{}' (of type {})".format(
+                artifact["name"], type(artifact)
+            )
+        )
+
+        # We only want to use fetch-artifact-url if
+        # 1. is type _UrlResource
+        # 2. if fetch_artifact_domains configured, URL conforms to that.
+        process_fetch = False
+        if isinstance(artifact, _UrlResource):
+            if fetch_domains is not None:
+                fad = fetch_domains.replace(" ", "").split(",")
+                # Verify if the URL can be used in fetch-artifact-url or now
+                for d in fad:
+                    u = urlparse(d)
+                    logger.debug(f"Parsed URL '{u.netloc}' and path '{u.path}'")
+                    if u.netloc + u.path in artifact["url"]:
+                        process_fetch = True
+                if not process_fetch:
+                    artifact["lookaside"] = True
+                    logger.warning(f"Ignoring {artifact['url']} as restricted to {fad}")
+            else:
+                # Just process all UrlResource
+                process_fetch = True
+
+        if process_fetch:
+            intersected_hash = [
+                x for x in crypto.SUPPORTED_HASH_ALGORITHMS if x in artifact
+            ]
+            logger.debug(f"Found checksum markers of {intersected_hash}")
+            if not intersected_hash:
+                logger.warning(
+                    "No checksum supplied for {}, looking up the checksum of the remote artifact".format(
+                        artifact["url"]
+                    )
+                )
+                checksums = discover_checksums(
+                    artifact["url"], FETCH_ARTIFACTS_HASH_ALGORITHMS
+                )
+                algorithm = next(
+                    alg for alg in FETCH_ARTIFACTS_HASH_ALGORITHMS if alg in checksums
+                )
+                artifact[algorithm] = checksums[algorithm]
+                intersected_hash = [algorithm]
+
+            entry = {
+                "url": artifact["url"],
+                "target": os.path.join(artifact["target"]),
+            }
+            for c in intersected_hash:
+                entry.update({c: artifact[c]})
+            patch_source_url(artifact, [entry])
+            logger.debug(
+                "Artifact '{}' (as URL) added to fetch-artifacts-url.yaml with contents {}".format(
+                    artifact["target"], entry
+                )
+            )
+            # OSBS by default downloads all artifacts to artifacts/<target_path>
+            artifact["target"] = os.path.join("artifacts", artifact["target"])
+            return entry
+        elif isinstance(artifact, _PlainResource) and config.get("common", "redhat"):
+            try:
+                if "md5" not in artifact:
+                    logger.error(
+                        "Unable to use Brew as artifact does not have md5 checksum defined"
+                    )
+                    raise CekitError(
+                        "Unable to use Brew as artifact does not have md5 checksum defined"
+                    )
+                entry = {
+                    "md5": artifact["md5"],
+                    "url": get_brew_url(artifact["md5"]),
+                    "target": os.path.join(artifact["target"]),
+                }
+                patch_source_url(artifact, [entry])
+
+                logger.debug(
+                    "Artifact '{}' (as plain) added to fetch-artifacts-url.yaml".format(
+                        artifact["target"]
+                    )
+                )
+                # OSBS by default downloads all artifacts to artifacts/<target_path>
+                artifact["target"] = os.path.join("artifacts", artifact["target"])
+                return entry
+            except Exception:
+                logger.debug(
+                    "Caught exception when processing PlainResource",
+                    exc_info=True,
+                )
+                logger.warning(
+                    "Plain artifact {} could not be found in Brew, trying to handle it using lookaside cache".format(
+                        artifact["name"]
+                    )
+                )
+                artifact.copy(target_dir)
+                # TODO: This is ugly, rewrite this!
+                artifact["lookaside"] = True
+        elif isinstance(artifact, _PncResource):
+            logger.info(f"Handling pnc resources for {artifact}")
+            entry = {
+                "id": artifact["pnc_artifact_id"],
+                "target": artifact["target"],
+            }
+            # OSBS by default downloads all artifacts to artifacts/<target_path>
+            artifact["target"] = os.path.join("artifacts", artifact["target"])
+            return entry
+        else:
+            logger.debug(f"Copying artifact {artifact} to {target_dir}")
+            artifact.copy(target_dir)
+
+        return None
+
 
 # Used to modify either the fetch-artifact or fetch-pnc files to add extra human readable information.
 def patch_file(file_comments: Dict[str, str], file: str) -> None:
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from cekit.config import Config
+from cekit.download import TRANSIENT_STATUS_CODES, download_client, offline
+from cekit.parallel import WorkerPool
+
+logger = logging.getLogger("cekit")
+config = Config()
+
+MIRROR_STATS_FILE = "mirrors.json"
+
+# Mirrors are probed again if the last probe is older than this (in seconds)
+MIRROR_PROBE_INTERVAL = 3600
+# Mirror which failed is skipped for this number of seconds, doubled with
+# every consecutive failure, up to the maximum
+MIRROR_BACKOFF = 60
+MIRROR_MAX_BACKOFF = 3600
+# Weight of the latest measurement in the latency and error rate averages
+SMOOTHING = 0.3
+# Mirrors with higher error rate are preferred only over unhealthy mirrors
+MIRROR_MAX_ERROR_RATE = 0.5
+
+
+def cache_urls() -> List[str]:
+    """
+    Returns the list of configured cacher URL templates. The 'cache_url'
+    configuration key may contain multiple templates separated by whitespace.
+    Cacher mirrors are not used in offline mode.
+    """
+    if offline():
+        return []
+
+    return (config.get("common", "cache_url") or "").split()
+
+
+class MirrorStats(object):
+    """
+    Latency and health statistics of cacher mirrors, persisted in the
+    work directory so that the knowledge is shared across CEKit runs.
+
+    Latency of a mirror is measured by probing its root URL, at most once
+    per MIRROR_PROBE_INTERVAL. Failures of actual fetches mark the mirror
+    as unhealthy for an exponentially growing period of time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._probed: List[str] = []
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as file_:
+                    self._stats = json.load(file_)
+            except (OSError, ValueError) as ex:
+                logger.warning(
+                    f"Could not read mirror statistics from '{path}', starting from scratch: {ex}"
+                )
+
+    def get(self, mirror: str) -> Dict[str, Any]:
+        return self._stats.setdefault(
+            mirror,
+            {
+                "latency": None,
+                "error_rate": 0.0,
+                "failures": 0,
+                "failed_at": 0,
+                "probed_at": 0,
+            },
+        )
+
+    def healthy(self, mirror: str) -> bool:
+        """Returns False if the mirror failed recently"""
+        stats = self.get(mirror)
+
+        if not stats["failures"]:
+            return True
+
+        backoff = min(MIRROR_BACKOFF * 2 ** (stats["failures"] - 1), MIRROR_MAX_BACKOFF)
+
+        return time.time() - stats["failed_at"] > backoff
+
+    def record(self, mirror: str, success: bool, latency: Optional[float] = None):
+        """Records the result of a request to the mirror"""
+        with self._lock:
+            stats = self.get(mirror)
+            stats["error_rate"] = (1 - SMOOTHING) * stats["error_rate"] + SMOOTHING * (
+                0.0 if success else 1.0
+            )
+
+            if success:
+                stats["failures"] = 0
+            else:
+                stats["failures"] += 1
+                stats["failed_at"] = time.time()
+
+            if latency is not None:
+                if stats["latency"] is None:
+                    stats["latency"] = latency
+                else:
+                    stats["latency"] = (1 - SMOOTHING) * stats[
+                        "latency"
+                    ] + SMOOTHING * latency
+
+            self._save()
+
+    def probe(self, mirrors: List[str]) -> None:
+        """
+        Measures the latency of mirrors which were not probed recently,
+        every mirror is probed at most once per process.
+        """
+        with self._lock:
+            stale = [
+                mirror
+                for mirror in mirrors
+                if mirror not in self._probed
+                and time.time() - self.get(mirror)["probed_at"] > MIRROR_PROBE_INTERVAL
+            ]
+            self._probed.extend(stale)
+
+        def probe(mirror: str) -> None:
+            parsed_url = urlparse(mirror)
+            client = download_client()
+            request = client.request(f"{parsed_url.scheme}://{parsed_url.netloc}/")
+            request.method = "HEAD"
+            start = time.monotonic()
+
+            try:
+                with client.open(request) as response:
+                    response.read()
+                    # Any response, even an error one, means the server is up
+                    success = response.getcode() not in TRANSIENT_STATUS_CODES
+            except Exception as ex:
+                logger.debug(
+                    f"Probing cacher mirror '{parsed_url.netloc}' failed: {ex}"
+                )
+                success = False
+
+            latency = time.monotonic() - start
+            logger.debug(
+                "Cacher mirror '{}' responded in {:.3f} seconds".format(
+                    parsed_url.netloc, latency
+                )
+            )
+
+            with self._lock:
+                self.get(mirror)["probed_at"] = time.time()
+
+            self.record(mirror, success, latency if success else None)
+
+        WorkerPool(max(len(stale), 1)).map(probe, stale)
+
+    def ordered(self, mirrors: List[str]) -> List[str]:
+        """
+        Returns the mirrors ordered by preference: healthy mirrors first, then
+        mirrors which fail often, faster mirrors first. Mirrors with unknown
+        latency follow the measured ones and keep their configured order.
+        """
+        self.probe(mirrors)
+
+        def preference(mirror: str):
+            stats = self.get(mirror)
+
+            return (
+                not self.healthy(mirror),
+                stats["error_rate"] > MIRROR_MAX_ERROR_RATE,
+                stats["latency"] is None,
+                stats["latency"] or 0,
+                mirrors.index(mirror),
+            )
+
+        with self._lock:
+            return sorted(mirrors, key=preference)
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.path)
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            # Replace the file atomically, other CEKit processes may read it
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".mirrors")
+            with os.fdopen(fd, "w") as file_:
+                json.dump(self._stats, file_, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as ex:
+            logger.debug(f"Could not save mirror statistics to '{self.path}': {ex}")
+
+
+_mirror_stats: Dict[str, MirrorStats] = {}
+_mirror_stats_lock = threading.Lock()
+
+
+def mirror_stats() -> MirrorStats:
+    """Returns mirror statistics stored in the current work directory"""
+    path = os.path.join(
+        os.path.expanduser(config.get("common", "work_dir")), MIRROR_STATS_FILE
+    )
+
+    with _mirror_stats_lock:
+        if path not in _mirror_stats:
+            _mirror_stats[path] = MirrorStats(path)
+
+        return _mirror_stats[path]
+
+
+def ordered_cache_urls() -> List[str]:
+    """
+    Returns configured cacher URL templates, the preferred mirror first.
+    A single configured template is returned as is, without probing.
+    """
+    mirrors = cache_urls()
+
+    if len(mirrors) <= 1:
+        return mirrors
+
+    return mirror_stats().ordered(mirrors)
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, TypeVar
+
+from cekit.config import Config
+from cekit.errors import CekitError
+
+logger = logging.getLogger("cekit")
+config = Config()
+
+_I = TypeVar("_I")
+_R = TypeVar("_R")
+
+DEFAULT_FETCH_WORKERS = 4
+
+
+def fetch_workers() -> int:
+    """Returns the maximum number of artifacts fetched concurrently"""
+    return config.get_int("common", "fetch_workers", DEFAULT_FETCH_WORKERS)
+
+
+def fetch_workers_per_host() -> int:
+    """Returns the maximum number of concurrent fetches from a single host"""
+    return config.get_int("common", "fetch_workers_per_host", fetch_workers())
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads executing a function for every item.
+
+    Items sharing the same group key are processed sequentially (in the order
+    they were provided) by a single worker, for example artifacts which should
+    be written to the same path. Concurrency is limited globally (workers) and per
+    host (per_host) the item is fetched from.
+
+    Results are returned in the order of the provided items, regardless of the order
+    in which the work was finished. All failures are collected and reported together.
+    """
+
+    def __init__(self, workers: int, per_host: Optional[int] = None):
+        self.workers = workers
+        self.per_host = per_host or workers
+        self._host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, host: Optional[str]) -> Optional[threading.BoundedSemaphore]:
+        if not host or self.per_host >= self.workers:
+            return None
+
+        with self._lock:
+            return self._host_limits.setdefault(
+                host, threading.BoundedSemaphore(self.per_host)
+            )
+
+    def map(
+        self,
+        func: Callable[[_I], _R],
+        items: Sequence[_I],
+        group: Callable[[_I], Hashable] = id,
+        host: Callable[[_I], Optional[str]] = lambda _: None,
+        describe: Callable[[_I], str] = str,
+        what: str = "items",
+    ) -> List[_R]:
+        groups: Dict[Hashable, List[int]] = OrderedDict()
+
+        for position, item in enumerate(items):
+            groups.setdefault(group(item), []).append(position)
+
+        results: List[Any] = [None] * len(items)
+        errors: List[Any] = []
+
+        def process(positions: List[int]) -> None:
+            limit = self._host_limit(host(items[positions[0]]))
+
+            if limit:
+                limit.acquire()
+
+            try:
+                for position in positions:
+                    try:
+                        results[position] = func(items[position])
+                    except Exception as ex:
+                        with self._lock:
+                            errors.append((position, ex))
+                        # Remaining items in group depend on this one
+                        break
+            finally:
+                if limit:
+                    limit.release()
+
+        if self.workers == 1 or len(groups) <= 1:
+            # Nothing to parallelize, run it in the current thread
+            for positions in groups.values():
+                process(positions)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.workers, len(groups))
+            ) as executor:
+                # Iterate over the futures so that unexpected errors are propagated
+                for future in [
+                    executor.submit(process, positions) for positions in groups.values()
+                ]:
+                    future.result()
+
+        if errors:
+            errors.sort(key=lambda error: error[0])
+
+            if len(errors) == 1:
+                raise errors[0][1]
+
+            for position, ex in errors:
+                logger.error(f"Processing of {describe(items[position])} failed: {ex}")
+
+            raise CekitError(
+                "Processing of {} {} failed: {}".format(
+                    len(errors),
+                    what,
+                    ", ".join(describe(items[position]) for position, _ in errors),
+                )
+            ) from errors[0][1]
+
+        return results
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(object):
+    """
+    Makes sure that concurrent calls for the same key are executed only once,
+    all callers waiting for the call in progress share its result (or its error).
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], _R]) -> _R:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            logger.debug(f"Waiting for '{key}' which is already in progress")
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of work shared by multiple threads, for example the number
+    of bytes read per second. Threads consuming more than the rate allows
+    are put to sleep. Bursts of up to one second worth of work are allowed.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._available = float(rate)
+        self._updated = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(
+                self.rate, self._available + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Work is done on credit, the thread waits until the debt is paid
+            self._available -= amount
+            wait = -self._available / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
@@ -1,14 +1,14 @@
-import base64
 import importlib
 import logging
 import os
 import shutil
-import ssl
 import subprocess
 import sys
-from typing import Any, Mapping, Sequence
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
+from urllib.request import Request
 
 import click
 import yaml
@@ -16,7 +16,34 @@ from yaml.representer import SafeRepresenter
 
 from cekit.cekit_types import DependencyDefinition, PathType
 from cekit.config import Config
-from cekit.errors import CekitError
+from cekit.crypto import (
+    SUPPORTED_HASH_ALGORITHMS,
+    MultiHasher,
+    compare_sums,
+    get_sums,
+)
+from cekit.download import (
+    TRANSIENT_STATUS_CODES,
+    DownloadCancelledError,
+    NotModifiedError,
+    PartialDownload,
+    RetryPolicy,
+    TransientDownloadError,
+    conditional_headers,
+    content_range_starts_at,
+    download_client,
+    download_segments,
+    ensure_online,
+    response_validators,
+    urlopen,
+)
+from cekit.errors import CekitChecksumError, CekitError
+from cekit.parallel import WorkerPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger("cekit")
 config = Config()
@@ -36,7 +63,242 @@ class Map(dict):
 SafeRepresenter.add_representer(Map, SafeRepresenter.represent_dict)
 
 
-def download_file(url: str, destination: str) -> None:
+class _NoProgressBar(object):
+    """Progress bar replacement which does not render anything"""
+
+    def __enter__(self) -> "_NoProgressBar":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def update(self, n_steps: int) -> None:
+        pass
+
+
+def _progressbar(length: int, label: str):
+    # Progress bars of downloads running concurrently in worker
+    # threads would garble the output, just log the download then
+    if threading.current_thread() is not threading.main_thread():
+        logger.info(label)
+        return _NoProgressBar()
+
+    return click.progressbar(
+        length=length,
+        label=label,
+        show_percent=True,
+        fill_char=(click.style("#", fg="green")),
+        empty_char=(click.style("-", fg="white", dim=True)),
+    )
+
+
+def _check_cancelled(url: str, cancel: Optional[threading.Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise DownloadCancelledError(f"Downloading '{url}' was cancelled")
+
+
+def _download_segments(
+    url: str,
+    res,
+    partial: PartialDownload,
+    segments: List[Tuple[int, int]],
+    cancel: Optional[threading.Event] = None,
+) -> None:
+    """
+    Downloads byte ranges (segments) of the file concurrently, every segment
+    is written directly to its position in the preallocated partial download file.
+
+    The response to the initial request is used to download the first segment.
+    """
+    client = download_client()
+    size = segments[-1][1] + 1
+    done = [0] * len(segments)
+    lock = threading.Lock()
+    chunk_size = 1048576  # 1 MB
+
+    logger.debug(f"Downloading '{url}' in {len(segments)} segments")
+
+    fd = os.open(partial.path, os.O_RDWR)
+
+    try:
+        os.ftruncate(fd, size)
+
+        with _progressbar(size, f"Downloading {url.rsplit('/', 1)[-1]}") as bar:
+
+            def fetch(index: int) -> None:
+                start, end = segments[index]
+                response = res
+
+                if index:
+                    headers = {"Range": f"bytes={start}-{end}"}
+
+                    if partial.validator:
+                        headers["If-Range"] = partial.validator
+
+                    response = urlopen(
+                        client.request(url, headers), context=client.context
+                    )
+
+                try:
+                    if index and not content_range_starts_at(response, start):
+                        raise TransientDownloadError(
+                            f"Server did not respond with the requested range of '{url}'"
+                        )
+
+                    position = start
+
+                    while position <= end:
+                        _check_cancelled(url, cancel)
+                        chunk = response.read(min(chunk_size, end + 1 - position))
+                        if not chunk:
+                            raise TransientDownloadError(
+                                f"Downloading '{url}' ended prematurely after {position} bytes"
+                            )
+                        os.pwrite(fd, chunk, position)
+                        position += len(chunk)
+
+                        with lock:
+                            done[index] += len(chunk)
+                            bar.update(len(chunk))
+                finally:
+                    response.close()
+
+            WorkerPool(len(segments)).map(
+                fetch,
+                list(range(len(segments))),
+                describe=lambda index: f"segment {index + 1} of '{url}'",
+                what="segments",
+            )
+    except BaseException:
+        # Keep the downloaded beginning of the file, so that the download can be resumed
+        contiguous = 0
+
+        for (start, end), downloaded in zip(segments, done):
+            contiguous += downloaded
+
+            if downloaded < end - start + 1:
+                break
+
+        os.ftruncate(fd, contiguous)
+        raise
+    finally:
+        os.close(fd)
+
+
+def _download_http(
+    url: str,
+    partial: PartialDownload,
+    cancel: Optional[threading.Event] = None,
+    validators: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
+    """
+    Downloads the URL into the partial download file, resuming it
+    with a range request if the file was partially downloaded before.
+
+    Returns checksums of the downloaded file for all supported algorithms,
+    computed while the file is downloaded.
+    """
+    client = download_client()
+    headers = partial.resume_headers()
+
+    if validators:
+        headers.update(conditional_headers(validators))
+
+    request: Request = client.request(url, headers)
+
+    res = urlopen(request, context=client.context)
+
+    try:
+        if res.getcode() == 304 and validators:
+            raise NotModifiedError(f"File '{url}' was not modified")
+
+        if validators is not None and res.getcode() in [200, 206]:
+            validators.clear()
+            validators.update(response_validators(res))
+
+        if partial.resumes(res):
+            logger.info(
+                f"Resuming download of '{url}' from {partial.size} bytes of {partial.path}"
+            )
+            mode = "ab"
+        elif res.getcode() == 200:
+            partial.start(res)
+
+            segments = download_segments(res)
+
+            if segments:
+                _download_segments(url, res, partial, segments, cancel)
+                # Segments are written out of order, the file must be read once
+                return get_sums(partial.path, SUPPORTED_HASH_ALGORITHMS)
+
+            mode = "wb"
+        elif res.getcode() == 416 and partial.size:
+            # Range not satisfiable, the remote file changed, start over
+            partial.discard()
+            return _download_http(url, partial, cancel, validators)
+        elif res.getcode() in TRANSIENT_STATUS_CODES:
+            raise TransientDownloadError(
+                f"Could not download file from {url}, status code: {res.getcode()}"
+            )
+        else:
+            raise CekitError(f"Could not download file from {url}")
+
+        hasher = MultiHasher(SUPPORTED_HASH_ALGORITHMS)
+        offset = 0
+
+        if mode == "ab":
+            offset = partial.size
+            hasher.update_file(partial.path)
+
+        remote_size = int(res.getheader("Content-Length") or 0)
+        chunk_size = 1048576  # 1 MB
+        with open(partial.path, mode) as f, _progressbar(
+            offset + remote_size, f"Downloading {url.rsplit('/', 1)[-1]}"
+        ) as bar:
+            bar.update(offset)
+            while True:
+                _check_cancelled(url, cancel)
+                chunk = res.read(chunk_size)
+                if not chunk:
+                    break
+                bar.update(chunk_size)
+                f.write(chunk)
+                hasher.update(chunk)
+
+        # Servers sending the Content-Length header may close the connection prematurely
+        if remote_size and partial.size != offset + remote_size:
+            raise TransientDownloadError(
+                f"Downloading '{url}' ended prematurely after {partial.size} bytes"
+            )
+
+        return hasher.hexdigests()
+    finally:
+        res.close()
+
+
+def download_file(
+    url: str,
+    destination: str,
+    checksums: Optional[Dict[str, str]] = None,
+    cancel: Optional[threading.Event] = None,
+    validators: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
+    """
+    Downloads the file from the URL and saves it as the destination.
+
+    Checksums of the file for all supported algorithms are computed while the
+    file is downloaded and returned (files copied from local paths are hashed
+    only if expected checksums are provided). If expected checksums are provided,
+    these are verified before the file is saved as the destination.
+
+    If validators (the 'ETag' and 'Last-Modified' headers of a previously downloaded
+    file) are provided, the HTTP download is conditional, NotModifiedError is raised
+    if the remote file did not change. The dictionary is updated with validators
+    of the downloaded file.
+
+    The download can be cancelled from other thread by setting the cancel event.
+    In offline mode only local files can be copied, OfflineError is raised for URLs.
+    """
     logger.debug(f"Downloading from '{url}' as {destination}")
 
     parsed_url = urlparse(url)
@@ -44,71 +306,157 @@ def download_file(url: str, destination: str) -> None:
     if parsed_url.scheme == "file" or not parsed_url.scheme:
         if os.path.isdir(parsed_url.path):
             shutil.copytree(parsed_url.path, destination)
-        else:
-            shutil.copy(parsed_url.path, destination)
+            return {}
+
+        shutil.copy(parsed_url.path, destination)
+
+        if not checksums:
+            return {}
+
+        digests = get_sums(destination, SUPPORTED_HASH_ALGORITHMS)
+
+        if not compare_sums(destination, digests, checksums):
+            os.remove(destination)
+            raise CekitChecksumError(f"Checksum verification of '{url}' failed")
+
+        return digests
     elif parsed_url.scheme in ["http", "https"]:
-        verify = config.get("common", "ssl_verify")
-        if str(verify).lower() == "false":
-            verify = False
+        ensure_online(f"download '{url}'")
 
-        ctx = ssl.create_default_context()
+        policy = RetryPolicy.for_url(url)
 
-        if not verify:
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
+        with PartialDownload(url) as partial:
+            attempt = 1
 
-        request: Request = Request(url)
-        if config.get("common", "url_authentication"):
-            domains = dict(
-                [
-                    x.split("#")
-                    for x in config.get("common", "url_authentication").split(";")
-                ]
-            )
-            for d, a in domains.items():
-                if parsed_url.hostname == d:
-                    logger.debug(
-                        f"Located matching hostname '{d}' to add authentication with username '{a.split(':')[0]}'."
-                    )
-                    b64auth = base64.b64encode(a.encode("latin-1")).decode()
-                    request.add_header("Authorization", f"Basic {b64auth}")
+            while True:
+                try:
+                    digests = _download_http(url, partial, cancel, validators)
                     break
+                except Exception as e:
+                    if not policy.should_retry(e, attempt):
+                        # Cancelled download is not needed anymore
+                        if partial.resumable and not isinstance(
+                            e, DownloadCancelledError
+                        ):
+                            logger.debug(
+                                f"Keeping incompletely downloaded '{partial.path}' file to resume the download later, failed due to {e}"
+                            )
+                        else:
+                            logger.debug(
+                                f"Removing incompletely downloaded '{partial.path}' file due to {e}"
+                            )
+                            partial.discard()
+                        raise
+
+                    delay = policy.delay(attempt)
+                    attempt += 1
+                    logger.warning(
+                        f"Downloading '{url}' failed due to {e}, retrying in {delay} seconds "
+                        f"(attempt {attempt} of {policy.attempts})"
+                    )
+                    time.sleep(delay)
 
-        res = urlopen(request, context=ctx)
+            # Corrupted file must never be published
+            if checksums and not compare_sums(partial.path, digests, checksums):
+                partial.discard()
+                raise CekitChecksumError(f"Checksum verification of '{url}' failed")
 
-        if res.getcode() != 200:
-            raise CekitError(f"Could not download file from {url}")
+            partial.publish(destination)
 
-        try:
-            remote_size = int(res.getheader("Content-Length", "0"))
-            chunk_size = 1048576  # 1 MB
-            with open(destination, "wb") as f, click.progressbar(
-                length=remote_size,
-                label=f"Downloading {url.rsplit('/', 1)[-1]}",
-                show_percent=True,
-                fill_char=(click.style("#", fg="green")),
-                empty_char=(click.style("-", fg="white", dim=True)),
-            ) as bar:
-                while True:
-                    chunk = res.read(chunk_size)
-                    if not chunk:
-                        break
-                    bar.update(chunk_size)
-                    f.write(chunk)
-        except Exception as e:
-            try:
-                logger.debug(
-                    f"Removing incompletely downloaded '{destination}' file due to {e}"
-                )
-                os.remove(destination)
-            except OSError:
-                logger.warning(f"An error occurred while removing file '{destination}'")
-
-            raise
+        return digests
     else:
         raise CekitError(f"Unsupported URL scheme: {url}")
 
 
+# Strategies which can be used to place files (for example cached artifacts) into the target directory
+MATERIALIZATION_STRATEGIES = ["auto", "reflink", "hardlink", "copy"]
+
+# ioctl request to clone a file on filesystems supporting it (Btrfs, XFS, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def _reflink(source: PathType, destination: PathType) -> bool:
+    if fcntl is None:
+        return False
+
+    created = False
+
+    try:
+        with open(source, "rb") as src, open(destination, "xb") as dst:
+            created = True
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError as ex:
+        logger.debug(f"Unable to reflink '{source}' to '{destination}': {ex}")
+
+        if created:
+            os.remove(destination)
+
+        return False
+
+    shutil.copystat(source, destination)
+    return True
+
+
+def _hardlink(source: PathType, destination: PathType) -> bool:
+    try:
+        os.link(source, destination)
+    except OSError as ex:
+        logger.debug(f"Unable to hardlink '{source}' to '{destination}': {ex}")
+        return False
+
+    return True
+
+
+def materialize_file(
+    source: PathType, destination: PathType, allow_hardlink: bool = True
+) -> str:
+    """
+    Places the source file at the destination path using the cheapest method available,
+    based on the 'materialization' configuration option:
+
+    * 'auto' (default) -- try to reflink the file first, then hardlink it (source and destination
+      need to be on the same filesystem) and finally fall back to a regular copy,
+    * 'reflink' -- try to reflink the file, fall back to a copy,
+    * 'hardlink' -- try to hardlink the file, fall back to a copy,
+    * 'copy' -- always copy the file.
+
+    Hardlinks share the content with the source. In the 'auto' mode these are used only
+    if allow_hardlink is set, which means that the source is protected against modifications
+    (for example it is read-only). With the 'hardlink' strategy the user opted in explicitly.
+
+    If the destination exists, it is removed first so that the content of a file
+    it may be linked to is never overwritten.
+
+    Returns the method which was used: 'reflink', 'hardlink' or 'copy'.
+    """
+
+    strategy = (config.get("common", "materialization") or "auto").lower()
+
+    if strategy not in MATERIALIZATION_STRATEGIES:
+        raise CekitError(
+            "Unsupported materialization strategy '{}', supported: {}".format(
+                strategy, ", ".join(MATERIALIZATION_STRATEGIES)
+            )
+        )
+
+    if os.path.lexists(destination) and not os.path.isdir(destination):
+        os.remove(destination)
+
+    if strategy in ["auto", "reflink"] and _reflink(source, destination):
+        method = "reflink"
+    elif (
+        strategy == "hardlink" or (strategy == "auto" and allow_hardlink)
+    ) and _hardlink(source, destination):
+        method = "hardlink"
+    else:
+        shutil.copy2(source, destination)
+        method = "copy"
+
+    logger.debug(f"File '{source}' placed at '{destination}' using {method}")
+
+    return method
+
+
 def load_descriptor(descriptor: str) -> dict:
     # TODO: The docstring mentions validation, but this doesn't appear to validate.
     """parses descriptor and validate it against requested schema type
@@ -154,6 +502,8 @@ def decision(question: str) -> bool:
 
 
 def get_latest_image_version(image: str) -> str:
+    ensure_online(f"inspect image '{image}' with skopeo")
+
     inspect_cmd = [
         "skopeo",
         "inspect",
@@ -206,6 +556,8 @@ def get_tag_from_inspect_struct(struct: Mapping) -> str:
 
 
 def get_brew_url(md5: str) -> str:
+    ensure_online(f"look up artifact with '{md5}' md5 sum in Brew")
+
     logger.debug(f"Getting brew details for an artifact with '{md5}' md5 sum")
     list_archives_cmd = [
         "brew",
@@ -0,0 +1,49 @@
+import pytest
+
+from cekit.config import Config
+from cekit.download import reset_download_client
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+
+@pytest.fixture(name="work_dir")
+def fixture_work_dir(tmpdir):
+    """
+    Empty CEKit work directory, the 'common' configuration section
+    is reset to point to it.
+    """
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    config.cfg["common"] = {"work_dir": work_dir}
+    reset_download_client()
+    return work_dir
+
+
+@pytest.fixture(name="git_identity")
+def fixture_git_identity(monkeypatch):
+    """Identity used by git to create commits in test repositories"""
+    for variable in ["GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"]:
+        monkeypatch.setenv(variable, "CEKit")
+    for variable in ["GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"]:
+        monkeypatch.setenv(variable, "cekit@example.com")
+
+
+@pytest.fixture(name="no_proxy")
+def fixture_no_proxy(monkeypatch):
+    """Makes sure requests to local test servers do not go through a proxy"""
+    for variable in ["http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY"]:
+        monkeypatch.delenv(variable, raising=False)
+
+
+@pytest.fixture(name="proxy")
+def fixture_proxy(no_proxy, monkeypatch):
+    """
+    Server acting as the HTTP proxy, routes are keyed by the absolute URL
+    of the requested file.
+    """
+    for variable in ["no_proxy", "NO_PROXY"]:
+        monkeypatch.delenv(variable, raising=False)
+
+    with LocalHttpServer() as proxy:
+        monkeypatch.setenv("http_proxy", proxy.url(""))
+        yield proxy
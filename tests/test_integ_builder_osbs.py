@@ -18,6 +18,7 @@ from mock.mock import Mock, call
 from cekit.cli import cli
 from cekit.tools import Chdir
 from cekit.version import __version__
+from tests.utils import fake_checksums
 
 image_descriptor = {
     "schema_version": 1,
@@ -1491,6 +1492,41 @@ def test_osbs_builder_with_fetch_artifacts_url_file_creation_multiple_hash(
     )
 
 
+def test_osbs_builder_with_fetch_artifacts_url_file_creation_without_checksum(
+    tmpdir, mocker, caplog
+):
+    """
+    Checks whether the checksum of URL artifact without checksum is looked up
+    and added to the fetch-artifacts-url.yaml file.
+    """
+
+    mocker.patch("cekit.tools.decision", return_value=True)
+    mocker.patch("cekit.builders.osbs.Git.push")
+    discover = mocker.patch(
+        "cekit.generator.osbs.discover_checksums",
+        return_value={"sha256": "123456", "sha512": "654321"},
+    )
+
+    tmpdir.mkdir("osbs").mkdir("repo")
+
+    descriptor = copy.deepcopy(image_descriptor)
+
+    descriptor["artifacts"] = [{"url": "https://foo/bar.jar"}]
+
+    run_osbs(descriptor, str(tmpdir), mocker)
+
+    with open(
+        os.path.join(str(tmpdir), "target", "image", "fetch-artifacts-url.yaml"), "r"
+    ) as _file:
+        fetch_artifacts = yaml.safe_load(_file)
+
+    discover.assert_called_once_with("https://foo/bar.jar", ["md5", "sha1", "sha256"])
+    assert fetch_artifacts == [
+        {"sha256": "123456", "target": "bar.jar", "url": "https://foo/bar.jar"}
+    ]
+    assert "No checksum supplied for https://foo/bar.jar" in caplog.text
+
+
 def test_osbs_builder_with_fetch_artifacts_url_file_creation_naming(
     tmpdir, mocker, caplog
 ):
@@ -2478,8 +2514,8 @@ def test_osbs_builder_with_brew_and_lookaside(tmpdir, mocker, caplog):
     """
 
     caplog.set_level(logging.DEBUG, logger="cekit")
-    mocker.patch("cekit.crypto.get_sum", return_value="123456")
-    mocker.patch("cekit.cache.artifact.get_sum", return_value="123456")
+    mocker.patch("cekit.crypto.get_sums", side_effect=fake_checksums)
+    mocker.patch("cekit.cache.artifact.get_sums", side_effect=fake_checksums)
     mocker.patch("cekit.tools.decision", return_value=True)
     mocker.patch("cekit.tools.urlopen")
     mocker.patch(
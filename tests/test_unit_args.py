@@ -33,6 +33,33 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": True,
+                "offline": False,
+                "target": "target",
+                "trace": False,
+                "validate": False,
+                "dry_run": False,
+                "overrides": (),
+                "pull": False,
+                "no_squash": False,
+                "tags": (),
+                "platform": None,
+            },
+        ),
+        # Check offline mode
+        (
+            ["--offline", "build", "docker"],
+            "cekit.builders.docker_builder.DockerBuilder",
+            {
+                "build_args": (),
+                "build_flag": (),
+                "container_file": None,
+                "descriptor": "image.yaml",
+                "verbose": False,
+                "nocolor": False,
+                "work_dir": "~/.cekit",
+                "config": "~/.cekit/config",
+                "redhat": False,
+                "offline": True,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -58,6 +85,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "custom-target",
                 "trace": False,
                 "validate": False,
@@ -83,6 +111,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "custom-workdir",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -108,6 +137,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "custom-config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -133,6 +163,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -158,6 +189,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -181,6 +213,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -208,6 +241,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -235,6 +269,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -262,6 +297,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -287,6 +323,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "overrides": (),
@@ -312,6 +349,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -334,6 +372,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -362,6 +401,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -384,6 +424,7 @@ def _get_class_by_name(clazz):
                 "work_dir": "~/.cekit",
                 "config": "~/.cekit/config",
                 "redhat": False,
+                "offline": False,
                 "target": "target",
                 "trace": False,
                 "validate": False,
@@ -0,0 +1,569 @@
+import hashlib
+import multiprocessing
+import os
+import time
+
+import pytest
+import yaml
+
+from cekit.cache import artifact as artifact_cache
+from cekit.cache.artifact import ArtifactCache, parse_age, parse_size
+from cekit.cache.index import INDEX_FILE_NAME, CacheIndex
+from cekit.config import Config
+from cekit.descriptor import resource
+from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from cekit.parallel import WorkerPool
+from cekit.tools import materialize_file
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+EMPTY_CHECKSUMS = {
+    "md5": "d41d8cd98f00b204e9800998ecf8427e",
+    "sha1": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+    "sha256": "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855",
+    "sha512": "cf83e1357eefb8bdf1542850d66d8007d620e4050b5715dc83f4a921d36ce9ce47d0d13c5d85f2b0ff8318d2877eec2f63b931bd47417a81a538327af927da3e",
+}
+
+
+def empty_artifact(work_dir, **checksums):
+    path = os.path.join(work_dir, "artifact")
+    open(path, "a").close()
+    descriptor = {"name": "artifact", "path": path}
+    descriptor.update(checksums)
+    return create_resource(descriptor, directory=work_dir)
+
+
+def test_cache_add_indexes_all_checksums(work_dir):
+    cache = ArtifactCache()
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    assert os.path.exists(os.path.join(work_dir, "cache", INDEX_FILE_NAME))
+
+    for alg, checksum in EMPTY_CHECKSUMS.items():
+        entry = cache._find_artifact(alg, checksum)
+        assert entry["cached_path"] == os.path.join(
+            work_dir, "cache", "blobs", "sha256", EMPTY_CHECKSUMS["sha256"]
+        )
+        assert entry["names"] == ["artifact"]
+        assert entry[alg] == checksum
+
+
+def test_cache_lookup_ignores_checksum_case(work_dir):
+    cache = ArtifactCache()
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    assert cache.cached(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"].upper()))
+
+
+def test_cache_not_cached(work_dir):
+    cache = ArtifactCache()
+
+    assert cache.cached(empty_artifact(work_dir, md5="123456")) is False
+
+    with pytest.raises(CekitError, match="Artifact is not cached."):
+        cache.get(empty_artifact(work_dir, md5="123456"))
+
+
+def test_cache_delete(work_dir):
+    cache = ArtifactCache()
+    artifact_id = cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    cache.delete(artifact_id)
+
+    assert not cache.list()
+    assert not cache.find_blob(EMPTY_CHECKSUMS["sha256"])
+
+    with pytest.raises(CekitError, match="is not cached"):
+        cache.delete(artifact_id)
+
+
+def test_cache_migrates_legacy_index_files(work_dir):
+    cache_dir = os.path.join(work_dir, "cache")
+    os.makedirs(cache_dir)
+    artifact_id = "1258069e-7194-426d-a6ab-ade0a27b8290"
+    open(os.path.join(cache_dir, artifact_id), "a").close()
+
+    legacy_entry = {
+        "names": ["artifact"],
+        "cached_path": os.path.join(cache_dir, artifact_id),
+    }
+    legacy_entry.update(EMPTY_CHECKSUMS)
+
+    with open(os.path.join(cache_dir, artifact_id + ".yaml"), "w") as file_:
+        yaml.safe_dump(legacy_entry, file_)
+
+    cache = ArtifactCache()
+
+    # Artifact was moved to the content-addressed layout
+    legacy_entry["cached_path"] = cache.blob_path(EMPTY_CHECKSUMS["sha256"])
+
+    assert cache.list() == {artifact_id: legacy_entry}
+    assert (
+        cache.get(empty_artifact(work_dir, sha1=EMPTY_CHECKSUMS["sha1"]))
+        == legacy_entry
+    )
+    assert not os.path.exists(os.path.join(cache_dir, artifact_id + ".yaml"))
+    assert not os.path.exists(os.path.join(cache_dir, artifact_id))
+    assert os.path.isfile(legacy_entry["cached_path"])
+
+
+def test_verification_stamp_skips_reading_unchanged_file(work_dir, mocker):
+    artifact = empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"])
+    path = os.path.join(work_dir, "artifact")
+    check_sums = mocker.spy(resource, "check_sums")
+
+    assert artifact._Resource__verify(path)
+    assert artifact._Resource__verify(path)
+
+    assert check_sums.call_count == 1
+
+
+def test_verification_stamp_invalidated_on_change(work_dir, mocker):
+    artifact = empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"])
+    path = os.path.join(work_dir, "artifact")
+
+    assert artifact._Resource__verify(path)
+
+    with open(path, "w") as f:
+        f.write("changed")
+
+    assert not artifact._Resource__verify(path)
+
+
+def test_verification_stamp_forced_verification(work_dir, mocker):
+    config.cfg["common"]["force_verify"] = "True"
+    artifact = empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"])
+    path = os.path.join(work_dir, "artifact")
+    check_sums = mocker.spy(resource, "check_sums")
+
+    assert artifact._Resource__verify(path)
+    assert artifact._Resource__verify(path)
+
+    assert check_sums.call_count == 2
+
+
+def test_copy_from_cache_records_verification_stamp(work_dir, mocker):
+    cache = ArtifactCache()
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+    target = os.path.join(work_dir, "target")
+    os.makedirs(target)
+
+    empty_artifact(work_dir, sha256=EMPTY_CHECKSUMS["sha256"]).copy(target)
+
+    check_sums = mocker.spy(resource, "check_sums")
+    empty_artifact(work_dir, sha256=EMPTY_CHECKSUMS["sha256"]).copy(target)
+
+    assert check_sums.call_count == 0
+    assert cache.verified(os.path.join(target, "artifact"), EMPTY_CHECKSUMS)
+
+
+@pytest.mark.parametrize("strategy", ["auto", "hardlink", "copy"])
+def test_copy_from_cache_materialization(work_dir, strategy):
+    config.cfg["common"]["materialization"] = strategy
+    cache = ArtifactCache()
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+    cached_path = cache.blob_path(EMPTY_CHECKSUMS["sha256"])
+    target = os.path.join(work_dir, "target")
+    os.makedirs(target)
+
+    empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]).copy(target)
+
+    # Cached artifacts are protected against modifications
+    assert os.stat(cached_path).st_mode & 0o222 == 0
+
+    linked = os.path.samefile(cached_path, os.path.join(target, "artifact"))
+    assert linked is (strategy != "copy")
+
+
+def test_copy_replaces_stale_linked_file_without_touching_cache(work_dir):
+    config.cfg["common"]["materialization"] = "hardlink"
+    cache = ArtifactCache()
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+    cached_path = cache.blob_path(EMPTY_CHECKSUMS["sha256"])
+    target = os.path.join(work_dir, "target")
+    os.makedirs(target)
+
+    os.link(cached_path, os.path.join(target, "artifact"))
+
+    with open(os.path.join(work_dir, "other"), "w") as f:
+        f.write("other content")
+
+    # Points to the same target file, but with different content
+    create_resource(
+        {
+            "name": "artifact",
+            "path": os.path.join(work_dir, "other"),
+            "md5": "0c84751f0ca9c6886bb09f2dd1a66faa",
+        },
+        directory=work_dir,
+    ).copy(target)
+
+    assert os.path.getsize(cached_path) == 0
+
+
+def test_materialization_unsupported_strategy(work_dir):
+    config.cfg["common"]["materialization"] = "teleport"
+    source = os.path.join(work_dir, "source")
+    open(source, "a").close()
+
+    with pytest.raises(CekitError, match="Unsupported materialization strategy"):
+        materialize_file(source, os.path.join(work_dir, "destination"))
+
+
+def test_downloaded_artifact_is_read_only_while_downloading(work_dir, mocker):
+    check_sums = mocker.spy(resource, "check_sums")
+    cache_get_sums = mocker.patch("cekit.cache.artifact.get_sums")
+
+    with LocalHttpServer({"/artifact": (200, {}, b"")}) as server:
+        artifact = create_resource(
+            {
+                "name": "artifact",
+                "url": server.url("/artifact"),
+                "md5": EMPTY_CHECKSUMS["md5"],
+            }
+        )
+        target = os.path.join(work_dir, "artifact")
+
+        artifact.copy(target)
+
+    check_sums.assert_not_called()
+    cache_get_sums.assert_not_called()
+
+    entry = ArtifactCache().get(artifact)
+
+    for alg, checksum in EMPTY_CHECKSUMS.items():
+        assert entry[alg] == checksum
+
+
+def test_download_with_wrong_checksum_is_not_cached(work_dir):
+    with LocalHttpServer({"/artifact": (200, {}, b"corrupted")}) as server:
+        artifact = create_resource(
+            {
+                "name": "artifact",
+                "url": server.url("/artifact"),
+                "md5": EMPTY_CHECKSUMS["md5"],
+            }
+        )
+
+        with pytest.raises(CekitError, match="Artifact checksum verification failed!"):
+            artifact.copy(os.path.join(work_dir, "artifact"))
+
+    assert not ArtifactCache().cached(artifact)
+    assert os.listdir(os.path.join(work_dir, "cache", "partial")) == []
+
+
+def test_same_artifact_is_fetched_once(work_dir):
+    def slow(handler):
+        time.sleep(0.2)
+        handler.respond(200, {}, b"")
+
+    with LocalHttpServer({"/artifact": slow}) as server:
+        artifacts = [
+            create_resource(
+                {
+                    "name": name,
+                    "url": server.url("/artifact"),
+                    "md5": EMPTY_CHECKSUMS["md5"],
+                }
+            )
+            for name in ["first", "second", "third"]
+        ]
+
+        WorkerPool(3).map(lambda artifact: artifact.copy(work_dir), artifacts)
+
+        assert len(server.requests) == 1
+
+    for name in ["first", "second", "third"]:
+        assert os.path.isfile(os.path.join(work_dir, name))
+
+    assert len(ArtifactCache().list()) == 1
+
+
+def test_artifact_without_checksum_is_fetched_once(work_dir):
+    def slow(handler):
+        time.sleep(0.2)
+        handler.respond(200, {}, b"content")
+
+    with LocalHttpServer({"/unique-artifact": slow}) as server:
+        artifacts = [
+            create_resource({"name": name, "url": server.url("/unique-artifact")})
+            for name in ["first", "second"]
+        ]
+
+        WorkerPool(2).map(lambda artifact: artifact.copy(work_dir), artifacts)
+
+        assert len(server.requests) == 1
+
+    for name in ["first", "second"]:
+        with open(os.path.join(work_dir, name), "rb") as f:
+            assert f.read() == b"content"
+
+
+def test_same_content_is_stored_once(work_dir):
+    cache = ArtifactCache()
+    first = cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    # Same content, different name and checksum
+    target = os.path.join(work_dir, "target")
+    os.makedirs(target)
+    other = create_resource(
+        {
+            "name": "other",
+            "path": os.path.join(work_dir, "artifact"),
+            "sha1": EMPTY_CHECKSUMS["sha1"],
+        },
+        directory=work_dir,
+    )
+    other.copy(target)
+
+    assert list(cache.list()) == [first]
+    assert cache.list()[first]["names"] == ["artifact", "other"]
+    assert os.listdir(os.path.join(work_dir, "cache", "blobs", "sha256")) == [
+        EMPTY_CHECKSUMS["sha256"]
+    ]
+
+
+def test_migration_removes_duplicates(work_dir):
+    cache_dir = os.path.join(work_dir, "cache")
+    os.makedirs(cache_dir)
+
+    for artifact_id, name in [("first-uuid", "first"), ("second-uuid", "second")]:
+        open(os.path.join(cache_dir, artifact_id), "a").close()
+
+        with open(os.path.join(cache_dir, artifact_id + ".yaml"), "w") as file_:
+            yaml.safe_dump(
+                dict(
+                    EMPTY_CHECKSUMS,
+                    names=[name],
+                    cached_path=os.path.join(cache_dir, artifact_id),
+                ),
+                file_,
+            )
+
+    cache = ArtifactCache()
+
+    entries = cache.list()
+
+    assert len(entries) == 1
+    assert sorted(list(entries.values())[0]["names"]) == ["first", "second"]
+    assert not os.path.exists(os.path.join(cache_dir, "first-uuid"))
+    assert not os.path.exists(os.path.join(cache_dir, "second-uuid"))
+    assert os.listdir(os.path.join(cache_dir, "blobs", "sha256")) == [
+        EMPTY_CHECKSUMS["sha256"]
+    ]
+
+
+def new_process(mocker):
+    """Forgets caches and indexes prepared in this process"""
+    mocker.patch.object(artifact_cache, "_migrated", set())
+    mocker.patch.dict(CacheIndex._instances, clear=True)
+
+
+def test_migration_is_done_once(work_dir, mocker):
+    ArtifactCache()
+
+    new_process(mocker)
+    entries = mocker.spy(CacheIndex, "entries")
+
+    ArtifactCache()
+
+    entries.assert_not_called()
+
+
+def test_legacy_index_files_are_migrated_after_migration(work_dir, mocker):
+    cache_dir = os.path.join(work_dir, "cache")
+    ArtifactCache()
+
+    open(os.path.join(cache_dir, "legacy-uuid"), "a").close()
+
+    with open(os.path.join(cache_dir, "legacy-uuid.yaml"), "w") as file_:
+        yaml.safe_dump(
+            dict(
+                EMPTY_CHECKSUMS,
+                names=["legacy"],
+                cached_path=os.path.join(cache_dir, "legacy-uuid"),
+            ),
+            file_,
+        )
+
+    new_process(mocker)
+
+    cache = ArtifactCache()
+
+    assert cache.list()["legacy-uuid"]["cached_path"] == cache.blob_path(
+        EMPTY_CHECKSUMS["sha256"]
+    )
+    assert not os.path.exists(os.path.join(cache_dir, "legacy-uuid"))
+
+
+def test_find_blob_by_digest(work_dir):
+    cache = ArtifactCache()
+
+    assert cache.find_blob(EMPTY_CHECKSUMS["sha256"]) is None
+
+    cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    assert cache.find_blob(EMPTY_CHECKSUMS["sha256"].upper()) == os.path.join(
+        work_dir, "cache", "blobs", "sha256", EMPTY_CHECKSUMS["sha256"]
+    )
+
+
+def cached_artifact(cache, work_dir, content, last_access=None):
+    path = os.path.join(work_dir, content)
+
+    with open(path, "w") as f:
+        f.write(content)
+
+    artifact_id = cache.add(
+        create_resource(
+            {
+                "name": content,
+                "path": path,
+                "md5": hashlib.md5(content.encode()).hexdigest(),
+            },
+            directory=work_dir,
+        )
+    )
+
+    if last_access is not None:
+        cache.index._connection().execute(
+            "UPDATE artifacts SET last_access = ? WHERE id = ?",
+            (last_access, artifact_id),
+        )
+
+    return artifact_id
+
+
+def test_cache_records_access(work_dir):
+    cache = ArtifactCache()
+    artifact_id = cache.add(empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]))
+
+    assert cache.index.usage()[artifact_id]["hits"] == 0
+
+    for target in ["first", "second"]:
+        os.makedirs(os.path.join(work_dir, target))
+        empty_artifact(work_dir, md5=EMPTY_CHECKSUMS["md5"]).copy(
+            os.path.join(work_dir, target)
+        )
+
+    assert cache.index.usage()[artifact_id]["hits"] == 2
+    assert cache.index.usage()[artifact_id]["last_access"] > time.time() - 10
+
+
+def test_gc_evicts_least_recently_used_artifacts(work_dir):
+    cache = ArtifactCache()
+    now = time.time()
+    oldest = cached_artifact(cache, work_dir, "oldest", now - 300)
+    pinned = cached_artifact(cache, work_dir, "pinned", now - 200)
+    older = cached_artifact(cache, work_dir, "older", now - 100)
+    newest = cached_artifact(cache, work_dir, "newest", now)
+
+    cache.pin(pinned)
+
+    assert cache.size() == 23
+    assert cache.gc(max_size=12, dry_run=True) == [oldest, older]
+    assert len(cache.list()) == 4
+
+    assert cache.gc(max_size=12) == [oldest, older]
+    assert sorted(cache.list()) == sorted([pinned, newest])
+    assert cache.size() == 12
+
+
+def test_gc_evicts_artifacts_not_used_recently(work_dir):
+    cache = ArtifactCache()
+    old = cached_artifact(cache, work_dir, "old", time.time() - 3 * 86400)
+    recent = cached_artifact(cache, work_dir, "recent", time.time() - 86400)
+
+    assert cache.gc(max_age=parse_age("2d")) == [old]
+    assert list(cache.list()) == [recent]
+    assert not os.path.exists(
+        cache.blob_path(hashlib.sha256("old".encode()).hexdigest())
+    )
+
+
+def test_cache_max_size_keeps_artifacts_used_by_current_build(work_dir):
+    config.cfg["common"]["cache_max_size"] = "20"
+    cache = ArtifactCache()
+
+    old = cached_artifact(cache, work_dir, "0123456789", time.time() - 3600)
+    first = cached_artifact(cache, work_dir, "abcdefghij")
+
+    assert sorted(cache.list()) == sorted([old, first])
+
+    # Exceeds the limit, the artifact not used in this build is evicted
+    second = cached_artifact(cache, work_dir, "klmnopqrst")
+
+    assert sorted(cache.list()) == sorted([first, second])
+
+    # Artifacts used in this build are kept, even if over the limit
+    third = cached_artifact(cache, work_dir, "uvwxyz")
+
+    assert sorted(cache.list()) == sorted([first, second, third])
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("100", 100), ("2K", 2048), ("1.5g", 1610612736), ("3MiB", 3145728)],
+)
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value,expected", [("2", 172800), ("12h", 43200), ("1w", 604800)]
+)
+def test_parse_age(value, expected):
+    assert parse_age(value) == expected
+
+
+def test_parse_invalid_size():
+    with pytest.raises(CekitError, match="Invalid size 'big'"):
+        parse_size("big")
+
+
+def copy_in_process(work_dir, url, target):
+    config.cfg["common"] = {"work_dir": work_dir}
+    create_resource(
+        {"name": "artifact", "url": url, "md5": "9a0364b9e99bb480dd25e1f0284c8555"}
+    ).copy(target)
+
+
+def test_artifact_is_fetched_once_by_concurrent_processes(work_dir):
+    def slow(handler):
+        time.sleep(1)
+        handler.respond(200, {}, b"content")
+
+    context = multiprocessing.get_context("spawn")
+
+    with LocalHttpServer({"/artifact": slow}) as server:
+        processes = [
+            context.Process(
+                target=copy_in_process,
+                args=(
+                    work_dir,
+                    server.url("/artifact"),
+                    os.path.join(work_dir, f"target-{i}"),
+                ),
+            )
+            for i in range(8)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join(60)
+
+        assert [process.exitcode for process in processes] == [0] * 8
+        assert len(server.requests) == 1
+
+    for i in range(8):
+        with open(os.path.join(work_dir, f"target-{i}"), "rb") as f:
+            assert f.read() == b"content"
+
+    cache = ArtifactCache()
+
+    assert len(cache.list()) == 1
+    assert list(cache.index.usage().values())[0]["hits"] == 8
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+
+import pytest
+
+from cekit.cache.discovery import checksums_from_headers, discover_checksums
+from cekit.config import Config
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+CONTENT = b"artifact content"
+MD5 = hashlib.md5(CONTENT).hexdigest()
+SHA1 = hashlib.sha1(CONTENT).hexdigest()
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+SHA512 = hashlib.sha512(CONTENT).hexdigest()
+
+
+pytestmark = pytest.mark.usefixtures("work_dir", "no_proxy")
+
+
+def b64(digest):
+    return base64.b64encode(bytes.fromhex(digest)).decode()
+
+
+class Artifact(object):
+    """Route serving the artifact, records methods of requests"""
+
+    def __init__(self, headers=None, head=True, etag='"v1"'):
+        self.headers = dict(headers or {})
+        self.head = head
+        self.etag = etag
+        self.methods = []
+
+    def __call__(self, handler):
+        self.methods.append(handler.command)
+
+        if handler.command == "HEAD" and not self.head:
+            handler.respond(405, {}, b"")
+            return
+
+        headers = dict(self.headers, ETag=self.etag)
+
+        if handler.headers.get("If-None-Match") == self.etag:
+            handler.respond(304, headers, b"")
+        else:
+            handler.respond(200, headers, CONTENT)
+
+
+@pytest.mark.parametrize(
+    "headers, checksums",
+    [
+        ({"Digest": f"SHA-256={b64(SHA256)}"}, {"sha256": SHA256}),
+        (
+            {"Digest": f"md5={b64(MD5)}, SHA={b64(SHA1)}, UNIXsum=30637"},
+            {"md5": MD5, "sha1": SHA1},
+        ),
+        (
+            {"Repr-Digest": f"sha-512=:{b64(SHA512)}:, sha-256=:{b64(SHA256)}:"},
+            {"sha512": SHA512, "sha256": SHA256},
+        ),
+        ({"Content-MD5": b64(MD5)}, {"md5": MD5}),
+        ({"X-Checksum-Sha1": SHA1, "X-Checksum-Md5": MD5}, {"sha1": SHA1, "md5": MD5}),
+        ({"Digest": "SHA-256=invalid", "X-Checksum-Sha1": "abc"}, {}),
+        ({"Digest": f"SHA-256={b64(MD5)}"}, {}),
+        ({}, {}),
+    ],
+)
+def test_checksums_from_headers(headers, checksums):
+    assert checksums_from_headers(headers) == checksums
+
+
+def test_checksum_is_taken_from_headers():
+    artifact = Artifact({"Digest": f"SHA-256={b64(SHA256)}"})
+
+    with LocalHttpServer({"/artifact.jar": artifact}) as server:
+        assert discover_checksums(server.url("/artifact.jar")) == {"sha256": SHA256}
+
+    assert artifact.methods == ["HEAD"]
+
+
+def test_checksum_is_taken_from_checksum_file():
+    artifact = Artifact()
+
+    with LocalHttpServer(
+        {
+            "/artifact.jar": artifact,
+            "/artifact.jar.sha1": (200, {}, f"{SHA1}  artifact.jar\n".encode()),
+            "/artifact.jar.md5": (200, {}, MD5.encode()),
+        }
+    ) as server:
+        assert discover_checksums(server.url("/artifact.jar")) == {"sha1": SHA1}
+
+        # Preferred checksum files are tried first
+        assert [path for path, _ in server.requests] == [
+            "/artifact.jar",
+            "/artifact.jar.sha256",
+            "/artifact.jar.sha1",
+        ]
+
+    assert artifact.methods == ["HEAD"]
+
+
+def test_checksum_file_for_url_with_query():
+    with LocalHttpServer(
+        {
+            "/artifact.jar?version=1": Artifact(),
+            "/artifact.jar.md5?version=1": (200, {}, MD5.encode()),
+        }
+    ) as server:
+        assert discover_checksums(server.url("/artifact.jar?version=1")) == {"md5": MD5}
+
+
+def test_malformed_checksum_file_is_ignored():
+    with LocalHttpServer(
+        {
+            "/artifact.jar": Artifact(),
+            "/artifact.jar.sha256": (200, {}, b"<html>Not found</html>"),
+            "/artifact.jar.md5": (200, {}, MD5.encode()),
+        }
+    ) as server:
+        assert discover_checksums(server.url("/artifact.jar")) == {"md5": MD5}
+
+
+def test_checksum_of_unusable_algorithm_is_not_enough():
+    with LocalHttpServer(
+        {
+            "/artifact.jar": Artifact({"Digest": f"SHA-512={b64(SHA512)}"}),
+            "/artifact.jar.md5": (200, {}, MD5.encode()),
+        }
+    ) as server:
+        assert discover_checksums(server.url("/artifact.jar"), ["md5", "sha1"]) == {
+            "sha512": SHA512,
+            "md5": MD5,
+        }
+
+
+def test_artifact_is_downloaded_as_last_resort(caplog):
+    artifact = Artifact()
+
+    with LocalHttpServer({"/artifact.jar": artifact}) as server:
+        assert discover_checksums(server.url("/artifact.jar")) == {
+            "md5": MD5,
+            "sha1": SHA1,
+            "sha256": SHA256,
+            "sha512": SHA512,
+        }
+
+    assert artifact.methods == ["HEAD", "GET"]
+    assert "downloading the artifact to compute it" in caplog.text
+
+
+def test_discovered_checksums_are_reused_while_file_does_not_change():
+    artifact = Artifact()
+
+    with LocalHttpServer({"/artifact.jar": artifact}) as server:
+        discover_checksums(server.url("/artifact.jar"))
+        discover_checksums(server.url("/artifact.jar"))
+
+        assert artifact.methods == ["HEAD", "GET", "HEAD"]
+
+        artifact.etag = '"v2"'
+        discover_checksums(server.url("/artifact.jar"))
+
+        assert artifact.methods == ["HEAD", "GET", "HEAD", "HEAD", "GET"]
+
+
+def test_discovered_checksums_are_revalidated_without_head_support():
+    artifact = Artifact(head=False)
+
+    with LocalHttpServer({"/artifact.jar": artifact}) as server:
+        discover_checksums(server.url("/artifact.jar"))
+
+        assert discover_checksums(server.url("/artifact.jar"))["md5"] == MD5
+
+        # File was downloaded only once, then the conditional request was answered with 304
+        assert [
+            headers.get("If-None-Match")
+            for path, headers in server.requests
+            if path == "/artifact.jar"
+        ] == [None, None, None, '"v1"']
+
+
+def test_checksums_of_local_file(tmpdir):
+    path = tmpdir.join("artifact.jar")
+    path.write_binary(CONTENT)
+
+    assert discover_checksums(f"file://{path}")["sha256"] == SHA256
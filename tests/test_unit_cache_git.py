@@ -0,0 +1,199 @@
+import os
+import subprocess
+
+import pytest
+
+from cekit.cache import git as git_cache
+from cekit.cache.git import SNAPSHOTS_DIR, GitMirror
+from cekit.config import Config
+from cekit.descriptor.resource import create_resource
+from cekit.download import OfflineError
+from cekit.errors import CekitError
+
+config = Config()
+
+
+pytestmark = pytest.mark.usefixtures("work_dir", "git_identity")
+
+
+def git(repository, *args):
+    return subprocess.run(
+        ["git", "-C", repository] + list(args),
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout.strip()
+
+
+def commit(repository, name, content):
+    with open(os.path.join(repository, name), "w") as file_:
+        file_.write(content)
+
+    git(repository, "add", name)
+    git(repository, "commit", "-q", "-m", f"Add {name}")
+
+    return git(repository, "rev-parse", "HEAD")
+
+
+@pytest.fixture(name="upstream")
+def fixture_upstream(tmpdir):
+    repository = str(tmpdir.mkdir("upstream"))
+    git(repository, "init", "-q")
+    git(repository, "checkout", "-q", "-b", "main")
+    commit(repository, "module.yaml", "name: first")
+    git(repository, "tag", "v1")
+    return repository
+
+
+@pytest.fixture(name="commands")
+def fixture_commands(mocker):
+    """Records git commands executed in the mirror"""
+    run_wrapper = mocker.spy(git_cache, "run_wrapper")
+
+    def commands():
+        return [
+            [arg for arg in call[0][0][1:] if not arg.startswith("--")][0]
+            for call in run_wrapper.call_args_list
+        ]
+
+    return commands
+
+
+def read(path):
+    with open(path, "r") as file_:
+        return file_.read()
+
+
+def test_checkout(upstream, tmpdir):
+    target = str(tmpdir.join("target"))
+
+    assert GitMirror(upstream).checkout("main", target) == git(
+        upstream, "rev-parse", "HEAD"
+    )
+
+    assert read(os.path.join(target, "module.yaml")) == "name: first"
+    assert not os.path.exists(os.path.join(target, ".git"))
+
+
+def test_checkout_replaces_target(upstream, tmpdir):
+    target = tmpdir.mkdir("target")
+    target.join("stale").write("stale")
+
+    GitMirror(upstream).checkout("main", str(target))
+
+    assert sorted(os.listdir(str(target))) == ["module.yaml"]
+
+
+def test_checkout_ignores_export_attributes(upstream, tmpdir):
+    os.makedirs(os.path.join(upstream, "tests"))
+    commit(upstream, os.path.join("tests", "test.sh"), "true")
+    commit(upstream, "version.txt", "$Format:%H$")
+    commit(upstream, ".gitattributes", "tests/ export-ignore\nversion.txt export-subst")
+
+    target = str(tmpdir.join("target"))
+
+    GitMirror(upstream).checkout("main", target)
+
+    assert read(os.path.join(target, "tests", "test.sh")) == "true"
+    assert read(os.path.join(target, "version.txt")) == "$Format:%H$"
+
+
+def test_extract_selected_paths(upstream, tmpdir):
+    os.makedirs(os.path.join(upstream, "modules", "a"))
+    commit(upstream, os.path.join("modules", "a", "file with\nnewline"), "a")
+    commit(upstream, "other.yaml", "name: other")
+
+    mirror = GitMirror(upstream)
+    target = str(tmpdir.join("target"))
+
+    mirror.extract(mirror.resolve("main"), ["modules"], target)
+
+    assert os.listdir(target) == ["modules"]
+    assert read(os.path.join(target, "modules", "a", "file with\nnewline")) == "a"
+
+
+def test_tag_is_not_fetched_again(upstream, tmpdir, commands):
+    GitMirror(upstream).checkout("v1", str(tmpdir.join("one")))
+    GitMirror(upstream).checkout("v1", str(tmpdir.join("two")))
+
+    assert "fetch" not in commands()
+    assert commands().count("read-tree") == 1
+    assert read(str(tmpdir.join("two", "module.yaml"))) == "name: first"
+
+
+def test_commit_is_not_fetched_again(upstream, tmpdir, commands):
+    head = git(upstream, "rev-parse", "HEAD")
+
+    GitMirror(upstream).checkout("main", str(tmpdir.join("one")))
+    GitMirror(upstream).checkout(head[:10], str(tmpdir.join("two")))
+
+    assert "fetch" not in commands()
+
+
+def test_branch_is_fetched(upstream, tmpdir, commands):
+    GitMirror(upstream).checkout("main", str(tmpdir.join("one")))
+    head = commit(upstream, "module.yaml", "name: second")
+
+    assert GitMirror(upstream).checkout("main", str(tmpdir.join("two"))) == head
+    assert "fetch" in commands()
+    assert read(str(tmpdir.join("two", "module.yaml"))) == "name: second"
+
+
+def test_missing_ref_is_fetched(upstream, tmpdir):
+    GitMirror(upstream).checkout("v1", str(tmpdir.join("one")))
+    commit(upstream, "other.yaml", "name: other")
+    git(upstream, "tag", "v2")
+
+    GitMirror(upstream).checkout("v2", str(tmpdir.join("two")))
+
+    assert read(str(tmpdir.join("two", "other.yaml"))) == "name: other"
+
+
+def test_unknown_ref(upstream, tmpdir):
+    with pytest.raises(CekitError, match="Could not checkout from unknown"):
+        GitMirror(upstream).checkout("unknown", str(tmpdir.join("target")))
+
+
+def test_old_snapshots_are_removed(upstream, tmpdir, mocker):
+    mocker.patch.object(git_cache, "SNAPSHOTS_KEPT", 2)
+    mirror = GitMirror(upstream)
+
+    for number in range(3):
+        commit(upstream, "module.yaml", f"name: {number}")
+        mirror.checkout("main", str(tmpdir.join("target")))
+
+    assert len(os.listdir(os.path.join(mirror.directory, SNAPSHOTS_DIR))) == 2
+
+
+def test_mirror_is_used_offline(upstream, tmpdir, commands, mocker):
+    mocker.patch.object(git_cache, "_local", return_value=False)
+    GitMirror(upstream).checkout("main", str(tmpdir.join("one")))
+    commit(upstream, "module.yaml", "name: second")
+
+    config.cfg["common"]["offline"] = True
+
+    GitMirror(upstream).checkout("main", str(tmpdir.join("two")))
+
+    assert "fetch" not in commands()
+    assert read(str(tmpdir.join("two", "module.yaml"))) == "name: first"
+
+    with pytest.raises(OfflineError, match="Ref 'v2'"):
+        GitMirror(upstream).checkout("v2", str(tmpdir.join("three")))
+
+    with pytest.raises(OfflineError, match="is not mirrored"):
+        GitMirror("https://example.com/repo.git").checkout("main", str(tmpdir))
+
+
+def test_local_repository_is_mirrored_offline(upstream, tmpdir):
+    config.cfg["common"]["offline"] = True
+
+    GitMirror(upstream).checkout("main", str(tmpdir.join("target")))
+
+    assert read(str(tmpdir.join("target", "module.yaml"))) == "name: first"
+
+
+def test_git_resource(upstream, tmpdir):
+    resource = create_resource({"git": {"url": upstream, "ref": "v1"}})
+
+    assert resource.copy(str(tmpdir)) == str(tmpdir.join("upstream"))
+    assert read(str(tmpdir.join("upstream", "module.yaml"))) == "name: first"
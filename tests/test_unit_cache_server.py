@@ -0,0 +1,194 @@
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from cekit.cache.artifact import ArtifactCache
+from cekit.cache.server import CacheServer, _parse_range, parse_bind
+from cekit.config import Config
+from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+CONTENT = b"0123456789"
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+MD5 = hashlib.md5(CONTENT).hexdigest()
+
+
+@pytest.fixture(name="cached")
+def fixture_cached(work_dir, tmpdir):
+    path = str(tmpdir.join("artifact"))
+
+    with open(path, "wb") as fd:
+        fd.write(CONTENT)
+
+    ArtifactCache().add(create_resource({"url": path, "md5": MD5}))
+
+
+def start_server(read_through=False):
+    server = CacheServer(("127.0.0.1", 0), read_through=read_through)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return server
+
+
+@pytest.fixture(name="server")
+def fixture_server(work_dir):
+    server = start_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, path, method="GET", headers=None):
+    url = "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(url, headers=headers or {}, method=method)
+        ) as response:
+            return response.getcode(), response.headers, response.read()
+    except urllib.error.HTTPError as ex:
+        return ex.code, ex.headers, ex.read()
+
+
+def test_serve_cached_artifact(cached, server):
+    status, headers, body = request(server, f"/md5/{MD5}/artifact")
+
+    assert status == 200
+    assert body == CONTENT
+    assert headers["ETag"] == f'"{SHA256}"'
+    assert headers["Accept-Ranges"] == "bytes"
+
+    # File name is optional, any checksum can be used
+    assert request(server, f"/sha256/{SHA256}")[2] == CONTENT
+
+    status, headers, body = request(server, f"/md5/{MD5}/artifact", method="HEAD")
+
+    assert status == 200
+    assert headers["Content-Length"] == str(len(CONTENT))
+    assert body == b""
+
+
+def test_serve_records_access(cached, server):
+    request(server, f"/md5/{MD5}/artifact")
+
+    assert list(ArtifactCache().index.usage().values())[0]["hits"] == 1
+
+
+@pytest.mark.parametrize(
+    "value, status, content_range, body",
+    [
+        ("bytes=2-4", 206, "bytes 2-4/10", b"234"),
+        ("bytes=7-", 206, "bytes 7-9/10", b"789"),
+        ("bytes=-3", 206, "bytes 7-9/10", b"789"),
+        ("bytes=5-100", 206, "bytes 5-9/10", b"56789"),
+        ("bytes=20-", 416, "bytes */10", b""),
+        ("bytes=0-1,4-5", 200, None, CONTENT),
+    ],
+)
+def test_serve_range(cached, server, value, status, content_range, body):
+    response = request(server, f"/md5/{MD5}/artifact", headers={"Range": value})
+
+    assert response[0] == status
+    assert response[1]["Content-Range"] == content_range
+    assert response[2] == body
+
+
+def test_serve_range_is_ignored_for_other_version(cached, server):
+    response = request(
+        server,
+        f"/md5/{MD5}/artifact",
+        headers={"Range": "bytes=2-4", "If-Range": '"other"'},
+    )
+
+    assert response[0] == 200
+    assert response[2] == CONTENT
+
+
+def test_serve_not_modified(cached, server):
+    status, _, body = request(
+        server, f"/md5/{MD5}/artifact", headers={"If-None-Match": f'"{SHA256}"'}
+    )
+
+    assert status == 304
+    assert body == b""
+
+
+@pytest.mark.parametrize(
+    "path", [f"/md5/{'0' * 32}/artifact", "/crc32/abc/artifact", "/md5/xyz", "/"]
+)
+def test_serve_missing_artifact(cached, server, path):
+    assert request(server, path)[0] == 404
+
+
+def test_serve_concurrent_clients(cached, server):
+    results = []
+
+    def fetch():
+        results.append(request(server, f"/md5/{MD5}/artifact")[2])
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results == [CONTENT] * 8
+
+
+def test_serve_read_through(work_dir):
+    with LocalHttpServer({f"/upstream/{MD5}": (200, {}, CONTENT)}) as upstream:
+        config.cfg["common"]["cache_url"] = upstream.url("/upstream/#hash#")
+        server = start_server(read_through=True)
+
+        try:
+            assert request(server, f"/md5/{MD5}/artifact")[2] == CONTENT
+            assert request(server, f"/md5/{MD5}/artifact")[2] == CONTENT
+            assert request(server, f"/md5/{'0' * 32}/missing")[0] == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Second request is served from the cache
+        assert [path for path, _ in upstream.requests].count(f"/upstream/{MD5}") == 1
+
+
+def test_serve_as_cache_url(cached, server, tmpdir):
+    config.cfg["common"]["cache_url"] = server.cache_url
+    other_work_dir = str(tmpdir.mkdir("other"))
+    config.cfg["common"]["work_dir"] = other_work_dir
+    target = str(tmpdir.join("target"))
+
+    create_resource({"name": "artifact", "md5": MD5}).copy(target)
+
+    with open(target, "rb") as fd:
+        assert fd.read() == CONTENT
+
+
+@pytest.mark.parametrize(
+    "bind, address",
+    [
+        ("127.0.0.1:8080", ("127.0.0.1", 8080)),
+        (":8080", ("", 8080)),
+        ("[::1]:8080", ("::1", 8080)),
+        ("localhost:0", ("localhost", 0)),
+    ],
+)
+def test_parse_bind(bind, address):
+    assert parse_bind(bind) == address
+
+
+@pytest.mark.parametrize("bind", ["127.0.0.1", "::1:8080", "host:99999", "host:port"])
+def test_parse_invalid_bind(bind):
+    with pytest.raises(CekitError, match="Invalid address"):
+        parse_bind(bind)
+
+
+def test_parse_range_without_header():
+    assert _parse_range(None, 10) is None
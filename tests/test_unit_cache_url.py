@@ -0,0 +1,172 @@
+import os
+
+import pytest
+
+from cekit.cache.url import UrlCache
+from cekit.config import Config
+from cekit.descriptor.resource import create_resource
+from cekit.errors import CekitError
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+
+def conditional(etag, content, last_modified=None):
+    """Route responding with 304 if the client has the file with the ETag"""
+
+    def respond(handler):
+        if etag and handler.headers.get("If-None-Match") == etag:
+            handler.respond(304, {"ETag": etag}, b"")
+            return
+
+        headers = {"ETag": etag} if etag else {}
+
+        if last_modified:
+            headers["Last-Modified"] = last_modified
+
+        handler.respond(200, headers, content)
+
+    return respond
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_unchanged_file_is_revalidated(work_dir):
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+        os.remove(destination)
+        UrlCache().fetch(server.url("/file"), destination)
+
+        assert [headers.get("If-None-Match") for _, headers in server.requests] == [
+            None,
+            '"v1"',
+        ]
+
+    assert read(destination) == b"content"
+
+
+def test_unchanged_file_is_revalidated_through_proxy(work_dir, proxy):
+    destination = os.path.join(work_dir, "file")
+    url = "http://cekit.test/file"
+
+    proxy.routes[url] = conditional('"v1"', b"content")
+
+    UrlCache().fetch(url, destination)
+    os.remove(destination)
+    UrlCache().fetch(url, destination)
+
+    assert [headers.get("If-None-Match") for _, headers in proxy.requests] == [
+        None,
+        '"v1"',
+    ]
+
+    assert read(destination) == b"content"
+
+
+def test_changed_file_is_downloaded(work_dir):
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+
+        server.routes["/file"] = conditional('"v2"', b"changed")
+        UrlCache().fetch(server.url("/file"), destination)
+
+        # New version is cached
+        UrlCache().fetch(server.url("/file"), destination)
+
+        assert server.requests[-1][1].get("If-None-Match") == '"v2"'
+
+    assert read(destination) == b"changed"
+
+
+def test_last_modified_is_used_for_revalidation(work_dir):
+    destination = os.path.join(work_dir, "file")
+    last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    with LocalHttpServer(
+        {"/file": conditional(None, b"content", last_modified)}
+    ) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+        UrlCache().fetch(server.url("/file"), destination)
+
+        assert server.requests[-1][1].get("If-Modified-Since") == last_modified
+
+
+def test_file_is_not_revalidated_within_ttl(work_dir):
+    config.cfg["common"]["url_cache_ttl"] = "3600"
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+        UrlCache().fetch(server.url("/file"), destination)
+
+        assert len(server.requests) == 1
+
+    assert read(destination) == b"content"
+
+
+def test_invalid_ttl(work_dir):
+    config.cfg["common"]["url_cache_ttl"] = "-1"
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), os.path.join(work_dir, "file"))
+
+        with pytest.raises(
+            CekitError, match="'common/url_cache_ttl' must be at least 0"
+        ):
+            UrlCache().fetch(server.url("/file"), os.path.join(work_dir, "file"))
+
+
+def test_modifying_destination_does_not_modify_cached_file(work_dir):
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+
+        with open(destination, "wb") as f:
+            f.write(b"modified")
+
+        UrlCache().fetch(server.url("/file"), destination)
+
+    assert read(destination) == b"content"
+
+
+def test_failed_download_keeps_cached_file(work_dir):
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": conditional('"v1"', b"content")}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+
+        server.routes["/file"] = (404, {}, b"")
+
+        with pytest.raises(CekitError):
+            UrlCache().fetch(server.url("/file"), destination)
+
+        server.routes["/file"] = conditional('"v1"', b"content")
+        UrlCache().fetch(server.url("/file"), destination)
+
+        assert server.requests[-1][1].get("If-None-Match") == '"v1"'
+
+
+def test_artifact_without_checksum_is_revalidated(work_dir):
+    target = os.path.join(work_dir, "artifact")
+
+    with LocalHttpServer({"/artifact": conditional('"v1"', b"content")}) as server:
+        for _ in range(2):
+            if os.path.exists(target):
+                os.remove(target)
+
+            create_resource({"url": server.url("/artifact")}).copy(target)
+
+        assert [headers.get("If-None-Match") for _, headers in server.requests] == [
+            None,
+            '"v1"',
+        ]
+
+    assert read(target) == b"content"
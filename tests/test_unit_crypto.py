@@ -0,0 +1,62 @@
+import builtins
+import hashlib
+
+from cekit import crypto
+
+
+def write_file(tmpdir, content):
+    path = str(tmpdir.join("artifact"))
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_get_sums_reads_file_once(tmpdir, mocker):
+    # Bigger than the read buffer so that multiple chunks are processed
+    content = b"a" * (crypto.READ_BUFFER_SIZE * 2 + 17)
+    path = write_file(tmpdir, content)
+
+    open_spy = mocker.patch.object(
+        crypto, "open", create=True, side_effect=builtins.open
+    )
+
+    checksums = crypto.get_sums(path, crypto.SUPPORTED_HASH_ALGORITHMS)
+
+    assert open_spy.call_count == 1
+    assert checksums == {
+        alg: hashlib.new(alg, content).hexdigest()
+        for alg in crypto.SUPPORTED_HASH_ALGORITHMS
+    }
+
+
+def test_get_sum(tmpdir):
+    path = write_file(tmpdir, b"")
+
+    assert crypto.get_sum(path, "md5") == "d41d8cd98f00b204e9800998ecf8427e"
+
+
+def test_check_sums(tmpdir):
+    path = write_file(tmpdir, b"")
+
+    assert crypto.check_sums(
+        path,
+        {
+            "md5": "D41D8CD98F00B204E9800998ECF8427E",
+            "sha1": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
+        },
+    )
+    assert not crypto.check_sums(
+        path, {"md5": "d41d8cd98f00b204e9800998ecf8427e", "sha1": "wrong"}
+    )
+
+
+def test_multi_hasher():
+    hasher = crypto.MultiHasher(["sha256", "md5", "md5"])
+    hasher.update(b"some")
+    hasher.update(b"content")
+
+    assert hasher.algorithms == ["sha256", "md5"]
+    assert hasher.hexdigests() == {
+        "sha256": hashlib.sha256(b"somecontent").hexdigest(),
+        "md5": hashlib.md5(b"somecontent").hexdigest(),
+    }
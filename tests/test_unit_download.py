@@ -0,0 +1,433 @@
+import hashlib
+import socket
+import threading
+import time
+
+import pytest
+
+from cekit.cache.lock import FileLock
+from cekit.config import Config
+from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from cekit.download import (
+    USER_AGENT,
+    DownloadClient,
+    RetryPolicy,
+    download_client,
+    reset_download_client,
+)
+from cekit.errors import CekitChecksumError, CekitError
+from cekit.tools import download_file
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+
+def setup_function(function):
+    config.cfg["common"] = {"work_dir": "/tmp"}
+    reset_download_client()
+
+
+pytestmark = pytest.mark.usefixtures("no_proxy")
+
+
+def test_connection_is_reused(tmpdir):
+    with LocalHttpServer(
+        {"/one": (200, {}, b"one"), "/two": (200, {}, b"two")}
+    ) as server:
+        download_file(server.url("/one"), str(tmpdir.join("one")))
+        download_file(server.url("/two"), str(tmpdir.join("two")))
+        download_file(server.url("/one"), str(tmpdir.join("three")))
+
+        assert server.connections == 1
+
+    assert tmpdir.join("one").read() == "one"
+    assert tmpdir.join("two").read() == "two"
+    assert tmpdir.join("three").read() == "one"
+
+
+def test_connection_is_not_reused_when_response_not_read():
+    with LocalHttpServer({"/file": (200, {}, b"content")}) as server:
+        client = DownloadClient()
+
+        client.open(client.request(server.url("/file"))).close()
+
+        with client.open(client.request(server.url("/file"))) as response:
+            assert response.read() == b"content"
+
+        assert server.connections == 2
+
+
+def test_reconnect_when_idle_connection_closed_by_server(tmpdir):
+    def close_connection(handler):
+        handler.respond(200, {}, b"content")
+        handler.close_connection = True
+
+    with LocalHttpServer({"/file": close_connection}) as server:
+        client = DownloadClient()
+
+        for _ in range(2):
+            with client.open(client.request(server.url("/file"))) as response:
+                assert response.read() == b"content"
+            # Make sure the server closes the connection before it is reused
+            time.sleep(0.1)
+
+        assert server.connections == 2
+
+
+def test_redirect_is_followed(tmpdir):
+    with LocalHttpServer(
+        {"/old": (302, {"Location": "/new"}, b""), "/new": (200, {}, b"moved")}
+    ) as server:
+        download_file(server.url("/old"), str(tmpdir.join("file")))
+
+        assert [path for path, _ in server.requests] == ["/old", "/new"]
+
+    assert tmpdir.join("file").read() == "moved"
+
+
+def test_too_many_redirects(tmpdir):
+    with LocalHttpServer({"/loop": (302, {"Location": "/loop"}, b"")}) as server:
+        with pytest.raises(CekitError, match="Too many redirects"):
+            download_file(server.url("/loop"), str(tmpdir.join("file")))
+
+
+def test_error_status_code(tmpdir):
+    with LocalHttpServer() as server:
+        with pytest.raises(CekitError, match="Could not download file from"):
+            download_file(server.url("/missing"), str(tmpdir.join("file")))
+
+
+def test_error_status_code_is_returned_through_proxy(proxy):
+    proxy.routes["http://cekit.test/file"] = (304, {"ETag": '"v1"'}, b"")
+
+    client = DownloadClient()
+
+    with client.open(client.request("http://cekit.test/file")) as response:
+        assert response.getcode() == 304
+        assert response.getheader("ETag") == '"v1"'
+
+    with client.open(client.request("http://cekit.test/missing")) as response:
+        assert response.getcode() == 404
+
+    assert [path for path, _ in proxy.requests] == [
+        "http://cekit.test/file",
+        "http://cekit.test/missing",
+    ]
+
+
+def test_authentication_and_user_agent(tmpdir):
+    config.cfg["common"]["url_authentication"] = "127.0.0.1#username:password"
+
+    with LocalHttpServer({"/file": (200, {}, b"content")}) as server:
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        headers = server.requests[0][1]
+
+    assert headers["Authorization"] == "Basic dXNlcm5hbWU6cGFzc3dvcmQ="
+    assert headers["User-Agent"] == USER_AGENT
+
+
+def test_read_timeout(tmpdir):
+    config.cfg["common"]["read_timeout"] = "1"
+
+    def stall(handler):
+        time.sleep(3)
+
+    with LocalHttpServer({"/stalled": stall}) as server:
+        with pytest.raises(socket.timeout):
+            download_file(server.url("/stalled"), str(tmpdir.join("file")))
+
+
+def test_client_is_shared_until_configuration_changes():
+    client = download_client()
+
+    assert download_client() is client
+    assert client.context.verify_mode.name == "CERT_NONE"
+
+    config.cfg["common"]["ssl_verify"] = True
+
+    assert download_client() is not client
+    assert download_client().context.verify_mode.name == "CERT_REQUIRED"
+
+
+def test_invalid_timeout():
+    config.cfg["common"]["connect_timeout"] = "soon"
+
+    with pytest.raises(CekitError, match="common/connect_timeout"):
+        download_client()
+
+
+def ranged(content, etag='"v1"', interrupt_after=None, accept_ranges=True, fail=None):
+    """Route serving the content, supporting range requests"""
+    state = {"interrupted": False}
+    headers = {"ETag": etag}
+
+    if accept_ranges:
+        headers["Accept-Ranges"] = "bytes"
+
+    def handler(handler):
+        range_header = handler.headers.get("Range")
+        if_range = handler.headers.get("If-Range")
+
+        if range_header and (if_range is None or if_range == etag):
+            start, _, end = range_header.split("=")[1].partition("-")
+            start, end = int(start), int(end or len(content) - 1)
+
+            if fail and fail(start):
+                handler.respond(503, {}, b"")
+                return
+
+            handler.respond(
+                206,
+                dict(
+                    headers,
+                    **{"Content-Range": f"bytes {start}-{end}/{len(content)}"},
+                ),
+                content[start : end + 1],
+            )
+            return
+
+        if interrupt_after and not state["interrupted"]:
+            state["interrupted"] = True
+            handler.send_response(200)
+            for name, value in headers.items():
+                handler.send_header(name, value)
+            handler.send_header("Content-Length", str(len(content)))
+            handler.end_headers()
+            handler.wfile.write(content[:interrupt_after])
+            handler.close_connection = True
+            return
+
+        handler.respond(200, headers, content)
+
+    return handler
+
+
+def partial_files(tmpdir):
+    return tmpdir.join("cache", "partial").listdir()
+
+
+def test_interrupted_download_is_resumed(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    content = b"0123456789" * 100
+
+    with LocalHttpServer({"/file": ranged(content, interrupt_after=300)}) as server:
+        with pytest.raises(CekitError, match="ended prematurely after 300 bytes"):
+            download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        assert not tmpdir.join("file").exists()
+        assert len(partial_files(tmpdir)) == 2
+
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        headers = server.requests[1][1]
+
+    assert headers["Range"] == "bytes=300-"
+    assert headers["If-Range"] == '"v1"'
+    assert tmpdir.join("file").read_binary() == content
+    assert partial_files(tmpdir) == []
+
+
+def test_partial_download_is_locked_for_other_processes(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer({"/file": (200, {}, b"content")}) as server:
+        key = hashlib.sha256(server.url("/file").encode("utf-8")).hexdigest()
+        # Separately opened lock file behaves as a lock held by another process
+        lock = FileLock(str(tmpdir.join("cache", "locks", f"partial-{key}")))
+
+        with lock:
+            thread = threading.Thread(
+                target=download_file,
+                args=(server.url("/file"), str(tmpdir.join("file"))),
+            )
+            thread.start()
+            thread.join(0.5)
+
+            assert thread.is_alive()
+            assert server.requests == []
+
+        thread.join()
+
+    assert tmpdir.join("file").read_binary() == b"content"
+
+
+def test_download_is_restarted_when_remote_file_changed(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer(
+        {"/file": ranged(b"old content", interrupt_after=3)}
+    ) as server:
+        with pytest.raises(CekitError):
+            download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        server.routes["/file"] = ranged(b"new content", etag='"v2"')
+
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+    assert tmpdir.join("file").read_binary() == b"new content"
+
+
+def test_download_is_restarted_through_proxy(tmpdir, proxy):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    url = "http://cekit.test/file"
+
+    proxy.routes[url] = ranged(b"old content", interrupt_after=3)
+
+    with pytest.raises(CekitError):
+        download_file(url, str(tmpdir.join("file")))
+
+    def satisfiable(handler):
+        if handler.headers.get("Range"):
+            handler.respond(416, {"Content-Range": "bytes */3"}, b"")
+        else:
+            handler.respond(200, {}, b"new")
+
+    proxy.routes[url] = satisfiable
+
+    download_file(url, str(tmpdir.join("file")))
+
+    assert tmpdir.join("file").read_binary() == b"new"
+
+
+def test_download_is_retried(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    config.cfg["common"]["download_retries"] = "http#1;127.0.0.1#3:0"
+    content = b"0123456789" * 100
+
+    with LocalHttpServer({"/file": ranged(content, interrupt_after=300)}) as server:
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        assert [headers.get("Range") for _, headers in server.requests] == [
+            None,
+            "bytes=300-",
+        ]
+
+    assert tmpdir.join("file").read_binary() == content
+
+
+def test_download_is_retried_on_transient_status_code(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    config.cfg["common"]["download_retries"] = "http#2:0"
+    responses = [(503, {}, b""), (200, {}, b"content")]
+
+    with LocalHttpServer(
+        {"/file": lambda handler: handler.respond(*responses.pop(0))}
+    ) as server:
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+    assert tmpdir.join("file").read_binary() == b"content"
+
+
+def test_download_is_not_retried_by_default(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer({"/file": (503, {}, b"")}) as server:
+        with pytest.raises(CekitError, match="status code: 503"):
+            download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        assert len(server.requests) == 1
+
+    assert partial_files(tmpdir) == []
+
+
+def test_invalid_retry_policy():
+    config.cfg["common"]["download_retries"] = "https#many"
+
+    with pytest.raises(CekitError, match="Invalid 'download_retries' policy 'many'"):
+        RetryPolicy.for_url("https://example.com/file")
+
+
+def segmented_content():
+    config.cfg["common"]["download_segments"] = "4"
+    config.cfg["common"]["download_segment_threshold"] = "1"
+
+    # Every segment contains different data
+    return b"".join(bytes([i]) * 1048576 for i in range(4)) + b"tail"
+
+
+def test_large_file_is_downloaded_in_segments(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    content = segmented_content()
+
+    with LocalHttpServer({"/file": ranged(content)}) as server:
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        ranges = sorted(str(headers.get("Range")) for _, headers in server.requests)
+
+    assert ranges == [
+        "None",
+        "bytes=1048577-2097153",
+        "bytes=2097154-3145730",
+        "bytes=3145731-4194307",
+    ]
+    assert tmpdir.join("file").read_binary() == content
+    assert partial_files(tmpdir) == []
+
+
+def test_segmented_download_falls_back_to_single_stream(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    content = segmented_content()
+
+    with LocalHttpServer({"/file": ranged(content, accept_ranges=False)}) as server:
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        assert len(server.requests) == 1
+
+    assert tmpdir.join("file").read_binary() == content
+
+
+def test_failed_segmented_download_is_resumed(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    content = segmented_content()
+
+    with LocalHttpServer(
+        {"/file": ranged(content, fail=lambda start: start > 2097152)}
+    ) as server:
+        with pytest.raises(CekitError):
+            download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        # First two segments were downloaded and are kept
+        assert (
+            tmpdir.join("cache", "partial")
+            .listdir(lambda path: path.ext == ".part")[0]
+            .size()
+            == 2097154
+        )
+
+        server.routes["/file"] = ranged(content)
+        download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        assert server.requests[-1][1]["Range"] == "bytes=2097154-"
+
+    assert tmpdir.join("file").read_binary() == content
+
+
+def test_checksums_are_computed_while_downloading(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    content = b"0123456789" * 100
+
+    with LocalHttpServer({"/file": ranged(content, interrupt_after=300)}) as server:
+        with pytest.raises(CekitError):
+            download_file(server.url("/file"), str(tmpdir.join("file")))
+
+        # Resumed download, already downloaded part is hashed too
+        checksums = download_file(server.url("/file"), str(tmpdir.join("file")))
+
+    assert checksums == {
+        algorithm: hashlib.new(algorithm, content).hexdigest()
+        for algorithm in SUPPORTED_HASH_ALGORITHMS
+    }
+
+
+def test_file_with_wrong_checksum_is_not_published(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer({"/file": ranged(b"content")}) as server:
+        with pytest.raises(CekitChecksumError):
+            download_file(
+                server.url("/file"), str(tmpdir.join("file")), {"md5": "123456"}
+            )
+
+    assert not tmpdir.join("file").exists()
+    assert partial_files(tmpdir) == []
@@ -0,0 +1,162 @@
+import os
+import subprocess
+
+import pytest
+import yaml
+
+from cekit.config import Config
+from cekit.generator.docker import DockerGenerator
+
+config = Config()
+
+MODULES = {
+    "modules/a": {
+        "name": "a",
+        "version": "1.0",
+        "modules": {"install": [{"name": "b"}]},
+    },
+    "modules/b": {"name": "b", "version": "1.0"},
+    "modules/b2": {"name": "b", "version": "2.0"},
+    "modules/c": {"name": "c", "version": "1.0"},
+    "other/d": {"name": "d", "version": "1.0"},
+}
+
+
+@pytest.fixture(autouse=True)
+def sparse_modules(work_dir, git_identity):
+    config.cfg["common"]["sparse_modules"] = True
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as file_:
+        file_.write(content)
+
+
+@pytest.fixture(name="repository")
+def fixture_repository(tmpdir):
+    repository = str(tmpdir.join("repository"))
+
+    for path, descriptor in MODULES.items():
+        write(os.path.join(repository, path, "module.yaml"), yaml.dump(descriptor))
+        write(os.path.join(repository, path, "install.sh"), "true")
+
+    write(os.path.join(repository, "tests", "features", "a.feature"), "Feature: a")
+
+    subprocess.run(["git", "-C", repository, "init", "-q"], check=True)
+    commit(repository)
+
+    return repository
+
+
+def commit(repository):
+    for command in [["add", "."], ["commit", "-q", "-m", "Modules"]]:
+        subprocess.run(["git", "-C", repository] + command, check=True)
+
+
+def generator(tmpdir, repositories, install):
+    image = {
+        "name": "test",
+        "version": "1.0",
+        "from": "centos:7",
+        "modules": {
+            "repositories": repositories,
+            "install": [{"name": name} for name in install],
+        },
+    }
+    write(str(tmpdir.join("image.yaml")), yaml.dump(image))
+
+    generator = DockerGenerator(
+        str(tmpdir.join("image.yaml")), str(tmpdir.join("target")), "", [], False
+    )
+    generator.init()
+
+    return generator
+
+
+def read(path):
+    with open(path, "r") as file_:
+        return file_.read()
+
+
+def extracted(tmpdir):
+    target = str(tmpdir.join("target", "repo", "repository"))
+
+    return sorted(
+        os.path.relpath(directory, target)
+        for directory, _, files in os.walk(target)
+        if files
+    )
+
+
+def test_only_required_modules_are_extracted(tmpdir, repository, caplog):
+    # Descriptors of modules which are not used are not loaded at all
+    write(os.path.join(repository, "broken", "module.yaml"), "name: [")
+    commit(repository)
+
+    generator(tmpdir, [{"git": {"url": repository, "ref": "HEAD"}}], ["a"])
+
+    assert extracted(tmpdir) == [
+        "modules/a",
+        "modules/b",
+        "modules/b2",
+        "tests/features",
+    ]
+    assert "Ignoring module descriptor 'broken/module.yaml'" in caplog.text
+
+
+def test_export_attributes_are_ignored(tmpdir, repository):
+    write(
+        os.path.join(repository, ".gitattributes"),
+        "tests/ export-ignore\nmodules/b/install.sh export-subst",
+    )
+    write(os.path.join(repository, "modules", "b", "install.sh"), "# $Format:%H$")
+    commit(repository)
+
+    generator(tmpdir, [{"git": {"url": repository, "ref": "HEAD"}}], ["a"])
+
+    target = str(tmpdir.join("target", "repo", "repository"))
+
+    assert "tests/features" in extracted(tmpdir)
+    assert read(os.path.join(target, "modules", "b", "install.sh")) == "# $Format:%H$"
+
+
+def test_all_modules_are_extracted_by_default(tmpdir, repository):
+    config.cfg["common"]["sparse_modules"] = False
+
+    generator(tmpdir, [{"git": {"url": repository, "ref": "HEAD"}}], ["a"])
+
+    assert "modules/c" in extracted(tmpdir)
+    assert "other/d" in extracted(tmpdir)
+
+
+def test_modules_are_extracted_on_demand(tmpdir, repository):
+    write(
+        str(tmpdir.join("local", "e", "module.yaml")),
+        yaml.dump(
+            {"name": "e", "version": "1.0", "modules": {"install": [{"name": "d"}]}}
+        ),
+    )
+
+    generator(
+        tmpdir,
+        [
+            {"path": str(tmpdir.join("local"))},
+            {"git": {"url": repository, "ref": "HEAD"}},
+        ],
+        ["e"],
+    )
+
+    assert extracted(tmpdir) == ["other/d", "tests/features"]
+
+
+def test_extracted_modules_are_installed(tmpdir, repository):
+    generator(
+        tmpdir, [{"git": {"url": repository, "ref": "HEAD"}}], ["a"]
+    ).copy_modules()
+
+    modules = str(tmpdir.join("target", "image", "modules"))
+
+    assert sorted(os.listdir(modules)) == ["a", "b"]
+    assert os.path.exists(os.path.join(modules, "b", "install.sh"))
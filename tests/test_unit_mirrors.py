@@ -0,0 +1,160 @@
+import json
+import time
+
+from cekit.config import Config
+from cekit.descriptor.resource import create_resource
+from cekit.download import reset_download_client
+from cekit.mirrors import (
+    MIRROR_MAX_BACKOFF,
+    MirrorStats,
+    cache_urls,
+    mirror_stats,
+    ordered_cache_urls,
+)
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+CONTENT_MD5 = "9a0364b9e99bb480dd25e1f0284c8555"
+
+
+def setup_function(function):
+    config.cfg["common"] = {"work_dir": "/tmp"}
+    reset_download_client()
+
+
+def test_cache_urls():
+    assert cache_urls() == []
+
+    config.cfg["common"]["cache_url"] = "http://one/#hash#"
+
+    assert cache_urls() == ["http://one/#hash#"]
+
+    config.cfg["common"]["cache_url"] = "http://one/#hash#\n  http://two/#hash#"
+
+    assert cache_urls() == ["http://one/#hash#", "http://two/#hash#"]
+
+
+def test_single_mirror_is_not_probed(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    config.cfg["common"]["cache_url"] = "http://127.0.0.1:1/#hash#"
+
+    assert ordered_cache_urls() == ["http://127.0.0.1:1/#hash#"]
+    assert not tmpdir.join("mirrors.json").exists()
+
+
+def test_mirrors_are_ordered_by_latency_and_health(tmpdir):
+    stats = MirrorStats(str(tmpdir.join("mirrors.json")))
+    mirrors = ["http://slow/", "http://unknown/", "http://fast/", "http://failing/"]
+
+    for mirror in mirrors:
+        stats.get(mirror)["probed_at"] = time.time()
+
+    stats.record("http://slow/", True, 2.0)
+    stats.record("http://fast/", True, 0.1)
+    stats.record("http://failing/", True, 0.01)
+    stats.record("http://failing/", False)
+
+    assert stats.ordered(mirrors) == [
+        "http://fast/",
+        "http://slow/",
+        "http://unknown/",
+        "http://failing/",
+    ]
+
+
+def test_mirrors_failing_often_are_demoted(tmpdir):
+    stats = MirrorStats(str(tmpdir.join("mirrors.json")))
+    mirrors = ["http://flaky/", "http://reliable/", "http://unknown/"]
+
+    for mirror in mirrors:
+        stats.get(mirror)["probed_at"] = time.time()
+
+    stats.record("http://reliable/", True, 1.0)
+    stats.record("http://flaky/", True, 0.1)
+
+    for _ in range(3):
+        stats.record("http://flaky/", False)
+    # Backoff expired, but the mirror still fails most of the requests
+    stats.get("http://flaky/")["failed_at"] -= MIRROR_MAX_BACKOFF + 1
+
+    assert stats.healthy("http://flaky/")
+    assert stats.ordered(mirrors) == [
+        "http://reliable/",
+        "http://unknown/",
+        "http://flaky/",
+    ]
+
+
+def test_failed_mirror_recovers_after_backoff(tmpdir):
+    stats = MirrorStats(str(tmpdir.join("mirrors.json")))
+
+    stats.record("http://mirror/", False)
+
+    assert not stats.healthy("http://mirror/")
+
+    stats.get("http://mirror/")["failed_at"] -= 61
+
+    assert stats.healthy("http://mirror/")
+
+
+def test_statistics_are_persisted(tmpdir):
+    path = str(tmpdir.join("mirrors.json"))
+
+    MirrorStats(path).record("http://mirror/", True, 0.5)
+
+    assert MirrorStats(path).get("http://mirror/")["latency"] == 0.5
+    assert (
+        json.loads(tmpdir.join("mirrors.json").read())["http://mirror/"]["error_rate"]
+        == 0.0
+    )
+
+
+def test_unreachable_mirror_is_skipped(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer({"/cache/artifact": (200, {}, b"content")}) as server:
+        unreachable = "http://127.0.0.1:1/cache/#filename#"
+        available = server.url("/cache/#filename#")
+        config.cfg["common"]["cache_url"] = f"{unreachable} {available}"
+
+        assert ordered_cache_urls() == [available, unreachable]
+        assert mirror_stats().get(unreachable)["failures"] == 1
+
+        res = create_resource(
+            {"name": "artifact", "url": "http://127.0.0.1:1/", "md5": CONTENT_MD5}
+        )
+        res.guarded_copy(str(tmpdir.join("artifact")))
+
+        # Mirror is probed first
+        assert [path for path, _ in server.requests] == ["/", "/cache/artifact"]
+
+    assert tmpdir.join("artifact").read_binary() == b"content"
+    assert tmpdir.join("mirrors.json").exists()
+
+
+def test_failing_mirror_fails_over(tmpdir, caplog):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer({"/good/artifact": (200, {}, b"content")}) as server:
+        bad = server.url("/bad/#filename#")
+        good = server.url("/good/#filename#")
+        config.cfg["common"]["cache_url"] = f"{bad} {good}"
+
+        # Both mirrors were probed already, configured order applies
+        for mirror in [bad, good]:
+            mirror_stats().get(mirror)["probed_at"] = time.time()
+
+        res = create_resource(
+            {"name": "artifact", "url": "http://127.0.0.1:1/", "md5": CONTENT_MD5}
+        )
+        res.guarded_copy(str(tmpdir.join("artifact")))
+
+        assert [path for path, _ in server.requests] == [
+            "/bad/artifact",
+            "/good/artifact",
+        ]
+
+        assert ordered_cache_urls() == [good, bad]
+
+    assert tmpdir.join("artifact").read_binary() == b"content"
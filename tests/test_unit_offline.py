@@ -0,0 +1,185 @@
+import hashlib
+import os
+
+import pytest
+
+from cekit import tools
+from cekit.cache.artifact import ArtifactCache
+from cekit.cache.discovery import discover_checksums
+from cekit.cache.url import UrlCache
+from cekit.config import Config
+from cekit.descriptor.resource import create_resource
+from cekit.download import OfflineError
+from cekit.errors import CekitError
+from cekit.mirrors import cache_urls
+from cekit.parallel import WorkerPool
+from cekit.tools import download_file
+from tests.utils import LocalHttpServer
+
+config = Config()
+
+CONTENT = b"content"
+MD5 = hashlib.md5(CONTENT).hexdigest()
+
+
+pytestmark = pytest.mark.usefixtures("work_dir", "no_proxy")
+
+
+def go_offline():
+    config.cfg["common"]["offline"] = True
+
+
+def test_offline_from_command_line():
+    config.configure("/dev/null", {"offline": True})
+
+    assert config.get_bool("common", "offline")
+
+
+def test_url_is_not_downloaded(tmpdir):
+    go_offline()
+
+    with LocalHttpServer({"/artifact": (200, {}, CONTENT)}) as server:
+        with pytest.raises(OfflineError, match="CEKit runs in offline mode"):
+            download_file(server.url("/artifact"), str(tmpdir.join("artifact")))
+
+        assert server.requests == []
+
+
+def test_local_file_is_copied(tmpdir):
+    go_offline()
+    source = tmpdir.join("source")
+    source.write_binary(CONTENT)
+
+    download_file(str(source), str(tmpdir.join("artifact")))
+
+    assert tmpdir.join("artifact").read_binary() == CONTENT
+
+
+def test_cached_artifact_is_used(tmpdir):
+    with LocalHttpServer({"/artifact": (200, {}, CONTENT)}) as server:
+        url = server.url("/artifact")
+        ArtifactCache().add(create_resource({"url": url, "md5": MD5}))
+
+        go_offline()
+        create_resource({"url": url, "md5": MD5}).copy(str(tmpdir.join("artifact")))
+
+        assert len(server.requests) == 1
+
+    assert tmpdir.join("artifact").read_binary() == CONTENT
+
+
+def test_missing_artifacts_are_reported_together(tmpdir, caplog):
+    go_offline()
+    artifacts = [
+        create_resource({"url": "http://127.0.0.1:1/one", "md5": MD5}),
+        create_resource({"url": "http://127.0.0.1:1/two"}),
+        create_resource({"name": "plain", "md5": MD5}),
+    ]
+
+    with pytest.raises(
+        CekitError, match="Processing of 3 artifacts failed: 'one', 'two', 'plain'"
+    ):
+        WorkerPool(4).map(
+            lambda artifact: artifact.copy(str(tmpdir)),
+            artifacts,
+            describe=lambda artifact: f"'{artifact.name}'",
+            what="artifacts",
+        )
+
+    assert "Resource 'one' is not available locally" in caplog.text
+    assert "Resource 'two' is not available locally" in caplog.text
+
+
+def test_cacher_mirrors_are_not_used():
+    config.cfg["common"]["cache_url"] = "http://cache/#hash#"
+
+    assert cache_urls() == ["http://cache/#hash#"]
+
+    go_offline()
+
+    assert cache_urls() == []
+
+
+def test_cached_url_is_not_revalidated(work_dir):
+    destination = os.path.join(work_dir, "file")
+
+    with LocalHttpServer({"/file": (200, {"ETag": '"v1"'}, CONTENT)}) as server:
+        UrlCache().fetch(server.url("/file"), destination)
+        os.remove(destination)
+
+        go_offline()
+        UrlCache().fetch(server.url("/file"), destination)
+
+        with pytest.raises(OfflineError, match="is not cached"):
+            UrlCache().fetch(server.url("/other"), destination)
+
+        assert len(server.requests) == 1
+
+    with open(destination, "rb") as file_:
+        assert file_.read() == CONTENT
+
+
+def test_recorded_checksums_are_used():
+    with LocalHttpServer({"/artifact": (200, {"ETag": '"v1"'}, CONTENT)}) as server:
+        discover_checksums(server.url("/artifact"))
+        requests = len(server.requests)
+
+        go_offline()
+
+        assert discover_checksums(server.url("/artifact"))["md5"] == MD5
+
+        with pytest.raises(OfflineError, match="cannot be looked up in offline mode"):
+            discover_checksums(server.url("/other"))
+
+        assert len(server.requests) == requests
+
+
+def test_remote_git_repository_is_not_cloned(tmpdir, mocker):
+    go_offline()
+    run = mocker.patch("cekit.cache.git.run_wrapper")
+
+    resource = create_resource(
+        {"git": {"url": "https://github.com/cekit/example", "ref": "main"}}
+    )
+
+    with pytest.raises(
+        OfflineError,
+        match="Resource 'example' is not available locally: Repository .* is not mirrored",
+    ):
+        resource.copy(str(tmpdir))
+
+    run.assert_not_called()
+
+
+def test_local_git_repository_is_cloned(tmpdir, mocker):
+    go_offline()
+    run = mocker.patch("cekit.cache.git.run_wrapper")
+    repository = str(tmpdir.mkdir("repository"))
+
+    with pytest.raises(CekitError):
+        create_resource({"git": {"url": repository, "ref": "main"}}).copy(
+            str(tmpdir.join("target"))
+        )
+
+    assert run.call_args_list[0][0][0][:4] == ["git", "clone", "--mirror", "--quiet"]
+    assert run.call_args_list[0][0][0][4] == repository
+
+
+def test_brew_is_not_called(mocker):
+    go_offline()
+    run = mocker.patch("subprocess.run")
+
+    with pytest.raises(OfflineError, match="in Brew"):
+        tools.get_brew_url("aa")
+
+    run.assert_not_called()
+
+
+def test_skopeo_is_not_called(mocker):
+    go_offline()
+    run = mocker.patch("subprocess.run")
+
+    with pytest.raises(OfflineError, match="with skopeo"):
+        tools.get_latest_image_version("registry.example.com/image:1")
+
+    run.assert_not_called()
@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+
+from cekit.config import Config
+from cekit.errors import CekitError
+from cekit.parallel import (
+    RateLimiter,
+    SingleFlight,
+    WorkerPool,
+    fetch_workers,
+    fetch_workers_per_host,
+)
+
+config = Config()
+
+
+def setup_function(function):
+    config.cfg["common"] = {"work_dir": "/tmp"}
+
+
+def test_results_are_returned_in_order():
+    def slow_first(item):
+        if item == 0:
+            time.sleep(0.1)
+        return item * 2
+
+    assert WorkerPool(4).map(slow_first, list(range(10))) == [
+        item * 2 for item in range(10)
+    ]
+
+
+def test_items_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    # Would time out if the items were processed one by one
+    WorkerPool(3).map(lambda item: barrier.wait(), [1, 2, 3])
+
+
+def test_items_in_same_group_run_sequentially():
+    processed = []
+
+    def record(item):
+        group, position = item
+        if position == 0:
+            time.sleep(0.1)
+        processed.append(item)
+
+    items = [("a", 0), ("b", 0), ("a", 1), ("a", 2)]
+
+    WorkerPool(4).map(record, items, group=lambda item: item[0])
+
+    assert [item for item in processed if item[0] == "a"] == [
+        ("a", 0),
+        ("a", 1),
+        ("a", 2),
+    ]
+
+
+def test_concurrency_is_limited_per_host():
+    lock = threading.Lock()
+    running = {"current": 0, "max": 0}
+
+    def work(item):
+        with lock:
+            running["current"] += 1
+            running["max"] = max(running["max"], running["current"])
+        time.sleep(0.05)
+        with lock:
+            running["current"] -= 1
+
+    WorkerPool(4, per_host=1).map(work, list(range(6)), host=lambda _: "host")
+
+    assert running["max"] == 1
+
+
+def test_single_failure_is_reraised():
+    def fail(item):
+        if item == 2:
+            raise CekitError("Artifact is broken")
+
+    with pytest.raises(CekitError, match="Artifact is broken"):
+        WorkerPool(4).map(fail, [1, 2, 3])
+
+
+def test_all_failures_are_reported(caplog):
+    processed = []
+
+    def fail(item):
+        processed.append(item)
+        if item in ["a", "c"]:
+            raise CekitError(f"Artifact {item} is broken")
+
+    with pytest.raises(CekitError) as excinfo:
+        WorkerPool(4).map(
+            fail, ["a", "b", "c"], describe=lambda item: f"'{item}'", what="artifacts"
+        )
+
+    assert str(excinfo.value) == "Processing of 2 artifacts failed: 'a', 'c'"
+    assert sorted(processed) == ["a", "b", "c"]
+    assert "Processing of 'a' failed: Artifact a is broken" in caplog.text
+    assert "Processing of 'c' failed: Artifact c is broken" in caplog.text
+
+
+def test_failure_skips_rest_of_group():
+    processed = []
+
+    def fail(item):
+        processed.append(item)
+        if item == "a":
+            raise CekitError("Artifact is broken")
+
+    with pytest.raises(CekitError):
+        WorkerPool(1).map(fail, ["a", "b"], group=lambda _: "target")
+
+    assert processed == ["a"]
+
+
+def test_fetch_workers_configuration():
+    assert fetch_workers() == 4
+    assert fetch_workers_per_host() == 4
+
+    config.cfg["common"]["fetch_workers"] = "8"
+
+    assert fetch_workers() == 8
+    assert fetch_workers_per_host() == 8
+
+    config.cfg["common"]["fetch_workers_per_host"] = "2"
+
+    assert fetch_workers_per_host() == 2
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "many"])
+def test_fetch_workers_invalid_configuration(value):
+    config.cfg["common"]["fetch_workers"] = value
+
+    with pytest.raises(CekitError, match="Configuration key 'common/fetch_workers'"):
+        fetch_workers()
+
+
+def test_no_items():
+    assert WorkerPool(4).map(lambda item: item, []) == []
+
+
+def test_single_flight_shares_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    results = WorkerPool(4).map(lambda _: flight.do("key", fetch), list(range(4)))
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        raise CekitError("Fetching failed")
+
+    with pytest.raises(CekitError):
+        WorkerPool(4).map(lambda _: flight.do("key", fetch), list(range(4)))
+
+    assert len(calls) == 1
+
+
+def test_single_flight_executes_subsequent_calls():
+    flight = SingleFlight()
+
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.do("other", lambda: 3) == 3
+
+
+def test_rate_limiter_limits_rate():
+    limiter = RateLimiter(1000)
+    start = time.monotonic()
+
+    # First second worth of work is allowed as a burst
+    WorkerPool(4).map(lambda _: limiter.consume(500), list(range(4)))
+
+    assert 0.9 < time.monotonic() - start < 2
@@ -1,5 +1,6 @@
 import logging
 import os
+import time
 from urllib.request import Request
 
 import pytest
@@ -8,27 +9,24 @@ import yaml
 from cekit.config import Config
 from cekit.descriptor import Image, Overrides
 from cekit.descriptor.resource import create_resource
+from cekit.download import reset_download_client
 from cekit.errors import CekitError
-
-try:
-    from unittest.mock import call
-except ImportError:
-    from mock import call
+from tests.utils import LocalHttpServer
 
 config = Config()
 
 
 def setup_function(function):
     config.cfg["common"] = {"work_dir": "/tmp"}
+    reset_download_client()
 
     if os.path.exists("file"):
         os.remove("file")
 
 
 def test_repository_dir_is_constructed_properly(mocker):
-    mocker.patch("subprocess.run")
     mocker.patch("os.path.isdir", ret="True")
-    mocker.patch("cekit.descriptor.resource.Chdir", autospec=True)
+    mocker.patch("cekit.cache.git.GitMirror.checkout")
 
     res = create_resource(
         {"git": {"url": "http://host.com/url/repo.git", "ref": "ref"}}
@@ -38,9 +36,8 @@ def test_repository_dir_is_constructed_properly(mocker):
 
 
 def test_repository_dir_uses_name_if_defined(mocker):
-    mocker.patch("subprocess.run")
     mocker.patch("os.path.isdir", ret="True")
-    mocker.patch("cekit.descriptor.resource.Chdir", autospec=True)
+    mocker.patch("cekit.cache.git.GitMirror.checkout")
 
     res = create_resource(
         {
@@ -52,9 +49,8 @@ def test_repository_dir_uses_name_if_defined(mocker):
 
 
 def test_repository_dir_uses_target_if_defined(mocker):
-    mocker.patch("subprocess.run")
     mocker.patch("os.path.isdir", ret="True")
-    mocker.patch("cekit.descriptor.resource.Chdir", autospec=True)
+    mocker.patch("cekit.cache.git.GitMirror.checkout")
 
     res = create_resource(
         {
@@ -66,33 +62,16 @@ def test_repository_dir_uses_target_if_defined(mocker):
 
 
 def test_git_clone(mocker):
-    mock = mocker.patch("subprocess.run")
     mocker.patch("os.path.isdir", ret="True")
-    mocker.patch("cekit.descriptor.resource.Chdir", autospec=True)
+    checkout = mocker.patch("cekit.cache.git.GitMirror.checkout", autospec=True)
 
     res = create_resource(
         {"git": {"url": "http://host.com/url/path.git", "ref": "ref"}}
     )
     res.copy("dir")
-    mock.assert_has_calls(
-        [
-            call(
-                ["git", "clone", "http://host.com/url/path.git", "dir/path"],
-                stdout=None,
-                stderr=None,
-                check=True,
-                universal_newlines=True,
-            ),
-            call(
-                ["git", "checkout", "ref"],
-                stdout=None,
-                stderr=None,
-                check=True,
-                universal_newlines=True,
-            ),
-        ],
-        any_order=True,
-    )
+
+    checkout.assert_called_once_with(mocker.ANY, "ref", "dir/path")
+    assert checkout.call_args[0][0].url == "http://host.com/url/path.git"
 
 
 def get_res(mocker):
@@ -114,7 +93,7 @@ def get_mock_urlopen(mocker):
 
 
 def get_mock_ssl(mocker, ctx):
-    return mocker.patch("cekit.tools.ssl.create_default_context", return_value=ctx)
+    return mocker.patch("cekit.download.ssl.create_default_context", return_value=ctx)
 
 
 def test_fetching_with_ssl_verify(mocker):
@@ -236,10 +215,21 @@ def test_generated_url_without_cacher():
 
 
 def test_resource_verify(mocker):
-    mock = mocker.patch("cekit.descriptor.resource.check_sum")
+    mock = mocker.patch("cekit.descriptor.resource.check_sums")
     res = create_resource({"url": "dummy", "sha256": "justamocksum"})
     res._Resource__verify("dummy")
-    mock.assert_called_with("dummy", "sha256", "justamocksum")
+    mock.assert_called_with("dummy", {"sha256": "justamocksum"})
+
+
+def test_resource_verify_multiple_checksums_at_once(mocker):
+    mock = mocker.patch("cekit.descriptor.resource.check_sums")
+    res = create_resource(
+        {"url": "dummy", "sha256": "justamocksum", "md5": "anothermocksum"}
+    )
+    res._Resource__verify("dummy")
+    mock.assert_called_once_with(
+        "dummy", {"sha256": "justamocksum", "md5": "anothermocksum"}
+    )
 
 
 def test_generated_url_with_cacher():
@@ -286,19 +276,17 @@ def test_path_local_non_existing_resource_with_cacher_use(mocker):
 
     res.guarded_copy("target")
 
-    download_file_mock.assert_called_with("/foo/bar", "target")
+    download_file_mock.assert_called_with("/foo/bar", "target", True)
 
 
 def test_url_resource_download_cleanup_after_failure(mocker, tmpdir, caplog):
     caplog.set_level(logging.DEBUG, logger="cekit")
-
-    mocker.patch("os.path.exists", return_value=False)
-    mocker.patch("os.makedirs")
-    os_remove_mock = mocker.patch("os.remove")
+    config.cfg["common"]["work_dir"] = str(tmpdir)
 
     urlopen_class_mock = mocker.patch("cekit.tools.urlopen")
     urlopen_mock = urlopen_class_mock.return_value
     urlopen_mock.getcode.return_value = 200
+    urlopen_mock.getheader.return_value = None
     urlopen_mock.read.side_effect = Exception
 
     res = create_resource({"url": "http://server.org/dummy", "sha256": "justamocksum"})
@@ -311,12 +299,15 @@ def test_url_resource_download_cleanup_after_failure(mocker, tmpdir, caplog):
     assert "Error copying resource: 'dummy'. See logs for more info" in str(
         excinfo.value
     )
-    assert f"Removing incompletely downloaded '{targetfile}' file" in caplog.text
 
     request: Request = urlopen_class_mock.call_args[0][0]
     urlopen_class_mock.assert_called_with(request, context=mocker.ANY)
     assert request.get_full_url() == "http://server.org/dummy"
-    os_remove_mock.assert_called_with(targetfile)
+
+    # Server does not support resuming the download, nothing to keep
+    assert "Removing incompletely downloaded" in caplog.text
+    assert not os.path.exists(targetfile)
+    assert os.listdir(os.path.join(str(tmpdir), "cache", "partial")) == []
 
 
 def test_copy_plain_resource_with_cacher(mocker, tmpdir):
@@ -327,6 +318,7 @@ def test_copy_plain_resource_with_cacher(mocker, tmpdir):
     mock_urlopen = urlopen_class_mock.return_value
     mock_urlopen.getcode.return_value = 200
     mock_urlopen.read.side_effect = [b"one", b"two", None]
+    mock_urlopen.getheader.return_value = None
 
     ctx = get_ctx(mocker)
     get_mock_ssl(mocker, ctx)
@@ -356,6 +348,7 @@ def test_copy_plain_resource_from_brew(mocker, tmpdir):
     mock_urlopen = urlopen_class_mock.return_value
     mock_urlopen.getcode.return_value = 200
     mock_urlopen.read.side_effect = [b"one", b"two", None]
+    mock_urlopen.getheader.return_value = None
 
     ctx = get_ctx(mocker)
     get_mock_ssl(mocker, ctx)
@@ -436,3 +429,67 @@ def test_fetching_file_with_authentication(mocker):
     mock_urlopen.assert_called_with(request, context=ctx)
     assert request.get_full_url() == "http://dummy.com"
     assert request.get_header("Authorization") == "Basic dXNlcm5hbWU6cGFzc3dvcmQ="
+
+
+CONTENT_MD5 = "9a0364b9e99bb480dd25e1f0284c8555"
+
+
+def test_url_resource_hedged_fetch_from_slow_cacher(tmpdir, caplog):
+    caplog.set_level(logging.DEBUG, logger="cekit")
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+    config.cfg["common"]["fetch_hedge_delay"] = "1"
+
+    def slow(handler):
+        time.sleep(5)
+        handler.respond(200, {}, b"content")
+
+    with LocalHttpServer({"/cacher": slow, "/direct": (200, {}, b"content")}) as server:
+        config.cfg["common"]["cache_url"] = server.url("/cacher")
+
+        res = create_resource(
+            {"name": "artifact", "url": server.url("/direct"), "md5": CONTENT_MD5}
+        )
+
+        start = time.monotonic()
+        res.guarded_copy(str(tmpdir.join("artifact")))
+
+    assert time.monotonic() - start < 5
+    assert tmpdir.join("artifact").read_binary() == b"content"
+    assert "takes more than 1 seconds, trying url too" in caplog.text
+    assert "Artifact 'artifact' fetched from url in" in caplog.text
+
+
+def test_url_resource_cacher_with_wrong_content(tmpdir, caplog):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer(
+        {"/cacher": (200, {}, b"corrupted"), "/direct": (200, {}, b"content")}
+    ) as server:
+        config.cfg["common"]["cache_url"] = server.url("/cacher")
+
+        res = create_resource(
+            {"name": "artifact", "url": server.url("/direct"), "md5": CONTENT_MD5}
+        )
+        res.guarded_copy(str(tmpdir.join("artifact")))
+
+        assert [path for path, _ in server.requests] == ["/cacher", "/direct"]
+
+    assert tmpdir.join("artifact").read_binary() == b"content"
+    assert "Could not fetch artifact 'artifact' from cacher" in caplog.text
+    assert sorted(path.basename for path in tmpdir.listdir()) == ["artifact", "cache"]
+
+
+def test_url_resource_all_sources_fail(tmpdir):
+    config.cfg["common"]["work_dir"] = str(tmpdir)
+
+    with LocalHttpServer() as server:
+        config.cfg["common"]["cache_url"] = server.url("/cacher")
+
+        res = create_resource(
+            {"name": "artifact", "url": server.url("/direct"), "md5": CONTENT_MD5}
+        )
+
+        with pytest.raises(CekitError, match="Error copying resource: 'artifact'"):
+            res.guarded_copy(str(tmpdir.join("artifact")))
+
+        assert len(server.requests) == 2
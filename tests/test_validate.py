@@ -16,6 +16,7 @@ from cekit.config import Config
 from cekit.descriptor import Repository
 from cekit.generator import base
 from cekit.tools import Chdir
+from tests.utils import fake_checksums
 
 odcs_fake_resp = b"""Result:
 {u'arches': u'x86_64',
@@ -821,15 +822,15 @@ def test_run_override_artifact_with_custom_override_destination(tmpdir):
 
 def test_run_override_artifact_with_custom_override_example1(tmpdir, mocker, caplog):
     # Ignore checksum verification.
-    mocker.patch("cekit.crypto.get_sum", return_value="123456")
-    mocker.patch("cekit.cache.artifact.get_sum", return_value="123456")
+    mocker.patch("cekit.crypto.get_sums", side_effect=fake_checksums)
+    mocker.patch("cekit.cache.artifact.get_sums", side_effect=fake_checksums)
 
     cache_id = uuid.uuid4()
     mocker.patch("uuid.uuid4", return_value=cache_id)
 
     work_dir = str(tmpdir.mkdir("work_dir"))
     image_dir = str(tmpdir.mkdir("source"))
-    os.makedirs(work_dir + "/cache")
+    os.makedirs(work_dir + "/cache/blobs/incoming")
 
     with open(os.path.join(image_dir, "bar2222.jar"), "w") as fd:
         fd.write("foo")
@@ -841,7 +842,9 @@ def test_run_override_artifact_with_custom_override_example1(tmpdir, mocker, cap
         fd.write("cache_url = #filename#\n")
         fd.write("work_dir = " + work_dir + "\n")
 
-    with open(os.path.join(work_dir, "cache", str(cache_id)), "w") as fd:
+    with open(
+        os.path.join(work_dir, "cache", "blobs", "incoming", str(cache_id)), "w"
+    ) as fd:
         fd.write("jar-content")
 
     img_desc = image_descriptor.copy()
@@ -893,8 +896,8 @@ def test_run_override_artifact_with_custom_override_example1(tmpdir, mocker, cap
 
 def test_run_override_artifact_with_custom_override_example2(tmpdir, mocker, caplog):
     # Ignore checksum verification.
-    mocker.patch("cekit.crypto.get_sum", return_value="123456")
-    mocker.patch("cekit.cache.artifact.get_sum", return_value="123456")
+    mocker.patch("cekit.crypto.get_sums", side_effect=fake_checksums)
+    mocker.patch("cekit.cache.artifact.get_sums", side_effect=fake_checksums)
 
     cache_id = uuid.uuid4()
     mocker.patch("uuid.uuid4", return_value=cache_id)
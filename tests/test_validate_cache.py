@@ -1,12 +1,20 @@
+import hashlib
+import io
+import json
 import os
 import re
 import sys
+import tarfile
+import time
 
 import pytest
+import yaml
 from click.testing import CliRunner
 
+from cekit.cache.bundle import zstandard
 from cekit.cache.cli import cli
 from cekit.crypto import SUPPORTED_HASH_ALGORITHMS
+from tests.utils import LocalHttpServer
 
 
 def test_cekit_cache_ls(tmpdir):
@@ -206,3 +214,490 @@ def run_cekit_cache(args, return_code=0, i=None):
     assert result.exit_code == return_code
 
     return result
+
+
+def test_cekit_cache_path(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    digest = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+    run_cekit_cache(["--work-dir", work_dir, "path", digest], 1)
+
+    artifact = os.path.join(work_dir, "artifact")
+    open(artifact, "a").close()
+
+    run_cekit_cache(["--work-dir", work_dir, "add", artifact, "--sha256", digest])
+
+    result = run_cekit_cache(["--work-dir", work_dir, "path", digest])
+
+    assert result.output.strip() == os.path.join(
+        work_dir, "cache", "blobs", "sha256", digest
+    )
+
+
+def test_cekit_cache_gc_requires_limit(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+
+    result = run_cekit_cache(["--work-dir", work_dir, "gc"], 2)
+
+    assert "At least one of --max-size or --max-age is required" in result.output
+
+
+def test_cekit_cache_gc_keeps_pinned_artifacts(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    artifact = os.path.join(work_dir, "artifact")
+    open(artifact, "a").close()
+
+    result = run_cekit_cache(
+        [
+            "--work-dir",
+            work_dir,
+            "add",
+            artifact,
+            "--md5",
+            "d41d8cd98f00b204e9800998ecf8427e",
+        ]
+    )
+    artifact_uuid = re.search(r"\'(.*)\'$", result.output).group(1)
+
+    run_cekit_cache(["--work-dir", work_dir, "pin", artifact_uuid])
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    assert "pinned: true" in result.output
+    assert "hits: 0" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "gc", "--max-age", "0"])
+
+    assert artifact_uuid not in result.output
+
+    run_cekit_cache(["--work-dir", work_dir, "unpin", artifact_uuid])
+
+    result = run_cekit_cache(["--work-dir", work_dir, "gc", "--max-age", "0"])
+
+    assert f"Artifact with UUID '{artifact_uuid}' evicted" in result.output
+    assert (
+        "No artifacts cached!" in run_cekit_cache(["--work-dir", work_dir, "ls"]).output
+    )
+
+
+def test_cekit_cache_gc_invalid_size(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+
+    result = run_cekit_cache(["--work-dir", work_dir, "gc", "--max-size", "big"], 2)
+
+    assert "Invalid size 'big'" in result.output
+
+
+def test_cekit_cache_prefetch(tmpdir, caplog):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    content = {"/a": b"a", "/b": b"b", "/c": b"c", "/d": b"d"}
+
+    with LocalHttpServer(
+        {path: (200, {}, body) for path, body in content.items()}
+    ) as server:
+
+        def artifact(path, checksum=True):
+            descriptor = {"name": path[1:], "url": server.url(path)}
+
+            if checksum:
+                descriptor["md5"] = hashlib.md5(content[path]).hexdigest()
+
+            return descriptor
+
+        descriptors = []
+
+        for name, artifacts in [
+            ("first", [artifact("/a"), artifact("/b")]),
+            ("second", [artifact("/a"), artifact("/c", checksum=False)]),
+        ]:
+            descriptors.append(str(tmpdir.join(f"{name}.yaml")))
+
+            with open(descriptors[-1], "w") as fd:
+                yaml.dump(
+                    {
+                        "name": f"test/{name}",
+                        "version": "1.0",
+                        "from": "centos:7",
+                        "artifacts": artifacts,
+                    },
+                    fd,
+                )
+
+        result = run_cekit_cache(
+            [
+                "--work-dir",
+                work_dir,
+                "prefetch",
+                "--descriptor",
+                descriptors[0],
+                "--descriptor",
+                descriptors[1],
+                "--overrides",
+                json.dumps({"artifacts": [artifact("/d")]}),
+            ]
+        )
+
+        assert sorted(path for path, _ in server.requests) == ["/a", "/b", "/d"]
+
+    assert "3 artifact(s) cached" in result.output
+    assert "Artifact 'c' does not define any checksum" in caplog.text
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    for name in ["a", "b", "d"]:
+        assert f"- {name}" in result.output
+
+
+def test_cekit_cache_prefetch_failure(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    descriptor = str(tmpdir.join("image.yaml"))
+
+    with LocalHttpServer() as server:
+        with open(descriptor, "w") as fd:
+            yaml.dump(
+                {
+                    "name": "test/image",
+                    "version": "1.0",
+                    "from": "centos:7",
+                    "artifacts": [
+                        {"name": "missing", "url": server.url("/missing"), "md5": "123"}
+                    ],
+                },
+                fd,
+            )
+
+        result = run_cekit_cache(
+            ["--work-dir", work_dir, "prefetch", "--descriptor", descriptor], 1
+        )
+
+    assert "Cannot cache artifacts" in result.output
+
+
+def test_cekit_cache_add_manifest(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    artifacts = {}
+
+    for name in ["a", "b", "c"]:
+        artifacts[name] = str(tmpdir.join(name))
+
+        with open(artifacts[name], "w") as fd:
+            fd.write(name)
+
+    def digest(name, alg="md5"):
+        return hashlib.new(alg, name.encode()).hexdigest()
+
+    run_cekit_cache(
+        ["--work-dir", work_dir, "add", artifacts["a"], "--md5", digest("a")]
+    )
+
+    manifest = str(tmpdir.join("manifest.yaml"))
+
+    with open(manifest, "w") as fd:
+        yaml.dump(
+            [
+                # Already cached, under a different checksum
+                {"location": artifacts["a"], "sha256": digest("a", "sha256")},
+                {"location": artifacts["b"], "md5": digest("b")},
+                {"location": artifacts["c"], "sha1": digest("c", "sha1")},
+                # Same artifact referenced twice is added once
+                {"location": artifacts["c"], "md5": digest("c")},
+            ],
+            fd,
+        )
+
+    result = run_cekit_cache(["--work-dir", work_dir, "add", "--manifest", manifest])
+
+    assert "2 artifact(s) added, 2 already cached, 0 failed" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    assert result.output.count("sha512:") == 3
+
+
+def test_cekit_cache_add_manifest_json_lines_with_failure(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    artifact = str(tmpdir.join("artifact"))
+
+    with open(artifact, "w") as fd:
+        fd.write("a")
+
+    manifest = str(tmpdir.join("manifest.jsonl"))
+
+    with open(manifest, "w") as fd:
+        fd.write(
+            json.dumps({"location": artifact, "md5": hashlib.md5(b"a").hexdigest()})
+            + "\n"
+        )
+        fd.write(
+            json.dumps({"location": str(tmpdir.join("missing")), "md5": "123"}) + "\n"
+        )
+
+    result = run_cekit_cache(["--work-dir", work_dir, "add", "--manifest", manifest], 1)
+
+    assert "Cannot cache artifact" in result.output
+    assert "1 artifact(s) added, 0 already cached, 1 failed" in result.output
+
+
+@pytest.mark.parametrize(
+    "content, message",
+    [
+        ('{"md5": "123"}\n', "Entry 1 of manifest '{}' does not define location"),
+        (
+            "- location: /some/path\n",
+            "Entry 1 of manifest '{}' does not define any checksum",
+        ),
+        ("location: /some/path\n", "Manifest '{}' must contain a list of artifacts"),
+    ],
+)
+def test_cekit_cache_add_invalid_manifest(tmpdir, content, message):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    manifest = str(tmpdir.join("manifest"))
+
+    with open(manifest, "w") as fd:
+        fd.write(content)
+
+    result = run_cekit_cache(["--work-dir", work_dir, "add", "--manifest", manifest], 1)
+
+    assert message.format(manifest) in result.output
+
+
+def test_cekit_cache_add_manifest_with_location(tmpdir):
+    result = run_cekit_cache(
+        ["--work-dir", str(tmpdir), "add", "location", "--manifest", "manifest"], 2
+    )
+
+    assert "cannot be used together with --manifest" in result.output
+
+
+def test_cekit_cache_verify(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    blobs_dir = os.path.join(work_dir, "cache", "blobs", "sha256")
+
+    for name in ["good", "corrupted", "missing"]:
+        artifact = str(tmpdir.join(name))
+
+        with open(artifact, "w") as fd:
+            fd.write(name)
+
+        run_cekit_cache(
+            [
+                "--work-dir",
+                work_dir,
+                "add",
+                artifact,
+                "--md5",
+                hashlib.md5(name.encode()).hexdigest(),
+            ]
+        )
+
+    def blob(name):
+        return os.path.join(blobs_dir, hashlib.sha256(name.encode()).hexdigest())
+
+    os.chmod(blob("corrupted"), 0o644)
+
+    with open(blob("corrupted"), "w") as fd:
+        fd.write("broken")
+
+    os.remove(blob("missing"))
+
+    orphan = os.path.join(blobs_dir, hashlib.sha256(b"orphan").hexdigest())
+
+    with open(orphan, "w") as fd:
+        fd.write("orphan")
+
+    # Recent unknown files may be just added by another process
+    recent = os.path.join(blobs_dir, hashlib.sha256(b"recent").hexdigest())
+
+    with open(recent, "w") as fd:
+        fd.write("recent")
+
+    os.utime(orphan, (time.time() - 7200, time.time() - 7200))
+
+    result = run_cekit_cache(
+        ["--work-dir", work_dir, "verify", "--workers", "2", "--max-rate", "1M"], 1
+    )
+
+    assert f"Cached file '{blob('corrupted')}' of artifact(s)" in result.output
+    assert f"is missing its cached file '{blob('missing')}'" in result.output
+    assert f"Cached file '{orphan}' does not belong to any artifact" in result.output
+    assert recent not in result.output
+    assert "Verified 3 artifact(s), found 3 problem(s)" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "verify", "--repair"])
+
+    assert "Verified 3 artifact(s), found 3 problem(s), repaired" in result.output
+    assert sorted(
+        name.split(".")[0]
+        for name in os.listdir(os.path.join(work_dir, "cache", "quarantine"))
+    ) == sorted([os.path.basename(blob("corrupted")), os.path.basename(orphan)])
+
+    result = run_cekit_cache(["--work-dir", work_dir, "verify"])
+
+    assert "Verified 1 artifact(s), found 0 problem(s)" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    assert "- good" in result.output
+    assert "- corrupted" not in result.output
+
+
+def add_artifacts(tmpdir, work_dir, names):
+    for name in names:
+        artifact = str(tmpdir.join(name))
+
+        with open(artifact, "w") as fd:
+            fd.write(name)
+
+        run_cekit_cache(
+            [
+                "--work-dir",
+                work_dir,
+                "add",
+                artifact,
+                "--md5",
+                hashlib.md5(name.encode()).hexdigest(),
+            ]
+        )
+
+
+@pytest.mark.parametrize(
+    "bundle",
+    [
+        "bundle.tar",
+        "bundle.tar.gz",
+        "bundle.tar.xz",
+        pytest.param(
+            "bundle.tar.zst",
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard module is not installed"
+            ),
+        ),
+    ],
+)
+def test_cekit_cache_export_import(tmpdir, bundle):
+    source = str(tmpdir.mkdir("source"))
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    bundle = str(tmpdir.join(bundle))
+
+    add_artifacts(tmpdir, source, ["a", "b"])
+    add_artifacts(tmpdir, work_dir, ["b"])
+
+    result = run_cekit_cache(["--work-dir", source, "export", "-o", bundle])
+
+    assert f"2 artifact(s) exported to '{bundle}'" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "import", bundle])
+
+    assert "1 artifact(s) imported, 1 already cached" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    assert "- a" in result.output
+    assert "- b" in result.output
+    assert result.output.count("sha512:") == 2
+    assert (
+        "md5: {}".format(hashlib.md5(b"a").hexdigest()) in result.output
+    ), "All checksums are imported"
+
+    run_cekit_cache(["--work-dir", work_dir, "verify"])
+
+
+def test_cekit_cache_export_by_descriptor(tmpdir):
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    bundle = str(tmpdir.join("bundle.tar"))
+    descriptor = str(tmpdir.join("image.yaml"))
+
+    add_artifacts(tmpdir, work_dir, ["a", "b"])
+
+    with open(descriptor, "w") as fd:
+        yaml.dump(
+            {
+                "name": "test/image",
+                "version": "1.0",
+                "from": "centos:7",
+                "artifacts": [
+                    {"name": "a", "md5": hashlib.md5(b"a").hexdigest()},
+                    {"name": "c", "md5": hashlib.md5(b"c").hexdigest()},
+                ],
+            },
+            fd,
+        )
+
+    result = run_cekit_cache(
+        ["--work-dir", work_dir, "export", "-o", bundle, "--descriptor", descriptor]
+    )
+
+    assert "1 artifact(s) exported" in result.output
+
+    with tarfile.open(bundle) as tar:
+        assert tar.getnames() == [
+            "index.json",
+            "blobs/sha256/" + hashlib.sha256(b"a").hexdigest(),
+        ]
+
+
+def test_cekit_cache_import_corrupted_bundle(tmpdir):
+    source = str(tmpdir.mkdir("source"))
+    work_dir = str(tmpdir.mkdir("work_dir"))
+    bundle = str(tmpdir.join("bundle.tar"))
+
+    add_artifacts(tmpdir, source, ["a"])
+    run_cekit_cache(["--work-dir", source, "export", "-o", bundle])
+
+    with open(bundle, "r+b") as fd:
+        content = fd.read()
+        fd.seek(content.index(b"a\0"))
+        fd.write(b"x")
+
+    result = run_cekit_cache(["--work-dir", work_dir, "import", bundle], 1)
+
+    assert "does not match its" in result.output
+
+    result = run_cekit_cache(["--work-dir", work_dir, "ls"])
+
+    assert "No artifacts cached!" in result.output
+
+
+def test_cekit_cache_import_not_a_bundle(tmpdir):
+    bundle = str(tmpdir.join("bundle.tar"))
+
+    with tarfile.open(bundle, "w") as tar:
+        tar.add(__file__, arcname="file.py")
+
+    result = run_cekit_cache(["--work-dir", str(tmpdir), "import", bundle], 1)
+
+    assert "is not a CEKit cache bundle" in result.output
+
+
+@pytest.mark.parametrize(
+    "artifact, message",
+    [
+        ({"names": ["a"], "md5": hashlib.md5(b"a").hexdigest()}, "lacks the sha256"),
+        (
+            {"names": ["a"], "sha256": hashlib.sha256(b"a").hexdigest(), "md5": "../x"},
+            "invalid md5 checksum",
+        ),
+        ({"names": ["a"], "sha256": "a/../../b"}, "invalid sha256 checksum"),
+        ({"names": "a", "sha256": hashlib.sha256(b"a").hexdigest()}, "invalid names"),
+    ],
+)
+def test_cekit_cache_import_invalid_bundle_index(tmpdir, artifact, message):
+    bundle = str(tmpdir.join("bundle.tar"))
+    index = json.dumps({"version": 1, "artifacts": [artifact]}).encode("utf-8")
+
+    with tarfile.open(bundle, "w") as tar:
+        info = tarfile.TarInfo("index.json")
+        info.size = len(index)
+        tar.addfile(info, io.BytesIO(index))
+
+    result = run_cekit_cache(["--work-dir", str(tmpdir), "import", bundle], 1)
+
+    assert message in result.output
+
+
+def test_cekit_cache_serve_invalid_bind(tmpdir):
+    result = run_cekit_cache(
+        ["--work-dir", str(tmpdir), "serve", "--bind", "localhost"], 2
+    )
+
+    assert "Invalid address 'localhost'" in result.output
@@ -1,4 +1,7 @@
+import threading
 from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 
 def merge_dicts(*dict_args):
@@ -14,3 +17,92 @@ def merge_dicts(*dict_args):
     for dictionary in dict_args:
         result.update(dictionary)
     return result
+
+
+def fake_checksums(target, algorithms):
+    """
+    Replacement for the cekit.crypto.get_sums() function returning
+    the same, fake, checksum for every requested algorithm.
+    """
+    return {algorithm: "123456" for algorithm in algorithms}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super(_Handler, self).setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, self.headers))
+
+        route = self.server.routes.get(self.path)
+
+        if route is None:
+            self.respond(404, {}, b"")
+        elif callable(route):
+            route(self)
+        else:
+            self.respond(*route)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def respond(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalHttpServer(object):
+    """
+    HTTP server running in a background thread, used to test downloads.
+
+    Responses are defined by routes, a dictionary where the key is the request
+    path and the value is a (status, headers, body) tuple or a callable taking
+    the request handler as the argument.
+    """
+
+    def __init__(self, routes=None):
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.routes = routes or {}
+        self._server.requests = []
+        self._server.connections = 0
+        self._server.lock = threading.Lock()
+
+    @property
+    def routes(self):
+        return self._server.routes
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    @property
+    def connections(self):
+        return self._server.connections
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self._server.server_address[1], path)
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()